@@ -1,461 +1,668 @@
-import json
+import time
+
+STARTED_AT = time.perf_counter()
+
+import multiprocessing
 import os
-import re
+import sys
+import threading
+from bisect import bisect_left, bisect_right
 
 import flet as ft
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
-from reportlab.lib.units import mm
-from reportlab.pdfbase.cidfonts import UnicodeCIDFont
-from reportlab.pdfbase import pdfmetrics
-from reportlab.pdfbase.ttfonts import TTFont
-from reportlab.platypus import (
-    BaseDocTemplate,
-    Frame,
-    NextPageTemplate,
-    PageTemplate,
-    Paragraph,
-    Spacer,
-    Table,
-    TableStyle,
-)
-
-RUBY_PATTERN = re.compile(r"\{(.+?)\}\((.+?)\)")
-
-
-def normalize_ruby(text: str) -> str:
-    return RUBY_PATTERN.sub(r"\1(\2)", text)
-
-
-def parse_blocks(text: str):
-    blocks = []
-    for raw_line in text.splitlines():
-        line = raw_line.rstrip()
-        stripped = line.strip()
-        if not stripped:
-            blocks.append(("blank", ""))
-        elif stripped.startswith("# "):
-            blocks.append(("heading", stripped[2:].strip()))
-        elif stripped.startswith(">"):
-            blocks.append(("quote", stripped[1:].strip()))
-        elif stripped.startswith("{{") and stripped.endswith("}}"):
-            blocks.append(("ho", stripped[2:-2].strip()))
-        elif stripped.startswith(":::secret") and stripped.endswith(":::"):
-            body = stripped[len(":::secret") : -3].strip()
-            blocks.append(("secret", body or "(secret)"))
-        else:
-            blocks.append(("paragraph", stripped))
-    return blocks
+
+import profiling
+from diagnostics import DiagnosticsPanel
+from document import PieceTable
+from image_cache import preview_image
+from live_preview import LivePreviewPipeline
+from export_worker import ExportJob, PdfExportWorker
+from history import EditHistory, FieldValues
+from project_journal import ProjectJournal, is_journal_project, read_journal_project, text_delta
+from project_store import read_project, resolve_image_path, write_project
+from search_index import MAX_HITS, SearchIndex
+from workspace import DocumentView, ProjectSession, Workspace
 
 
 def main(page: ft.Page):
     page.title = "Shinobi-Writer (v0.3)"
     page.theme_mode = ft.ThemeMode.LIGHT
     page.padding = 10
-    page.window_width = 1600
-    page.window_height = 920
+    page.window.width = 1600
+    page.window.height = 920
     page.bgcolor = "#f6f6f6"
 
-    pdf_font_name = "Helvetica"
-
-    font_candidates = [
-        "C:\\Windows\\Fonts\\meiryo.ttc",
-        "C:\\Windows\\Fonts\\msgothic.ttc",
-        "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
-        "/usr/share/fonts/opentype/noto/NotoSerifCJK-Regular.ttc",
-        "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
-        "/Library/Fonts/Arial Unicode.ttf",
-    ]
-
-    for candidate in font_candidates:
-        if os.path.exists(candidate):
-            try:
-                pdfmetrics.registerFont(TTFont("Japanese", candidate))
-                pdf_font_name = "Japanese"
-                break
-            except Exception:
-                continue
-
-    if pdf_font_name != "Japanese":
-        try:
-            pdfmetrics.registerFont(UnicodeCIDFont("HeiseiKakuGo-W5"))
-            pdf_font_name = "HeiseiKakuGo-W5"
-        except Exception:
-            pass
-
-    current_img_path = ""
-    current_project_path = ""
+    # タブごとのプロジェクト。本文は各タブの document が正、表示中のタブのタイトルだけは入力欄が正
+    workspace = Workspace(lambda: DocumentView(scroll_to_line))
+    active_view = None
+    last_jump_line = 0
+    # 検索結果 (文書内の位置) と、それを出した時の (表示, 索引の版, 検索語)
+    search_hits = []
+    search_key = None
+    last_hit = -1
+    page_estimator = None
+    editor_focused = False
+    # 入力欄が表示した値。Ctrl+Z/Y の後に届いた変更がそのどれかに戻っていれば、クライアント (Flutter) 側の取り消し
+    field_values = FieldValues()
+    # アプリの履歴で戻した後のカーソル位置
+    undo_caret = None
+    switch_lock = threading.Lock()
 
     def toast(message: str, color: str = "#2e7d32"):
-        page.snack_bar = ft.SnackBar(ft.Text(message), bgcolor=color)
-        page.snack_bar.open = True
-        page.update()
+        page.show_dialog(ft.SnackBar(ft.Text(message), bgcolor=color))
 
     def get_editor_text() -> str:
-        return editor_field.value or ""
-
-    def get_styles():
-        base = getSampleStyleSheet()["BodyText"]
-        base.fontName = pdf_font_name
-        base.fontSize = 10
-        base.leading = 14
-
-        heading = ParagraphStyle(
-            "HeadingStyle",
-            parent=base,
-            fontSize=13,
-            leading=18,
-            textColor=colors.HexColor("#111111"),
-            backColor=colors.HexColor("#f4f4f4"),
-            borderPadding=(6, 8, 6),
-            leftIndent=0,
-            borderWidth=0,
-        )
-        quote = ParagraphStyle(
-            "QuoteStyle",
-            parent=base,
-            backColor=colors.HexColor("#eeeeee"),
-            textColor=colors.HexColor("#222222"),
-            borderPadding=(6, 8, 6),
-            leftIndent=6,
-            rightIndent=6,
-        )
-        normal = ParagraphStyle("NormalStyle", parent=base)
-        return heading, quote, normal
-
-    def build_story(text: str):
-        heading_style, quote_style, normal_style = get_styles()
-        story = [NextPageTemplate("Later")]
-        for block_type, body in parse_blocks(text):
-            body = normalize_ruby(body)
-            if block_type == "blank":
-                story.append(Spacer(1, 4 * mm))
-            elif block_type == "heading":
-                heading_tbl = Table(
-                    [[Paragraph(f"<b>{body}</b>", heading_style)]],
-                    colWidths=[170 * mm],
-                )
-                heading_tbl.setStyle(
-                    TableStyle(
-                        [
-                            ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f4f4f4")),
-                            ("TEXTCOLOR", (0, 0), (-1, -1), colors.HexColor("#111111")),
-                            ("BOX", (0, 0), (-1, -1), 0.5, colors.HexColor("#dadada")),
-                            ("LEFTPADDING", (0, 0), (-1, -1), 6),
-                            ("RIGHTPADDING", (0, 0), (-1, -1), 6),
-                            ("TOPPADDING", (0, 0), (-1, -1), 6),
-                            ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                        ]
-                    )
-                )
-                story.extend([heading_tbl, Spacer(1, 3 * mm)])
-            elif block_type == "quote":
-                story.extend([Paragraph(body, quote_style), Spacer(1, 2 * mm)])
-            elif block_type == "ho":
-                ho_tbl = Table([[Paragraph(f"HO: <b>{body}</b>", normal_style)]], colWidths=[170 * mm])
-                ho_tbl.setStyle(
-                    TableStyle(
-                        [
-                            ("BOX", (0, 0), (-1, -1), 1, colors.HexColor("#555555")),
-                            ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f7f7f7")),
-                            ("LEFTPADDING", (0, 0), (-1, -1), 8),
-                            ("RIGHTPADDING", (0, 0), (-1, -1), 8),
-                            ("TOPPADDING", (0, 0), (-1, -1), 6),
-                            ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                        ]
-                    )
-                )
-                story.extend([ho_tbl, Spacer(1, 2 * mm)])
-            elif block_type == "secret":
-                secret_tbl = Table([[Paragraph(f"SECRET: {body}", normal_style)]], colWidths=[170 * mm])
-                secret_tbl.setStyle(
-                    TableStyle(
-                        [
-                            ("BOX", (0, 0), (-1, -1), 1, colors.HexColor("#333333")),
-                            ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#eeeeee")),
-                            ("LEFTPADDING", (0, 0), (-1, -1), 8),
-                            ("RIGHTPADDING", (0, 0), (-1, -1), 8),
-                            ("TOPPADDING", (0, 0), (-1, -1), 6),
-                            ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
-                        ]
-                    )
-                )
-                story.extend([secret_tbl, Spacer(1, 2 * mm)])
-            else:
-                story.extend([Paragraph(body, normal_style), Spacer(1, 2 * mm)])
-        return story
-
-    def save_project(path: str):
-        nonlocal current_project_path
-        data = {
-            "title": title_field.value or "",
-            "text_content": get_editor_text(),
-            "header_image_path": current_img_path,
-        }
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        current_project_path = path
-        project_path_label.value = os.path.basename(path)
+        # 入力欄は章単位のこともあるので、全文は常に document から取る
+        return workspace.active.text()
+
+    def session_state(session: ProjectSession):
+        # 自動保存スレッドからも呼ばれる。表示中のタブのタイトルだけは入力欄から読む
+        with switch_lock:
+            title = title_field.value or "" if session is workspace.active else session.title
+        return title, session.text(), session.img_path
+
+    def current_state():
+        return session_state(workspace.active)
+
+    def on_journal_error(err):
+        toast(f"自動保存失敗: {err}", "#b71c1c")
+
+    def on_preview_error(err):
+        toast(f"プレビュー更新失敗: {err}", "#b71c1c")
+
+    def open_journal(session: ProjectSession, path: str, state, compact: bool):
+        # state はディスク上の内容。これと画面の差分が次の自動保存で追記される
+        close_journal(session)
+        session.journal = ProjectJournal(path, *state, on_error=on_journal_error)
+        if compact:
+            session.journal.compact()
+        session.journal.start_autosave(lambda: session_state(session))
+
+    def close_journal(session: ProjectSession):
+        if session.journal is not None:
+            session.journal.close(session_state(session))
+            session.journal = None
+
+    def close_all_journals():
+        for session in list(workspace.sessions):
+            close_journal(session)
+
+    def update_project_label(suffix: str = ""):
+        session = workspace.active
+        project_path_label.value = (os.path.basename(session.path) if session.path else "未保存") + suffix
         project_path_label.update()
 
-    def load_project(path: str):
-        nonlocal current_img_path, current_project_path
-        with open(path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-        title_field.value = data.get("title", "")
-        editor_field.value = data.get("text_content", "")
-        current_img_path = data.get("header_image_path", "")
-
-        if current_img_path and os.path.exists(current_img_path):
-            img_preview.src = current_img_path
+    def update_memory_label():
+        memory_label.value = (
+            f"タブ {len(workspace.sessions)} / キャッシュ {workspace.memory_usage() / 1048576:.1f}"
+            f" / {workspace.memory_limit / 1048576:.0f} MB"
+        )
+        memory_label.update()
+
+    def refresh_tabs():
+        tabs_bar.tabs = [ft.Tab(label=session.display_name()) for session in workspace.sessions]
+        project_tabs.length = len(workspace.sessions)
+        project_tabs.selected_index = workspace.sessions.index(workspace.active)
+        project_tabs.update()
+
+    def set_project_path(session: ProjectSession, path: str):
+        session.path = path
+        if session is workspace.active:
+            update_project_label()
+        refresh_tabs()
+
+    def show_header_image(img_path: str):
+        if img_path:
+            img_preview.src = preview_image(img_path)
             img_preview.visible = True
-            img_info.value = os.path.basename(current_img_path)
+            img_info.value = os.path.basename(img_path)
         else:
-            current_img_path = ""
             img_preview.src = ""
             img_preview.visible = False
             img_info.value = "画像未選択"
-
-        current_project_path = path
-        project_path_label.value = os.path.basename(path)
-        title_field.update()
-        editor_field.update()
         img_preview.update()
         img_info.update()
-        project_path_label.update()
-        update_toc(None)
-        update_preview()
 
-    def handle_project_save(e: ft.FilePickerResultEvent):
-        if e.path:
+    def switch_to(session: ProjectSession):
+        # 表示中のタブを書き戻してから session を表示する。解析結果がキャッシュに残っていれば作り直さない
+        nonlocal active_view
+        with switch_lock:
+            previous = workspace.active
+            if previous is not None and previous is not session:
+                previous.title = title_field.value or ""
+            workspace.active = session
+            title_field.value = session.title
+            show_visible_text(session)
+        active_view = workspace.view_for(session)
+        live_preview.bind(active_view.parser, active_view.preview, active_view.toc)
+        preview_slot.content = active_view.preview.view
+        toc_slot.content = active_view.toc.view
+        show_header_image(session.img_path)
+        update_project_label()
+        refresh_tabs()
+        page.update()
+        refresh_editor_views()
+        workspace.trim()
+        update_memory_label()
+
+    def new_tab():
+        switch_to(workspace.add(ProjectSession()))
+
+    def close_tab():
+        session = workspace.active
+        index = workspace.sessions.index(session)
+        try:
+            close_journal(session)
+        except Exception as err:
+            toast(f"保存失敗: {err}", "#b71c1c")
+            return
+        workspace.remove(session)
+        if not workspace.sessions:
+            workspace.add(ProjectSession())
+        # 閉じたタブの内容は書き戻さない
+        switch_to(workspace.sessions[min(index, len(workspace.sessions) - 1)])
+
+    def on_tab_change(e):
+        index = e.control.selected_index
+        if 0 <= index < len(workspace.sessions) and workspace.sessions[index] is not workspace.active:
+            switch_to(workspace.sessions[index])
+
+    def tab_for_load() -> ProjectSession:
+        # 何も書いていない表示中のタブは使い回し、それ以外は新しいタブで開く
+        session = workspace.active
+        if session.path or session.journal is not None or session.img_path or any(current_state()[:2]):
+            session = workspace.add(ProjectSession())
+        return session
+
+    def save_project(path: str, session: ProjectSession = None) -> bool:
+        # 読み込み中のタブは保存先を控えるだけで False を返す (読み終わった後に load_journal_project が保存する)
+        session = session or workspace.active
+        other = workspace.find(path)
+        if other is not None and other is not session:
+            raise RuntimeError("このファイルは別のタブで開いています")
+        if session.hold_save(path):
+            return False
+        with profiling.span("save_project"):
+            if not is_journal_project(path):
+                # JSON は従来形式の書き出し。ジャーナル形式で開いている間は現在のプロジェクトを切り替えない
+                write_project(path, *session_state(session))
+                if session.journal is None:
+                    set_project_path(session, path)
+                return True
+            if session.journal is not None and session.journal.path == path:
+                session.journal.record(*session_state(session))
+            else:
+                open_journal(session, path, session_state(session), compact=True)
+        set_project_path(session, path)
+        return True
+
+    def apply_project_data(session: ProjectSession, path: str, data: dict):
+        img_path = resolve_image_path(path, data["header_image_path"])
+        session.title = data["title"]
+        session.document = PieceTable(data["text_content"])
+        session.section = None
+        session.history = EditHistory()
+        session.img_path = img_path if img_path and os.path.exists(img_path) else ""
+        session.path = path
+        switch_to(session)
+
+    def load_project(path: str):
+        with profiling.span("load_project"):
+            data = read_project(path)
+        apply_project_data(tab_for_load(), path, data)
+
+    def load_journal_project(path: str):
+        # 裏スレッドで読む。ジャーナルが空なら先頭の章を先に表示し、残りは読み終わってから末尾に足す
+        session = None
+        head_len = None
+
+        def show_head(data):
+            nonlocal session, head_len
+            head_len = len(data["text_content"])
+            session = tab_for_load()
+            session.begin_load()
+            apply_project_data(session, path, data)
+            update_project_label(" (読込中...)")
+
+        try:
+            with profiling.span("load_project"):
+                data = read_journal_project(path, on_head=show_head)
+        except Exception as err:
+            if session is not None and session.finish_load():
+                toast(f"読込失敗のため保存しませんでした: {err}", "#b71c1c")
+            else:
+                toast(f"読込失敗: {err}", "#b71c1c")
+            return
+
+        text = data["text_content"]
+        if session is None:
+            session = tab_for_load()
+            session.begin_load()
+            apply_project_data(session, path, data)
+        elif len(text) > head_len:
+            # 読込中に別のタブへ切り替えていても、そのタブの document の末尾に足すだけで済む
+            with session.lock:
+                session.document.apply(len(session.document), 0, text[head_len:])
+                if session is workspace.active:
+                    show_visible_text(session)
+                    editor_field.update()
+            if session is workspace.active:
+                refresh_editor_views()
+        if session is workspace.active:
+            update_project_label()
+        open_journal(session, path, (data["title"], text, session.img_path), compact=data["needs_compact"])
+        update_memory_label()
+        if data["replayed"]:
+            toast(f"未保存の編集 {data['replayed']} 件を復元しました: {path}")
+        else:
+            toast(f"プロジェクト読込: {path}")
+        # 読込中に押された保存は、開いたジャーナル (ディスクの内容と揃った状態) に対して行う
+        pending = session.finish_load()
+        if pending:
             try:
-                save_project(e.path)
-                toast(f"プロジェクト保存: {e.path}")
+                save_project(pending, session)
+                toast(f"上書き保存: {pending}")
             except Exception as err:
                 toast(f"保存失敗: {err}", "#b71c1c")
 
-    def handle_project_load(e: ft.FilePickerResultEvent):
-        if e.files:
+    async def ask_save_project(extension: str):
+        path = await file_picker.save_file(file_name=f"{title_field.value or 'project'}.{extension}")
+        if path:
             try:
-                load_project(e.files[0].path)
-                toast(f"プロジェクト読込: {e.files[0].path}")
+                if save_project(path):
+                    toast(f"プロジェクト保存: {path}")
+                else:
+                    toast("読込が終わってから保存します", "#424242")
+            except Exception as err:
+                toast(f"保存失敗: {err}", "#b71c1c")
+
+    async def ask_load_project():
+        files = await file_picker.pick_files(allow_multiple=False, file_type=ft.FilePickerFileType.CUSTOM, allowed_extensions=["shinobi", "json"])
+        if files:
+            path = files[0].path
+            opened = workspace.find(path)
+            if opened is not None:
+                switch_to(opened)
+                toast(f"既に開いています: {path}", "#424242")
+                return
+            if is_journal_project(path):
+                threading.Thread(target=load_journal_project, args=(path,), name="project-load", daemon=True).start()
+                return
+            try:
+                load_project(path)
+                toast(f"プロジェクト読込: {path}")
             except Exception as err:
                 toast(f"読込失敗: {err}", "#b71c1c")
 
-    def on_img_picked(e: ft.FilePickerResultEvent):
-        nonlocal current_img_path
-        if e.files:
-            file_path = e.files[0].path
-            current_img_path = file_path
-            img_preview.src = file_path
-            img_preview.visible = True
-            img_info.value = os.path.basename(file_path)
-            img_info.update()
-            img_preview.update()
-            update_preview()
-
-    def save_pdf_file(path: str):
-        doc = BaseDocTemplate(
-            path,
-            pagesize=A4,
-            leftMargin=12 * mm,
-            rightMargin=12 * mm,
-            topMargin=12 * mm,
-            bottomMargin=12 * mm,
-        )
-        width, height = A4
-
-        first_frame = Frame(
-            12 * mm,
-            15 * mm,
-            width - 24 * mm,
-            height - 120 * mm,
-            id="first_frame",
-        )
-        gap = 6 * mm
-        col_w = (width - 24 * mm - gap) / 2
-        later_frame_l = Frame(12 * mm, 15 * mm, col_w, height - 27 * mm, id="col_left")
-        later_frame_r = Frame(12 * mm + col_w + gap, 15 * mm, col_w, height - 27 * mm, id="col_right")
-
-        def draw_first_page(c, _):
-            c.saveState()
-            c.setFillColor(colors.white)
-            c.rect(0, 0, width, height, fill=1, stroke=0)
-            y = height - 15 * mm
-            if current_img_path and os.path.exists(current_img_path):
-                try:
-                    img_w = width - 24 * mm
-                    img_h = 70 * mm
-                    c.drawImage(current_img_path, 12 * mm, y - img_h, width=img_w, height=img_h, preserveAspectRatio=True, anchor='n')
-                    y -= img_h + 8 * mm
-                except Exception:
-                    pass
-            c.setFillColor(colors.HexColor("#111111"))
-            c.setFont(pdf_font_name, 22)
-            c.drawString(15 * mm, y, title_field.value or "No Title")
-            c.restoreState()
-
-        def draw_later_page(c, _):
-            c.saveState()
-            c.setFillColor(colors.white)
-            c.rect(0, 0, width, height, fill=1, stroke=0)
-            c.restoreState()
-
-        doc.addPageTemplates(
-            [
-                PageTemplate(id="First", frames=[first_frame], onPage=draw_first_page),
-                PageTemplate(id="Later", frames=[later_frame_l, later_frame_r], onPage=draw_later_page),
-            ]
-        )
+    async def ask_header_image():
+        files = await file_picker.pick_files(allow_multiple=False, file_type=ft.FilePickerFileType.CUSTOM, allowed_extensions=["png", "jpg", "jpeg"])
+        if files:
+            file_path = files[0].path
+            workspace.active.img_path = file_path
+            show_header_image(file_path)
+            refresh_editor_views()
 
-        story = build_story(get_editor_text())
-        doc.build(story)
+    def on_export_event(kind: str, job: ExportJob, value):
+        if kind == "started":
+            export_status.value = "PDF作成中..."
+        elif kind == "page":
+            export_status.value = f"PDF作成中... {value}ページ"
+        elif kind == "superseded":
+            return
+        else:
+            export_status.value = ""
+            if kind == "done":
+                toast(f"PDF保存 ({value}): {job.path}" if value else f"PDF保存: {job.path}")
+            elif kind == "cancelled":
+                toast("PDF出力をキャンセルしました", "#424242")
+            else:
+                toast(f"PDF保存失敗: {value}", "#b71c1c")
+        export_cancel_button.visible = pdf_worker.busy
+        export_status.update()
+        export_cancel_button.update()
+
+    pdf_worker = PdfExportWorker(on_export_event)
+
+    async def ask_save_pdf():
+        path = await file_picker.save_file(file_name=f"{title_field.value or 'output'}.pdf")
+        if path:
+            pdf_worker.submit(
+                ExportJob(
+                    path=path,
+                    title=title_field.value or "",
+                    text=get_editor_text(),
+                    img_path=workspace.active.img_path,
+                    profile=profiling.is_enabled(),
+                    engine=engine_dropdown.value or "",
+                )
+            )
+            export_status.value = "PDF出力待ち..."
+            export_cancel_button.visible = True
+            export_status.update()
+            export_cancel_button.update()
+
+    def show_visible_text(session: ProjectSession):
+        # 章単位の編集中は、その章の分だけをクライアントに送る
+        start, end = session.visible_range()
+        editor_field.value = session.document.slice(start, end)
+        field_values.seen(editor_field.value)
+        editor_field.label = f"章: {session.section[2] or '(冒頭)'}" if session.section is not None else None
+        section_switch.value = session.section is not None
+
+    def bind_section(line_index):
+        session = workspace.active
+        # 見出しの位置は最後の解析結果から取るので、先に解析を追いつかせる
+        refresh_editor_views()
+        outline = active_view.outline
+        start_line, end_line, title = outline.section_at(line_index)
+        start = outline.line_offset(start_line)
+        session.section = (start, outline.line_offset(end_line) - start, title)
+        show_visible_text(session)
+        editor_field.update()
+        section_switch.update()
+        toast(f"章単位で編集: {title or '(冒頭)'}", "#424242")
+
+    def unbind_section():
+        session = workspace.active
+        session.section = None
+        show_visible_text(session)
+        editor_field.update()
+        section_switch.update()
+
+    def on_section_switch(e):
+        if e.control.value:
+            bind_section(last_jump_line)
+        else:
+            unbind_section()
+
+    async def ask_save_handouts():
+        path = await file_picker.save_file(file_name=f"{title_field.value or 'output'}-handouts.zip")
+        if not path:
+            return
+        title, text, _ = current_state()
+        engine = engine_dropdown.value or ""
+
+        def run():
+            # ReportLab を読み込むのでここで import する
+            from handouts import export_handouts
 
-    def save_pdf(e: ft.FilePickerResultEvent):
-        if e.path:
             try:
-                save_pdf_file(e.path)
-                toast(f"PDF保存: {e.path}")
+                results = export_handouts(path, title, text, engine=engine)
             except Exception as err:
-                toast(f"PDF保存失敗: {err}", "#b71c1c")
+                toast(f"ハンドアウト出力失敗: {err}", "#b71c1c")
+                return
+            failed = [r for r in results if not r["ok"]]
+            if failed:
+                toast(f"ハンドアウト {len(results) - len(failed)}/{len(results)} 件 (失敗: {failed[0]['error']}): {path}", "#b71c1c")
+            else:
+                toast(f"ハンドアウト {len(results)} 件を保存: {path}")
+
+        toast("ハンドアウトを書き出しています...", "#424242")
+        threading.Thread(target=run, name="handout-export", daemon=True).start()
 
     def scroll_to_line(line_index):
+        nonlocal last_jump_line
+        last_jump_line = line_index
+        if workspace.active.section is not None:
+            bind_section(line_index)
+            return
+        offset = active_view.outline.line_offset(line_index)
+        page.run_task(select_in_editor, offset, offset)
         toast(f"行ジャンプ: {line_index + 1}行目", "#424242")
 
-    def update_toc(_):
-        toc_view.controls.clear()
-        lines = get_editor_text().split("\n")
-        for i, line in enumerate(lines):
-            text = line.strip()
-            if text.startswith("# "):
-                toc_view.controls.append(
-                    ft.Container(
-                        content=ft.Text(f"■ {text[2:]}", size=12, weight="bold", color="#dd0000"),
-                        padding=ft.padding.only(top=8, bottom=4),
-                        on_click=lambda _, pos=i: scroll_to_line(pos),
-                    )
-                )
-            elif text.startswith("## "):
-                toc_view.controls.append(
-                    ft.Container(
-                        content=ft.Text(f"  - {text[3:]}", size=11, color="#aaaaaa"),
-                        padding=ft.padding.only(left=10, bottom=2),
-                        on_click=lambda _, pos=i: scroll_to_line(pos),
-                    )
-                )
-        toc_view.update()
+    async def select_in_editor(start: int, end: int):
+        # 選択範囲は入力欄にフォーカスがある時だけ反映されるので、先にフォーカスする
+        await editor_field.focus()
+        editor_field.selection = ft.TextSelection(base_offset=start, extent_offset=end)
+        editor_field.update()
 
-    def apply_insert(snippet: str, line_start: bool = False):
-        value = get_editor_text()
-        selection = getattr(editor_field, "selection", None)
-        start = len(value)
-        end = len(value)
-        if selection is not None:
-            start = getattr(selection, "start", start)
-            end = getattr(selection, "end", end)
-        start = max(0, min(start, len(value)))
-        end = max(0, min(end, len(value)))
-
-        if line_start:
-            line_head = value.rfind("\n", 0, start) + 1
-            editor_field.value = value[:line_head] + snippet + value[line_head:]
+    def ensure_search_index() -> SearchIndex:
+        if active_view.search is None:
+            index = SearchIndex()
+            live_preview.add_parser_listener(index.apply)
+            active_view.search = index
+        return active_view.search
+
+    def current_hits(limit: int = MAX_HITS):
+        # 索引が検索後に更新されていれば引き直す。位置は見出し索引の行頭オフセットで求める
+        nonlocal search_hits, search_key
+        query = search_field.value or ""
+        if not query:
+            return []
+        refresh_editor_views()
+        index = ensure_search_index()
+        key = (active_view, index.version, query, limit)
+        if key != search_key:
+            outline = active_view.outline
+            with profiling.span("search"):
+                search_hits = [outline.line_offset(line) + col for line, col in index.search(query, limit)]
+            search_key = key
+        return search_hits
+
+    def show_search_status(position: int = 0):
+        hits = current_hits()
+        total = f"{len(hits)}{'+' if len(hits) >= MAX_HITS else ''} 件"
+        search_status.value = f"{position} / {total}" if position else total
+        search_status.update()
+
+    def on_search_change(_):
+        nonlocal last_hit
+        last_hit = -1
+        if search_field.value:
+            show_search_status()
         else:
+            search_status.value = ""
+            search_status.update()
+
+    def jump_to_hit(step: int):
+        nonlocal last_hit
+        hits = current_hits()
+        if not hits:
+            toast("見つかりません", "#424242")
+            return
+        if step > 0:
+            i = bisect_right(hits, last_hit) % len(hits)
+        else:
+            i = (bisect_left(hits, last_hit) - 1) % len(hits)
+        last_hit = hits[i]
+        length = len(search_field.value)
+        session = workspace.active
+        start, end = session.visible_range()
+        if not (start <= last_hit and last_hit + length <= end):
+            # 章の外の一致なら全文表示に戻す
+            unbind_section()
+            start = 0
+        page.run_task(select_in_editor, last_hit - start, last_hit - start + length)
+        show_search_status(i + 1)
+
+    def replace_all(_):
+        # 全一致をまとめた 1 つの差分にして当てる。章単位の編集中は章の中だけ置き換える
+        query = search_field.value or ""
+        hits = current_hits(0)
+        session = workspace.active
+        with session.lock:
+            start, end = session.visible_range()
+            hits = [offset for offset in hits if start <= offset and offset + len(query) <= end]
+            if not hits:
+                toast("見つかりません", "#424242")
+                return
+            replacement = replace_field.value or ""
+            first = hits[0]
+            region = session.document.slice(first, hits[-1] + len(query))
+            pieces = []
+            pos = first
+            for offset in hits:
+                pieces.append(region[pos - first : offset - first])
+                pieces.append(replacement)
+                pos = offset + len(query)
+            session.edit(first - start, len(region), "".join(pieces))
+            show_visible_text(session)
+            editor_field.update()
+        refresh_editor_views()
+        show_search_status()
+        toast(f"{len(hits)} 件置換しました", "#424242")
+
+    def on_page_estimate_switch(e):
+        # ReportLab の読み込みとフォント登録があるので、初めて有効にした時に作る
+        nonlocal page_estimator
+        if e.control.value:
+            if page_estimator is None:
+                from page_estimate import PageEstimator
+
+                page_estimator = PageEstimator()
+            live_preview.layout = page_estimator.estimate
+        else:
+            live_preview.layout = None
+        refresh_editor_views()
+
+    def apply_insert(snippet: str, line_start: bool = False):
+        # 差分だけを document に当てる。入力欄へ送り直すのは表示中の範囲だけ
+        session = workspace.active
+        with session.lock:
+            value = editor_field.value or ""
+            selection = editor_field.selection
+            start = end = len(value)
+            # 選択が無い (-1) か、まだ一度もカーソルを置いていなければ末尾に足す
+            if selection is not None and selection.base_offset is not None and selection.extent_offset is not None:
+                if min(selection.base_offset, selection.extent_offset) >= 0:
+                    start = min(selection.base_offset, selection.extent_offset)
+                    end = max(selection.base_offset, selection.extent_offset)
+            start = min(start, len(value))
+            end = min(end, len(value))
+
+            if line_start:
+                start = end = value.rfind("\n", 0, start) + 1
+            session.edit(start, end - start, snippet)
             editor_field.value = value[:start] + snippet + value[end:]
-        editor_field.update()
-        update_toc(None)
-        update_preview()
-
-    def update_preview():
-        preview_column.controls.clear()
-        preview_column.controls.append(ft.Text(title_field.value or "(タイトル未設定)", size=22, weight="bold", color="#111"))
-        if current_img_path and os.path.exists(current_img_path):
-            preview_column.controls.append(
-                ft.Image(src=current_img_path, height=140, fit=ft.ImageFit.COVER)
-            )
-        preview_column.controls.append(ft.Divider(color="#ddd"))
-
-        for block_type, body in parse_blocks(get_editor_text()):
-            body = normalize_ruby(body)
-            if block_type == "blank":
-                preview_column.controls.append(ft.Container(height=8))
-            elif block_type == "heading":
-                preview_column.controls.append(
-                    ft.Container(
-                        content=ft.Text(body, color="#111", weight="bold"),
-                        bgcolor="#f8f8f8",
-                        border=ft.border.only(left=ft.BorderSide(3, "#666")),
-                        padding=8,
-                    )
-                )
-            elif block_type == "quote":
-                preview_column.controls.append(
-                    ft.Container(content=ft.Text(body, color="#222"), bgcolor="#dddddd", padding=8, border_radius=4)
-                )
-            elif block_type == "ho":
-                preview_column.controls.append(
-                    ft.Container(
-                        content=ft.Text(f"HO: {body}", color="#333"),
-                        border=ft.border.all(1, "#888"),
-                        bgcolor="#f6f6f6",
-                        padding=8,
-                    )
-                )
-            elif block_type == "secret":
-                preview_column.controls.append(
-                    ft.Container(
-                        content=ft.Text(f"SECRET: {body}", color="#111"),
-                        bgcolor="#cccccc",
-                        border=ft.border.all(1, "#666"),
-                        padding=8,
-                    )
-                )
-            else:
-                preview_column.controls.append(ft.Text(body, color="#333"))
-        preview_column.update()
+            field_values.seen(editor_field.value)
+            editor_field.update()
+        refresh_editor_views()
+
+    async def ask_save_trace():
+        path = await file_picker.save_file(file_name="shinobi-trace.json")
+        if path:
+            try:
+                profiling.dump_trace(path)
+                toast(f"トレース保存: {path}")
+            except Exception as err:
+                toast(f"トレース保存失敗: {err}", "#b71c1c")
 
     def refresh_editor_views():
-        update_toc(None)
-        update_preview()
+        live_preview.refresh_now(get_editor_text())
+
+    def on_editor_change(e):
+        session = workspace.active
+        value = e.control.value or ""
+        if field_values.is_client_undo(value):
+            # 取り消しの正はアプリの履歴だけ。クライアントが戻した本文は記録せず、document の内容を送り直す
+            with session.lock:
+                show_visible_text(session)
+                editor_field.update()
+            if undo_caret is not None:
+                page.run_task(select_in_editor, undo_caret, undo_caret)
+            return
+        field_values.seen(value)
+        # 読込スレッドが末尾に足している間に突き合わせると、差分の位置がずれる
+        with session.lock:
+            start, end = session.visible_range()
+            delta = text_delta(session.document.slice(start, end), value)
+            if delta is None:
+                return
+            session.edit(*delta, typing=True)
+        live_preview.submit(session.text)
+
+    def on_editor_focus(_):
+        nonlocal editor_focused
+        editor_focused = True
 
     def on_editor_blur(_):
+        nonlocal editor_focused
+        editor_focused = False
+        # フォーカスが外れたら次の入力は別の取り消し単位にする
+        workspace.active.history.checkpoint()
         refresh_editor_views()
 
+    def undo_redo(redo: bool):
+        # 戻した後のカーソル位置 (入力欄内) を返す
+        session = workspace.active
+        with session.lock:
+            offset = session.redo() if redo else session.undo()
+            if offset is None:
+                toast("やり直す操作がありません" if redo else "元に戻す操作がありません", "#424242")
+                return None
+            show_visible_text(session)
+            start, end = session.visible_range()
+            offset = max(0, min(offset, end) - start)
+            editor_field.update()
+            section_switch.update()
+        page.run_task(select_in_editor, offset, offset)
+        refresh_editor_views()
+        return offset
+
+    def on_title_change(_):
+        refresh_editor_views()
+        if not workspace.active.path:
+            refresh_tabs()
+
     def save_project_shortcut():
-        if current_project_path:
+        path = workspace.active.path
+        if path:
             try:
-                save_project(current_project_path)
-                toast(f"上書き保存: {current_project_path}")
+                if save_project(path):
+                    toast(f"上書き保存: {path}")
+                else:
+                    toast("読込が終わってから保存します", "#424242")
             except Exception as err:
                 toast(f"保存失敗: {err}", "#b71c1c")
         else:
-            project_save_picker.save_file(file_name=f"{title_field.value or 'project'}.json")
+            page.run_task(ask_save_project, "shinobi")
 
     def on_keyboard(e: ft.KeyboardEvent):
+        nonlocal undo_caret
         ctrl_pressed = getattr(e, "ctrl", False)
         key = str(getattr(e, "key", "")).lower()
         if ctrl_pressed and key == "s":
             save_project_shortcut()
+        elif ctrl_pressed and key in ("z", "y"):
+            # キーはページで先に受け取るので、入力欄の中でもアプリの履歴で戻す。
+            # 入力欄は Flutter 側でも取り消しを行い、その変更が後から届く (on_editor_change で捨てる)
+            if editor_focused:
+                field_values.expect_client_undo()
+            undo_caret = undo_redo(key == "y" or getattr(e, "shift", False))
+        elif ctrl_pressed and key == "f":
+            page.run_task(search_field.focus)
         elif ctrl_pressed and key == "r":
             refresh_editor_views()
             toast("プレビュー更新", "#424242")
+        elif ctrl_pressed and getattr(e, "shift", False) and key == "p":
+            diagnostics.toggle()
+
+    def shutdown():
+        # 全タブの残りの差分を書いてスナップショットに畳み、PDF 出力プロセス (typst watch も) を止める。2 回呼ばれてもよい
+        close_all_journals()
+        pdf_worker.close()
+
+    async def on_window_event(e):
+        if e.type == ft.WindowEventType.CLOSE:
+            shutdown()
+            await page.window.destroy()
 
     page.on_keyboard_event = on_keyboard
+    page.on_disconnect = lambda _: shutdown()
+    # 閉じるボタンでは on_disconnect が来る前にプロセスが終わることがあるので、閉じる前に片付ける
+    page.window.prevent_close = True
+    page.window.on_event = on_window_event
 
-    img_picker = ft.FilePicker(on_result=on_img_picked)
-    pdf_save_dialog = ft.FilePicker(on_result=save_pdf)
-    project_save_picker = ft.FilePicker(on_result=handle_project_save)
-    project_load_picker = ft.FilePicker(on_result=handle_project_load)
-    page.overlay.extend([img_picker, pdf_save_dialog, project_save_picker, project_load_picker])
+    # 選んだパスは await で受け取るので、ダイアログは 1 つを使い回す
+    file_picker = ft.FilePicker()
 
-    toc_view = ft.Column(scroll=ft.ScrollMode.AUTO, height=220)
+    diagnostics = DiagnosticsPanel(on_dump=lambda: page.run_task(ask_save_trace))
 
     title_field = ft.TextField(
         label="タイトル",
         bgcolor="#ffffff",
         border_color="#d8d8d8",
         text_size=12,
-        on_change=lambda _: update_preview(),
+        on_change=on_title_change,
     )
     editor_field = ft.TextField(
         multiline=True,
@@ -466,22 +673,56 @@ def main(page: ft.Page):
         border_color="#e3e3e3",
         cursor_color="#555",
         hint_text="# タイトル\n\n> ここに描写を書く...",
+        on_change=on_editor_change,
+        on_focus=on_editor_focus,
         on_blur=on_editor_blur,
         expand=True,
     )
 
-    img_preview = ft.Image(src="", width=200, height=120, fit=ft.ImageFit.CONTAIN, visible=False)
+    img_preview = ft.Image(src="", width=200, height=120, fit=ft.BoxFit.CONTAIN, visible=False)
     img_info = ft.Text("画像未選択", size=10, color="#666")
     project_path_label = ft.Text("未保存", size=10, color="#888")
+    memory_label = ft.Text("", size=10, color="#888")
+    page_estimate_switch = ft.Switch(label="ページ割りを表示", value=False, on_change=on_page_estimate_switch)
+    search_field = ft.TextField(
+        label="検索 (Ctrl+F)",
+        dense=True,
+        text_size=12,
+        bgcolor="#ffffff",
+        border_color="#d8d8d8",
+        on_change=on_search_change,
+        on_submit=lambda _: jump_to_hit(1),
+    )
+    replace_field = ft.TextField(label="置換", dense=True, text_size=12, bgcolor="#ffffff", border_color="#d8d8d8")
+    search_status = ft.Text("", size=10, color="#888")
+    section_switch = ft.Switch(label="章単位で編集 (INDEX で章を選択)", value=False, on_change=on_section_switch)
+    # タブの数と length が合っていないと描けないので、最初のタブを開くまでは仮の 1 つを置く
+    tabs_bar = ft.TabBar(tabs=[ft.Tab(label="無題")], scrollable=True)
+    project_tabs = ft.Tabs(content=tabs_bar, length=1, on_change=on_tab_change, expand=True)
+    toc_slot = ft.Container()
+    preview_slot = ft.Container(expand=True)
+    export_status = ft.Text("", size=10, color="#888")
+    engine_dropdown = ft.Dropdown(
+        label="出力エンジン",
+        value=os.environ.get("SHINOBI_PDF_ENGINE", "") or "auto",
+        options=[
+            ft.DropdownOption("auto", "自動 (Typst があれば Typst)"),
+            ft.DropdownOption("reportlab", "ReportLab"),
+            ft.DropdownOption("typst", "Typst"),
+        ],
+        dense=True,
+        text_size=11,
+    )
+    export_cancel_button = ft.TextButton("キャンセル", visible=False, on_click=lambda _: pdf_worker.cancel())
 
     snippet_buttons = ft.Column(
         [
             ft.Text("スニペット", size=12, weight="bold", color="#aaa"),
-            ft.ElevatedButton("シーン表", on_click=lambda _: apply_insert("{{SceneTable}}")),
-            ft.ElevatedButton("HO枠", on_click=lambda _: apply_insert("{{HO1}}")),
-            ft.ElevatedButton("描写ボックス", on_click=lambda _: apply_insert("> ", line_start=True)),
-            ft.ElevatedButton("袋とじ", on_click=lambda _: apply_insert(":::secret 内容 :::")),
-            ft.ElevatedButton("ルビ", on_click=lambda _: apply_insert("{漢字}(よみ)")),
+            ft.Button("シーン表", on_click=lambda _: apply_insert("{{SceneTable}}")),
+            ft.Button("HO枠", on_click=lambda _: apply_insert("{{HO1}}")),
+            ft.Button("描写ボックス", on_click=lambda _: apply_insert("> ", line_start=True)),
+            ft.Button("袋とじ", on_click=lambda _: apply_insert(":::secret 内容 :::")),
+            ft.Button("ルビ", on_click=lambda _: apply_insert("{漢字}(よみ)")),
         ],
         spacing=6,
     )
@@ -494,52 +735,104 @@ def main(page: ft.Page):
                 title_field,
                 ft.Row(
                     [
-                        ft.ElevatedButton("JSON保存", on_click=lambda _: project_save_picker.save_file(file_name=f"{title_field.value or 'project'}.json")),
-                        ft.ElevatedButton("JSON読込", on_click=lambda _: project_load_picker.pick_files(allow_multiple=False, allowed_extensions=["json"])),
-                    ]
+                        ft.Button("保存", on_click=lambda _: page.run_task(ask_save_project, "shinobi")),
+                        ft.Button("開く", on_click=lambda _: page.run_task(ask_load_project)),
+                        ft.TextButton("JSON書出", on_click=lambda _: page.run_task(ask_save_project, "json")),
+                    ],
+                    wrap=True,
                 ),
                 ft.Text("現在のプロジェクト", size=10, color="#777"),
                 project_path_label,
+                memory_label,
                 ft.Divider(color="#ddd"),
                 ft.Text("ヘッダー画像", size=11, color="#aaa"),
-                ft.Container(content=img_preview, bgcolor="#fff", alignment=ft.alignment.center, border=ft.border.all(1, "#ddd"), height=120),
+                ft.Container(content=img_preview, bgcolor="#fff", alignment=ft.Alignment.CENTER, border=ft.Border.all(1, "#ddd"), height=120),
                 ft.Row(
                     [
                         img_info,
-                        ft.IconButton(icon=ft.icons.IMAGE, on_click=lambda _: img_picker.pick_files(allow_multiple=False, allowed_extensions=["png", "jpg", "jpeg"])),
+                        ft.IconButton(icon=ft.Icons.IMAGE, on_click=lambda _: page.run_task(ask_header_image)),
                     ],
                     alignment=ft.MainAxisAlignment.SPACE_BETWEEN,
                 ),
-                ft.ElevatedButton("PDF保存", icon=ft.icons.SAVE_ALT, on_click=lambda _: pdf_save_dialog.save_file(file_name=f"{title_field.value or 'output'}.pdf")),
+                engine_dropdown,
+                page_estimate_switch,
+                ft.Button("PDF保存", icon=ft.Icons.SAVE_ALT, on_click=lambda _: page.run_task(ask_save_pdf)),
+                ft.Row([export_status, export_cancel_button], alignment=ft.MainAxisAlignment.SPACE_BETWEEN),
+                ft.TextButton(
+                    "ハンドアウト (HO・袋とじごとの PDF を zip で)",
+                    icon=ft.Icons.FOLDER_ZIP,
+                    on_click=lambda _: page.run_task(ask_save_handouts),
+                ),
                 ft.Divider(color="#ddd"),
                 snippet_buttons,
                 ft.Divider(color="#ddd"),
-                ft.ElevatedButton("プレビュー更新", on_click=lambda _: refresh_editor_views()),
-                ft.Text("※入力中はプレビュー更新を抑制しています（Ctrl+R でも更新可能）", size=10, color="#888"),
+                search_field,
+                replace_field,
+                ft.Row(
+                    [
+                        ft.IconButton(icon=ft.Icons.ARROW_UPWARD, tooltip="前へ", on_click=lambda _: jump_to_hit(-1)),
+                        ft.IconButton(icon=ft.Icons.ARROW_DOWNWARD, tooltip="次へ", on_click=lambda _: jump_to_hit(1)),
+                        ft.TextButton("すべて置換", on_click=replace_all),
+                        search_status,
+                    ],
+                    spacing=0,
+                    wrap=True,
+                ),
+                ft.Divider(color="#ddd"),
+                ft.Button("プレビュー更新", on_click=lambda _: refresh_editor_views()),
+                ft.Text("※入力が止まると自動でプレビュー更新します（Ctrl+R で即時更新）", size=10, color="#888"),
                 ft.Divider(color="#ddd"),
                 ft.Text("INDEX", size=12, weight="bold", color="#888"),
-                toc_view,
+                section_switch,
+                toc_slot,
+                diagnostics.view,
             ],
             scroll=ft.ScrollMode.AUTO,
         ),
         bgcolor="#fafafa",
         padding=10,
-        border=ft.border.only(right=ft.BorderSide(1, "#e1e1e1")),
+        border=ft.Border.only(right=ft.BorderSide(1, "#e1e1e1")),
     )
 
-    preview_column = ft.Column(scroll=ft.ScrollMode.AUTO)
+    # 描画先はタブ切り替え時に bind で差し替える
+    live_preview = LivePreviewPipeline(
+        None,
+        None,
+        None,
+        lambda: (title_field.value or "(タイトル未設定)", workspace.active.img_path),
+        on_error=on_preview_error,
+    )
     right_col = ft.Container(
-        content=ft.Column([ft.Text("PREVIEW", size=12, weight="bold", color="#888"), ft.Divider(color="#ddd"), preview_column]),
+        content=ft.Column([ft.Text("PREVIEW", size=12, weight="bold", color="#888"), ft.Divider(color="#ddd"), preview_slot], expand=True),
         bgcolor="#fafafa",
         padding=10,
-        border=ft.border.only(left=ft.BorderSide(1, "#e1e1e1")),
+        border=ft.Border.only(left=ft.BorderSide(1, "#e1e1e1")),
     )
 
     page.add(
         ft.Row(
             [
                 ft.Container(content=left_col, expand=3),
-                ft.Container(content=editor_field, expand=7, padding=20),
+                ft.Container(
+                    content=ft.Column(
+                        [
+                            ft.Row(
+                                [
+                                    project_tabs,
+                                    ft.IconButton(icon=ft.Icons.ADD, tooltip="新しいタブ", on_click=lambda _: new_tab()),
+                                    ft.IconButton(icon=ft.Icons.CLOSE, tooltip="タブを閉じる", on_click=lambda _: close_tab()),
+                                    ft.IconButton(icon=ft.Icons.UNDO, tooltip="元に戻す (Ctrl+Z)", on_click=lambda _: undo_redo(False)),
+                                    ft.IconButton(icon=ft.Icons.REDO, tooltip="やり直す (Ctrl+Y)", on_click=lambda _: undo_redo(True)),
+                                ],
+                                spacing=0,
+                            ),
+                            ft.Container(content=editor_field, expand=True),
+                        ],
+                        expand=True,
+                    ),
+                    expand=7,
+                    padding=20,
+                ),
                 ft.Container(content=right_col, expand=4),
             ],
             expand=True,
@@ -547,8 +840,12 @@ def main(page: ft.Page):
         )
     )
 
-    update_toc(None)
-    update_preview()
+    new_tab()
+    if os.environ.get("SHINOBI_STARTUP_TIMING"):
+        print(f"[startup] first frame: {(time.perf_counter() - STARTED_AT) * 1000:.1f} ms", file=sys.stderr)
+    pdf_worker.warm_up()
 
 
-ft.app(target=main)
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    ft.run(main)
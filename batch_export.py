@@ -0,0 +1,131 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from export_engines import ENGINE_NAMES, get_engine
+from pdf_export import register_pdf_font
+from project_store import read_project, resolve_image_path
+
+
+def collect_projects(patterns):
+    found = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = glob.glob(os.path.join(pattern, "**", "*.json"), recursive=True)
+            matches += glob.glob(os.path.join(pattern, "**", "*.shinobi"), recursive=True)
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        for path in sorted(matches):
+            path = os.path.abspath(path)
+            if path not in seen and os.path.isfile(path):
+                seen.add(path)
+                found.append(path)
+    return found
+
+
+def output_paths(projects, out_dir: str = "") -> dict:
+    # プロジェクト → PDF。--out-dir の下には、対象の共通フォルダからの相対パスをそのまま作る。
+    # 同じフォルダの同名 (x.json と x.shinobi) だけは拡張子を残して x.json.pdf / x.shinobi.pdf にする
+    root = ""
+    if out_dir and projects:
+        try:
+            root = os.path.commonpath([os.path.dirname(path) for path in projects])
+        except ValueError:  # Windows でドライブが違う
+            root = ""
+    paths = {}
+    for path in projects:
+        folder = os.path.dirname(path)
+        if out_dir:
+            folder = os.path.normpath(os.path.join(out_dir, os.path.relpath(folder, root))) if root else out_dir
+        paths[path] = os.path.join(folder, os.path.splitext(os.path.basename(path))[0] + ".pdf")
+    counts = Counter(os.path.normcase(pdf) for pdf in paths.values())
+    for path, pdf in paths.items():
+        if counts[os.path.normcase(pdf)] > 1:
+            paths[path] = os.path.join(os.path.dirname(pdf), os.path.basename(path) + ".pdf")
+    return paths
+
+
+def export_project(project_path: str, pdf_path: str, use_cache: bool = True, engine: str = "") -> dict:
+    started = time.perf_counter()
+    result = {"project": project_path, "pdf": pdf_path, "ok": False, "error": ""}
+    try:
+        data = read_project(project_path)
+        img_path = resolve_image_path(project_path, data["header_image_path"])
+        exporter = get_engine(engine)
+        result["engine"] = exporter.name
+        exporter.export(pdf_path, data["title"], data["text_content"], img_path, use_cache=use_cache)
+        result["ok"] = True
+    except Exception as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def run_batch(projects, out_dir: str = "", jobs: int = 0, use_cache: bool = True, on_result=None, engine: str = ""):
+    pdf_paths = output_paths(projects, out_dir)
+    if out_dir:
+        for folder in {os.path.dirname(pdf) for pdf in pdf_paths.values()}:
+            os.makedirs(folder, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=jobs or os.cpu_count(), initializer=register_pdf_font) as pool:
+        futures = [pool.submit(export_project, path, pdf_paths[path], use_cache, engine) for path in projects]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if on_result is not None:
+                on_result(result)
+    results.sort(key=lambda r: r["project"])
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="プロジェクト JSON をまとめて PDF に書き出します。")
+    parser.add_argument("inputs", nargs="+", help="プロジェクト JSON のパス、ディレクトリ、または glob")
+    parser.add_argument("-o", "--out-dir", default="", help="PDF の出力先（省略時は各 JSON と同じ場所。フォルダ構成はそのまま再現）")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="並列プロセス数（省略時は CPU コア数）")
+    parser.add_argument("--report", default="", help="ファイルごとの時間とエラーを書き出す JSON レポート")
+    parser.add_argument("--no-cache", action="store_true", help="出力キャッシュを使わずに書き出す")
+    parser.add_argument(
+        "--engine",
+        choices=ENGINE_NAMES,
+        default="",
+        help="PDF エンジン（省略時は環境変数 SHINOBI_PDF_ENGINE、未設定なら auto: typst があれば Typst）",
+    )
+    args = parser.parse_args(argv)
+
+    projects = collect_projects(args.inputs)
+    if not projects:
+        print("対象のプロジェクトが見つかりません", file=sys.stderr)
+        return 2
+
+    def on_result(result):
+        status = "OK " if result["ok"] else "NG "
+        detail = result["pdf"] if result["ok"] else result["error"]
+        print(f"{status}{result['seconds']:8.3f}s  {result['project']} -> {detail}")
+
+    started = time.perf_counter()
+    results = run_batch(projects, args.out_dir, args.jobs, not args.no_cache, on_result, args.engine)
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for r in results if not r["ok"])
+    print(f"{len(results)} 件 / 失敗 {failed} 件 / {elapsed:.2f}s")
+
+    if args.report:
+        report = {
+            "total_seconds": round(elapsed, 4),
+            "count": len(results),
+            "failed": failed,
+            "results": results,
+        }
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from blocks import IncrementalBlockParser, normalize_ruby, parse_blocks
+from project_store import read_project, write_project
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_THRESHOLD = 0.25
+
+_WORDS = ["忍者", "城下町", "密書", "月夜", "探索者", "影", "巻物", "刀", "村人", "結界", "依頼", "宿場"]
+_RUBY = ["{忍}(しのび)", "{影縫}(かげぬい)", "{結界}(けっかい)", "{密書}(みっしょ)"]
+
+
+def generate_scenario(lines: int, seed: int = 0) -> str:
+    rnd = random.Random(seed)
+    out = []
+    chapter = 0
+    for i in range(lines):
+        roll = rnd.random()
+        if i % 120 == 0:
+            chapter += 1
+            out.append(f"# 第{chapter}章 {rnd.choice(_WORDS)}の{rnd.choice(_WORDS)}")
+        elif i % 40 == 0:
+            out.append(f"## {rnd.choice(_WORDS)}")
+        elif roll < 0.12:
+            out.append("")
+        elif roll < 0.24:
+            out.append("> " + "".join(rnd.choice(_WORDS) for _ in range(rnd.randint(4, 16))) + "。")
+        elif roll < 0.28:
+            out.append("{{HO%d %s}}" % (rnd.randint(1, 4), rnd.choice(_WORDS)))
+        elif roll < 0.31:
+            out.append(":::secret " + "".join(rnd.choice(_WORDS) for _ in range(rnd.randint(2, 8))) + " :::")
+        else:
+            words = [rnd.choice(_WORDS + _RUBY) for _ in range(rnd.randint(6, 40))]
+            out.append("、".join(words) + "。")
+    return "\n".join(out)
+
+
+def _stage_parse(text):
+    return lambda: parse_blocks(text)
+
+
+def _stage_parse_incremental(text):
+    parser = IncrementalBlockParser()
+    parser.parse(text)
+    middle = len(text) // 2
+    edited = [text[:middle] + "追記" + text[middle:], text]
+    state = {"i": 0}
+
+    def run():
+        state["i"] ^= 1
+        return parser.parse(edited[state["i"]])
+
+    return run
+
+
+def _stage_ruby(text):
+    bodies = [body for _, body in parse_blocks(text)]
+    return lambda: [normalize_ruby(body) for body in bodies]
+
+
+def _stage_inline(text):
+    from inline import inline_markup, lex_inline
+
+    bodies = [body for _, body in parse_blocks(text)]
+
+    def run():
+        # キャッシュ無しの 1 回目 (プレビュー) + キャッシュ有りの 2 回目 (PDF) を測る
+        lex_inline.cache_clear()
+        inline_markup.cache_clear()
+        for body in bodies:
+            lex_inline(body)
+        return [inline_markup(body) for body in bodies]
+
+    return run
+
+
+def _stage_project_io(text, folder):
+    path = os.path.join(folder, "bench_project.json")
+
+    def run():
+        write_project(path, "ベンチマーク", text, "")
+        return read_project(path)
+
+    return run
+
+
+def _stage_journal_save(text, folder):
+    from project_journal import ProjectJournal, write_snapshot
+
+    path = os.path.join(folder, "bench_project.shinobi")
+    write_snapshot(path, "ベンチマーク", text, "")
+    journal = ProjectJournal(path, "ベンチマーク", text, "")
+    state = {"text": text}
+
+    def run():
+        # 1 文字追記して保存 (Ctrl+S 相当) が書き込み完了するまで
+        state["text"] += "。"
+        journal.record("ベンチマーク", state["text"], "")
+        journal.flush()
+
+    return run
+
+
+def _stage_build_story(text):
+    from pdf_export import FlowableFactory, register_pdf_font
+
+    font_name = register_pdf_font()
+    blocks = parse_blocks(text)
+
+    def run():
+        factory = FlowableFactory(font_name)
+        story = []
+        for block_type, body in blocks:
+            story.extend(factory.block(block_type, body))
+        return story
+
+    return run
+
+
+def _stage_pdf(text, folder):
+    from pdf_export import register_pdf_font, save_pdf_file
+
+    register_pdf_font()
+    path = os.path.join(folder, "bench_output.pdf")
+    return lambda: save_pdf_file(path, "ベンチマーク", text, use_cache=False)
+
+
+def _stage_page_estimate(text):
+    from page_estimate import PageEstimator
+
+    estimator = PageEstimator()
+    blocks = parse_blocks(text)
+    # 1 回目 (計測前の空回し) で全ブロックの高さが揃うので、以降は入力中の見積もり相当
+    return lambda: estimator.estimate(blocks)
+
+
+def _stage_preview(text):
+    from preview import PreviewEngine
+
+    blocks = parse_blocks(text)
+    return lambda: PreviewEngine().render("ベンチマーク", "", blocks)
+
+
+STAGES = {
+    "parse_blocks": lambda text, folder: _stage_parse(text),
+    "parse_incremental": lambda text, folder: _stage_parse_incremental(text),
+    "normalize_ruby": lambda text, folder: _stage_ruby(text),
+    "inline_lex": lambda text, folder: _stage_inline(text),
+    "project_io": _stage_project_io,
+    "journal_save": _stage_journal_save,
+    "build_story": lambda text, folder: _stage_build_story(text),
+    "pdf_export": _stage_pdf,
+    "page_estimate": lambda text, folder: _stage_page_estimate(text),
+    "preview": lambda text, folder: _stage_preview(text),
+}
+SLOW_STAGES = {"build_story", "pdf_export"}
+
+
+def measure(run, repeat: int):
+    run()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    try:
+        run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "seconds": round(min(timings), 6),
+        "median_seconds": round(statistics.median(timings), 6),
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+def run_benchmarks(sizes, stages, repeat: int, seed: int, max_slow_lines: int, on_result=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            text = generate_scenario(size, seed)
+            for stage in stages:
+                key = f"{stage}@{size}"
+                if stage in SLOW_STAGES and size > max_slow_lines:
+                    continue
+                try:
+                    run = STAGES[stage](text, folder)
+                except ImportError as err:
+                    results[key] = {"skipped": str(err)}
+                else:
+                    results[key] = measure(run, 1 if stage in SLOW_STAGES else repeat)
+                if on_result is not None:
+                    on_result(key, results[key])
+    return results
+
+
+def compare(results, baseline, threshold: float):
+    regressions = []
+    for key, base in baseline.get("results", {}).items():
+        current = results.get(key)
+        if not current or "seconds" not in current or "seconds" not in base:
+            continue
+        for metric in ("seconds", "peak_kb"):
+            if base[metric] > 0 and current[metric] > base[metric] * (1 + threshold):
+                regressions.append((key, metric, base[metric], current[metric]))
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="パーサー・プレビュー・PDF 出力のベンチマーク")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="シナリオ行数（カンマ区切り）")
+    parser.add_argument("--stages", default=",".join(STAGES), help="計測するステージ（カンマ区切り）")
+    parser.add_argument("--repeat", type=int, default=5, help="軽いステージの繰り返し回数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-slow-lines", type=int, default=20000, help="build_story / pdf_export を計測する最大行数")
+    parser.add_argument("--output", default="", help="結果 JSON の出力先")
+    parser.add_argument("--baseline", default="", help="比較するベースライン JSON")
+    parser.add_argument("--save-baseline", action="store_true", help="結果を --baseline に保存する")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="許容する悪化率（0.25 = 25%%）")
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        parser.error(f"不明なステージ: {', '.join(unknown)}")
+
+    def on_result(key, result):
+        if "skipped" in result:
+            print(f"{key:28s} skipped ({result['skipped']})")
+        else:
+            print(f"{key:28s} {result['seconds'] * 1000:10.2f} ms  peak {result['peak_kb']:10.1f} KiB")
+
+    results = run_benchmarks(sizes, stages, args.repeat, args.seed, args.max_slow_lines, on_result)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if not args.baseline:
+        return 0
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.threshold)
+    for key, metric, before, after in regressions:
+        print(f"REGRESSION {key} {metric}: {before} -> {after}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+import re
+from array import array
+from bisect import bisect_right
+
+RUBY_PATTERN = re.compile(r"\{(.+?)\}\((.+?)\)")
+
+BLOCK_TYPES = ("blank", "heading", "quote", "ho", "secret", "paragraph")
+BLANK, HEADING, QUOTE, HO, SECRET, PARAGRAPH = range(len(BLOCK_TYPES))
+
+_CHUNK = 512
+# 本文の文字単位の比較は、行単位より大きな塊で比べる
+TEXT_CHUNK = 4096
+
+
+def normalize_ruby(text: str) -> str:
+    return RUBY_PATTERN.sub(r"\1(\2)", text)
+
+
+def parse_blocks(text: str):
+    blocks = []
+    for raw_line in text.splitlines():
+        line = raw_line.rstrip()
+        stripped = line.strip()
+        if not stripped:
+            blocks.append(("blank", ""))
+        elif stripped.startswith("# "):
+            blocks.append(("heading", stripped[2:].strip()))
+        elif stripped.startswith(">"):
+            blocks.append(("quote", stripped[1:].strip()))
+        elif stripped.startswith("{{") and stripped.endswith("}}"):
+            blocks.append(("ho", stripped[2:-2].strip()))
+        elif stripped.startswith(":::secret") and stripped.endswith(":::"):
+            body = stripped[len(":::secret") : -3].strip()
+            blocks.append(("secret", body or "(secret)"))
+        else:
+            blocks.append(("paragraph", stripped))
+    return blocks
+
+
+def _trim(line: str, start: int, end: int):
+    segment = line[start:end]
+    head = len(segment) - len(segment.lstrip())
+    if head == len(segment):
+        return end, end
+    return start + head, start + len(segment.rstrip())
+
+
+def classify_line(raw_line: str):
+    # parse_blocks と同じ判定を、行内の本文オフセットで返す
+    line = raw_line.rstrip()
+    lead = len(line) - len(line.lstrip())
+    stripped = line[lead:]
+    end = len(line)
+    if not stripped:
+        return BLANK, 0, 0
+    if stripped.startswith("# "):
+        return (HEADING, *_trim(line, lead + 2, end))
+    if stripped.startswith(">"):
+        return (QUOTE, *_trim(line, lead + 1, end))
+    if stripped.startswith("{{") and stripped.endswith("}}"):
+        return (HO, *_trim(line, lead + 2, end - 2))
+    if stripped.startswith(":::secret") and stripped.endswith(":::"):
+        return (SECRET, *_trim(line, lead + len(":::secret"), end - 3))
+    return PARAGRAPH, lead, end
+
+
+def block_body(kind: int, line: str, start: int, end: int) -> str:
+    if kind == SECRET and start == end:
+        return "(secret)"
+    return line[start:end]
+
+
+def common_prefix(a, b, chunk: int = _CHUNK) -> int:
+    # 文字列でも行のリストでもよい。chunk ずつ比べ、食い違った塊の中だけ 1 つずつ見る
+    limit = min(len(a), len(b))
+    i = 0
+    while i < limit:
+        j = min(i + chunk, limit)
+        if a[i:j] != b[i:j]:
+            while a[i] == b[i]:
+                i += 1
+            return i
+        i = j
+    return limit
+
+
+def common_suffix(a, b, limit: int, chunk: int = _CHUNK) -> int:
+    # 末尾から limit 個までの一致数。反転したコピーは作らず位置で比べる
+    n = 0
+    la, lb = len(a), len(b)
+    while n < limit:
+        m = min(n + chunk, limit)
+        if a[la - m : la - n] != b[lb - m : lb - n]:
+            while a[la - n - 1] == b[lb - n - 1]:
+                n += 1
+            return n
+        n = m
+    return limit
+
+
+class BlockList:
+    # parse の結果。本文と行ごとの表を参照するだけで、(種別, 本文) は読む時に作る。
+    # 表は parse のたびに作り直すので、後から parse しても中身は変わらない
+
+    __slots__ = ("_text", "_lines", "_kinds", "_starts", "_ends")
+
+    def __init__(self, text: str, lines, kinds, starts, ends):
+        self._text = text
+        self._lines = lines
+        self._kinds = kinds
+        self._starts = starts
+        self._ends = ends
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def _block(self, index: int):
+        kind = self._kinds[index]
+        line = self._lines[index]
+        return BLOCK_TYPES[kind], block_body(kind, self._text, line + self._starts[index], line + self._ends[index])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._block(i) for i in range(*index.indices(len(self._kinds)))]
+        return self._block(index)
+
+    def __iter__(self):
+        return map(self._block, range(len(self._kinds)))
+
+
+class IncrementalBlockParser:
+    # ブロック表は種別コードと本文のオフセットだけを持ち、前回と食い違う範囲の行だけを再分類する。
+    # 行頭は _text 内の位置、本文の開始・終了は行頭からの位置
+
+    def __init__(self):
+        self._listeners = []
+        self._kinds = array("B")
+        self.reset()
+
+    def add_listener(self, listener):
+        # listener(head, old_stop, new_lines): 行 [head, old_stop) が new_lines に置き換わった
+        self._listeners.append(listener)
+        if self._kinds:
+            listener(0, 0, self._text.splitlines(True))
+
+    def reset(self):
+        if self._kinds:
+            for listener in self._listeners:
+                listener(0, len(self._kinds), [])
+        self._text = ""
+        self._lines = array("I")
+        self._kinds = array("B")
+        self._starts = array("I")
+        self._ends = array("I")
+        self._result = BlockList("", self._lines, self._kinds, self._starts, self._ends)
+        self.dirty_range = (0, 0)
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def kind_at(self, index: int) -> str:
+        return BLOCK_TYPES[self._kinds[index]]
+
+    def line_at(self, index: int) -> str:
+        stop = self._lines[index + 1] if index + 1 < len(self._lines) else len(self._text)
+        return self._text[self._lines[index] : stop]
+
+    def span_at(self, index: int):
+        return self._starts[index], self._ends[index]
+
+    def parse(self, text: str):
+        if text is self._text or text == self._text:
+            self.dirty_range = (len(self._kinds), len(self._kinds))
+            return self._result
+
+        old = self._text
+        lines = self._lines
+        count = len(lines)
+        prefix = common_prefix(old, text, TEXT_CHUNK)
+        suffix = common_suffix(old, text, min(len(old), len(text)) - prefix, TEXT_CHUNK)
+        # 食い違いの始まりを含む行から読み直す。行頭の直前が \r なら \r\n に繋がることがあるので 1 行戻る
+        head = max(bisect_right(lines, prefix) - 1, 0)
+        if head and lines[head] == prefix and old[prefix - 1] == "\r":
+            head -= 1
+        # 行頭の前後の文字がどちらも末尾の一致範囲に入っている行からは変わらない
+        old_stop = bisect_right(lines, len(old) - suffix)
+        shift = len(text) - len(old)
+        begin = lines[head] if count else 0
+        new_lines = text[begin : (lines[old_stop] if old_stop < count else len(old)) + shift].splitlines(True)
+
+        offsets = array("I")
+        kinds = array("B")
+        starts = array("I")
+        ends = array("I")
+        for raw_line in new_lines:
+            kind, start, end = classify_line(raw_line)
+            offsets.append(begin)
+            kinds.append(kind)
+            starts.append(start)
+            ends.append(end)
+            begin += len(raw_line)
+
+        tail = lines[old_stop:]
+        if shift:
+            tail = array("I", [line + shift for line in tail])
+        # 配列は作り直す (前回返した BlockList が参照している)
+        self._lines = lines[:head] + offsets + tail
+        self._kinds = self._kinds[:head] + kinds + self._kinds[old_stop:]
+        self._starts = self._starts[:head] + starts + self._starts[old_stop:]
+        self._ends = self._ends[:head] + ends + self._ends[old_stop:]
+        self._text = text
+        self._result = BlockList(text, self._lines, self._kinds, self._starts, self._ends)
+        self.dirty_range = (head, head + len(new_lines))
+        for listener in self._listeners:
+            listener(head, old_stop, new_lines)
+        return self._result
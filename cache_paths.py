@@ -0,0 +1,15 @@
+import os
+
+
+def cache_dir(*parts: str) -> str:
+    base = os.environ.get("SHINOBI_CACHE_DIR")
+    if not base:
+        if os.name == "nt":
+            root = os.environ.get("LOCALAPPDATA") or os.path.expanduser("~")
+            base = os.path.join(root, "ShinobiWriter", "cache")
+        else:
+            root = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+            base = os.path.join(root, "shinobi-writer")
+    path = os.path.join(base, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
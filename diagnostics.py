@@ -0,0 +1,70 @@
+import threading
+import time
+
+import flet as ft
+
+import profiling
+from preview import is_mounted
+
+REFRESH_SECONDS = 1.0
+
+
+class DiagnosticsPanel:
+    # Ctrl+Shift+P で開く計測パネル。表示中だけスパン計測を有効にする
+
+    def __init__(self, on_dump):
+        self.rows = ft.Column(spacing=1)
+        self.view = ft.Container(
+            content=ft.Column(
+                [
+                    ft.Text("DIAGNOSTICS", size=12, weight="bold", color="#888"),
+                    ft.Row(
+                        [
+                            ft.TextButton("トレース保存", on_click=lambda _: on_dump()),
+                            ft.TextButton("リセット", on_click=lambda _: self.reset()),
+                        ]
+                    ),
+                    self.rows,
+                ],
+                spacing=4,
+            ),
+            visible=False,
+            padding=6,
+            bgcolor="#ffffff",
+            border=ft.Border.all(1, "#ddd"),
+        )
+        self._always_on = profiling.is_enabled()
+        self._thread = None
+
+    def toggle(self):
+        self.view.visible = not self.view.visible
+        profiling.set_enabled(self._always_on or self.view.visible)
+        self.refresh()
+        if self.view.visible and self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, name="diagnostics", daemon=True)
+            self._thread.start()
+
+    def reset(self):
+        profiling.reset()
+        self.refresh()
+
+    def refresh(self):
+        self.rows.controls = [
+            ft.Text(
+                f"{row['name'][:22]:22s} {row['count']:4d}  avg {row['mean_ms']:7.1f}  "
+                f"p95 {row['p95_ms']:7.1f}  max {row['max_ms']:7.1f} ms",
+                size=10,
+                font_family="monospace",
+                color="#444",
+            )
+            for row in profiling.summary()
+        ]
+        if is_mounted(self.view):
+            self.view.update()
+
+    def _refresh_loop(self):
+        while self.view.visible:
+            time.sleep(REFRESH_SECONDS)
+            if self.view.visible:
+                self.refresh()
+        self._thread = None
@@ -0,0 +1,78 @@
+import threading
+from bisect import bisect_right
+from itertools import accumulate
+
+MAX_PIECES = 512
+
+
+class PieceTable:
+    # 本文を (文字列, 開始, 終了) の断片の並びで持つ。編集は断片の付け替えだけで済み、
+    # 全文の文字列は読まれた時に 1 回だけ組み立てる (組み立てた後は 1 断片に畳む)
+
+    def __init__(self, text: str = ""):
+        self._lock = threading.Lock()
+        self._pieces = [(text, 0, len(text))] if text else []
+        self._starts = [0] if text else []
+        self._length = len(text)
+        self._text = text
+        self.version = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    def text(self) -> str:
+        with self._lock:
+            if self._text is None:
+                self._text = "".join(s[a:b] for s, a, b in self._pieces)
+                self._pieces = [(self._text, 0, self._length)] if self._length else []
+                self._starts = [0] if self._length else []
+            return self._text
+
+    def slice(self, start: int, end: int) -> str:
+        with self._lock:
+            if self._text is not None:
+                return self._text[start:end]
+            start = max(0, start)
+            end = min(end, self._length)
+            if start >= end:
+                return ""
+            parts = []
+            i = bisect_right(self._starts, start) - 1
+            while i < len(self._pieces) and self._starts[i] < end:
+                s, a, b = self._pieces[i]
+                base = self._starts[i]
+                parts.append(s[a + max(0, start - base) : a + min(b - a, end - base)])
+                i += 1
+            return "".join(parts)
+
+    def _split(self, offset: int) -> int:
+        # offset から始まる断片の番号。断片の途中なら 2 つに割る
+        if offset >= self._length:
+            return len(self._pieces)
+        i = bisect_right(self._starts, offset) - 1
+        s, a, b = self._pieces[i]
+        cut = a + offset - self._starts[i]
+        if cut == a:
+            return i
+        self._pieces[i : i + 1] = [(s, a, cut), (s, cut, b)]
+        self._starts.insert(i + 1, offset)
+        return i + 1
+
+    def apply(self, at: int, deleted: int, inserted: str):
+        # project_journal.text_delta と同じ (位置, 削除文字数, 挿入文字列)
+        with self._lock:
+            at = max(0, min(at, self._length))
+            deleted = max(0, min(deleted, self._length - at))
+            if not deleted and not inserted:
+                return
+            i = self._split(at)
+            j = self._split(at + deleted)
+            self._pieces[i:j] = [(inserted, 0, len(inserted))] if inserted else []
+            self._length += len(inserted) - deleted
+            self._text = None
+            self.version += 1
+            if len(self._pieces) > MAX_PIECES:
+                text = "".join(s[a:b] for s, a, b in self._pieces)
+                self._pieces = [(text, 0, len(text))]
+                self._text = text
+            self._starts = list(accumulate((b - a for _, a, b in self._pieces[:-1]), initial=0)) if self._pieces else []
@@ -0,0 +1,77 @@
+import hashlib
+import os
+import shutil
+
+from cache_paths import cache_dir
+
+MAX_CACHED_EXPORTS = 32
+
+_image_digests = {}
+
+
+def image_digest(img_path: str) -> str:
+    if not img_path or not os.path.exists(img_path):
+        return ""
+    st = os.stat(img_path)
+    stamp = (os.path.abspath(img_path), st.st_mtime_ns, st.st_size)
+    digest = _image_digests.get(stamp)
+    if digest is None:
+        h = hashlib.sha256()
+        with open(img_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        digest = _image_digests[stamp] = h.hexdigest()
+    return digest
+
+
+def export_key(title: str, text: str, img_path: str, style_version: str) -> str:
+    h = hashlib.sha256()
+    for part in (style_version, title, image_digest(img_path), text):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ExportCache:
+    # 入力ハッシュ → 出力済み PDF。件数上限を超えたら古いものから消す
+
+    def __init__(self, folder: str = "", max_entries: int = MAX_CACHED_EXPORTS):
+        self._folder = folder
+        self.max_entries = max_entries
+
+    @property
+    def folder(self) -> str:
+        if not self._folder:
+            self._folder = cache_dir("pdf")
+        return self._folder
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.folder, f"{key}.pdf")
+
+    def fetch(self, key: str, dest: str) -> bool:
+        entry = self._entry(key)
+        if not os.path.exists(entry):
+            return False
+        try:
+            shutil.copyfile(entry, dest)
+            os.utime(entry)
+        except OSError:
+            return False
+        return True
+
+    def store(self, key: str, src: str):
+        entry = self._entry(key)
+        try:
+            shutil.copyfile(src, entry + ".tmp")
+            os.replace(entry + ".tmp", entry)
+            self._prune()
+        except OSError:
+            pass
+
+    def _prune(self):
+        entries = [os.path.join(self.folder, name) for name in os.listdir(self.folder) if name.endswith(".pdf")]
+        if len(entries) <= self.max_entries:
+            return
+        entries.sort(key=os.path.getmtime)
+        for old in entries[: len(entries) - self.max_entries]:
+            os.remove(old)
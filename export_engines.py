@@ -0,0 +1,44 @@
+import os
+
+ENGINE_ENV = "SHINOBI_PDF_ENGINE"
+ENGINE_NAMES = ("auto", "reportlab", "typst")
+
+_engines = {}
+
+
+class ReportLabEngine:
+    name = "reportlab"
+
+    def available(self) -> bool:
+        return True
+
+    def export(self, path: str, title: str, text: str, img_path: str = "", parser=None, progress=None, use_cache=True):
+        from pdf_export import save_pdf_file
+
+        save_pdf_file(path, title, text, img_path, parser=parser, progress=progress, use_cache=use_cache)
+
+    def close(self):
+        pass
+
+
+def get_engine(name: str = ""):
+    # auto / typst は typst コマンドがあれば Typst、無ければ ReportLab。エンジンはプロセス内で使い回す
+    name = name or os.environ.get(ENGINE_ENV, "") or "auto"
+    if name in ("auto", "typst"):
+        engine = _engines.get("typst")
+        if engine is None:
+            from typst_export import TypstEngine
+
+            engine = _engines["typst"] = TypstEngine()
+        if engine.available():
+            return engine
+    engine = _engines.get("reportlab")
+    if engine is None:
+        engine = _engines["reportlab"] = ReportLabEngine()
+    return engine
+
+
+def close_engines():
+    for engine in _engines.values():
+        engine.close()
+    _engines.clear()
@@ -0,0 +1,207 @@
+import multiprocessing
+import multiprocessing.connection
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import profiling
+
+
+@dataclass(frozen=True)
+class ExportJob:
+    path: str
+    title: str
+    text: str
+    img_path: str = ""
+    profile: bool = False
+    engine: str = ""
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def _exit_with_parent(cleanup):
+    # アプリが落ちた・terminate された時も、typst watch などの子プロセスを残さずに終わる
+    def finish(*_):
+        try:
+            cleanup()
+        finally:
+            os._exit(0)
+
+    if os.name != "nt":
+        signal.signal(signal.SIGTERM, finish)
+    parent = multiprocessing.parent_process()
+    if parent is None:
+        return
+
+    def watch():
+        # 親が終わると sentinel が読めるようになる (強制終了でも)
+        multiprocessing.connection.wait([parent.sentinel])
+        finish()
+
+    threading.Thread(target=watch, name="parent-watch", daemon=True).start()
+
+
+def _worker_main(jobs, events, cancel):
+    # フォント登録とパーサーをジョブ間で使い回すため、ワーカーは常駐させる
+    started_at = time.perf_counter()
+    from blocks import IncrementalBlockParser
+    from export_engines import close_engines, get_engine
+    from pdf_export import register_pdf_font
+
+    _exit_with_parent(close_engines)
+    font_name = register_pdf_font()
+    if os.environ.get("SHINOBI_STARTUP_TIMING"):
+        elapsed = (time.perf_counter() - started_at) * 1000
+        print(f"[startup] export worker ready ({font_name}): {elapsed:.1f} ms", file=sys.stderr)
+    parser = IncrementalBlockParser()
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        def on_progress(kind, value):
+            if cancel.is_set():
+                raise ExportCancelled()
+            if kind == "PAGE":
+                events.put(("page", value))
+
+        profiling.set_enabled(job.profile)
+        try:
+            engine = get_engine(job.engine)
+            with profiling.span("pdf.export"):
+                engine.export(job.path, job.title, job.text, job.img_path, parser=parser, progress=on_progress)
+            result = ("done", engine.name)
+        except ExportCancelled:
+            result = ("cancelled", None)
+        except Exception as err:
+            result = ("error", str(err))
+        if job.profile:
+            events.put(("spans", profiling.drain_events()))
+        events.put(result)
+    close_engines()
+
+
+class PdfExportWorker:
+    # on_event(kind, job, value) は監視スレッドから呼ばれる
+    # kind: started / page / done / cancelled / error / superseded
+
+    def __init__(self, on_event):
+        self._ctx = multiprocessing.get_context("spawn")
+        self._on_event = on_event
+        self._cond = threading.Condition()
+        self._pending = None
+        self._running = None
+        self._closed = False
+        self._thread = None
+        self._process = None
+        self._jobs = None
+        self._events = None
+        self._cancel = self._ctx.Event()
+        self._process_lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._running is not None or self._pending is not None
+
+    def submit(self, job: ExportJob):
+        with self._cond:
+            superseded = self._pending
+            self._pending = job
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="pdf-export", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        if superseded is not None:
+            self._on_event("superseded", superseded, None)
+
+    def cancel(self):
+        with self._cond:
+            dropped = self._pending
+            self._pending = None
+            if self._running is not None:
+                self._cancel.set()
+        if dropped is not None:
+            self._on_event("cancelled", dropped, None)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._pending = None
+            self._cancel.set()
+            self._cond.notify()
+        if self._process is not None and self._process.is_alive():
+            self._jobs.put(None)
+            self._process.join(timeout=2)
+            if self._process.is_alive():
+                self._process.terminate()
+
+    def warm_up(self):
+        # ReportLab の読み込みとフォント解析を初回描画後にバックグラウンドで済ませておく
+        threading.Thread(target=self._warm_up, name="pdf-export-warmup", daemon=True).start()
+
+    def _warm_up(self):
+        try:
+            self._ensure_process()
+        except Exception:
+            pass
+
+    def _ensure_process(self):
+        with self._process_lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            self._jobs = self._ctx.Queue()
+            self._events = self._ctx.Queue()
+            self._process = self._ctx.Process(
+                target=_worker_main,
+                args=(self._jobs, self._events, self._cancel),
+                name="pdf-export-worker",
+                daemon=True,
+            )
+            self._process.start()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._pending is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                job = self._pending
+                self._pending = None
+                self._running = job
+                self._cancel.clear()
+
+            try:
+                self._ensure_process()
+            except Exception as err:
+                with self._cond:
+                    self._running = None
+                self._process = None
+                self._on_event("error", job, str(err))
+                continue
+            self._jobs.put(job)
+            self._on_event("started", job, None)
+            while True:
+                try:
+                    kind, value = self._events.get(timeout=0.5)
+                except queue.Empty:
+                    if self._process.is_alive():
+                        continue
+                    self._process = None
+                    kind, value = "error", "PDF出力プロセスが終了しました"
+                if kind == "page":
+                    self._on_event(kind, job, value)
+                    continue
+                if kind == "spans":
+                    profiling.merge(value)
+                    continue
+                with self._cond:
+                    self._running = None
+                self._on_event(kind, job, value)
+                break
@@ -0,0 +1,168 @@
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+
+from blocks import parse_blocks
+from export_engines import ENGINE_NAMES, get_engine
+from inline import plain_text
+from pdf_export import register_pdf_font
+from project_store import read_project
+
+MARKER_TYPES = ("ho", "secret")
+_UNSAFE_NAME = re.compile(r'[\\/:*?"<>|\s]+')
+
+
+@dataclass(frozen=True)
+class Handout:
+    name: str
+    blocks: tuple
+
+
+def split_handouts(blocks):
+    # HO / 袋とじのブロックから、次の見出し・HO・袋とじの手前までを 1 枚のハンドアウトにする
+    handouts = []
+    current = None
+    for block in blocks:
+        block_type = block[0]
+        if block_type in MARKER_TYPES:
+            current = [block]
+            handouts.append(current)
+        elif block_type == "heading":
+            current = None
+        elif current is not None:
+            current.append(block)
+    result = []
+    for group in handouts:
+        while group[-1][0] == "blank":
+            group.pop()
+        block_type, body = group[0]
+        name = plain_text(body) if block_type == "ho" else f"SECRET {plain_text(body)}"
+        result.append(Handout(name, tuple(group)))
+    return result
+
+
+def blocks_to_text(blocks) -> str:
+    # parse_blocks で同じブロックに戻る書き方。出力キャッシュのキーに使う
+    lines = []
+    for block_type, body in blocks:
+        if block_type == "heading":
+            lines.append(f"# {body}")
+        elif block_type == "quote":
+            lines.append(f"> {body}")
+        elif block_type == "ho":
+            lines.append(f"{{{{{body}}}}}")
+        elif block_type == "secret":
+            lines.append(f":::secret {body} :::")
+        else:
+            lines.append(body)
+    return "\n".join(lines)
+
+
+def handout_file_name(index: int, handout: Handout) -> str:
+    name = _UNSAFE_NAME.sub("_", handout.name).strip("_")[:40] or "handout"
+    return f"{index + 1:02d}_{name}.pdf"
+
+
+class _ParsedBlocks:
+    # エンジンの parser 引数に渡す。親プロセスで解析済みのブロックをそのまま返す
+    def __init__(self, blocks):
+        self.blocks = list(blocks)
+
+    def parse(self, text: str):
+        return self.blocks
+
+
+def export_handout(pdf_path: str, title: str, handout: Handout, use_cache: bool = True, engine: str = "") -> dict:
+    started = time.perf_counter()
+    result = {"handout": handout.name, "pdf": pdf_path, "ok": False, "error": ""}
+    try:
+        exporter = get_engine(engine)
+        result["engine"] = exporter.name
+        exporter.export(
+            pdf_path,
+            f"{title} - {handout.name}" if title else handout.name,
+            blocks_to_text(handout.blocks),
+            parser=_ParsedBlocks(handout.blocks),
+            use_cache=use_cache,
+        )
+        result["ok"] = True
+    except Exception as err:
+        result["error"] = f"{type(err).__name__}: {err}"
+    result["seconds"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def export_handouts(zip_path: str, title: str, text: str, jobs: int = 0, use_cache: bool = True, on_result=None, engine: str = ""):
+    # 解析は 1 回だけ。各ハンドアウトは常駐ワーカー (フォント登録済み) で並列に書き出し、1 つの zip にまとめる
+    handouts = split_handouts(parse_blocks(text))
+    if not handouts:
+        raise ValueError("HO / 袋とじのブロックがありません")
+    results = []
+    with tempfile.TemporaryDirectory(prefix="shinobi-handouts-") as folder:
+        names = [handout_file_name(i, handout) for i, handout in enumerate(handouts)]
+        workers = min(jobs or os.cpu_count() or 1, len(handouts))
+        # アプリ (スレッドを抱えたプロセス) からも呼ぶので fork ではなく spawn で起動する
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=register_pdf_font) as pool:
+            futures = [
+                pool.submit(export_handout, os.path.join(folder, name), title, handout, use_cache, engine)
+                for name, handout in zip(names, handouts)
+            ]
+            for future in as_completed(futures):
+                result = future.result()
+                results.append(result)
+                if on_result is not None:
+                    on_result(result)
+
+        tmp_path = zip_path + ".tmp"
+        # PDF は圧縮済みなので無圧縮で詰める
+        with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_STORED) as bundle:
+            for name in names:
+                path = os.path.join(folder, name)
+                if os.path.exists(path):
+                    bundle.write(path, name)
+        os.replace(tmp_path, zip_path)
+    # 一時フォルダは消えるので、結果の pdf は zip 内の名前にする
+    for result in results:
+        result["pdf"] = os.path.basename(result["pdf"])
+    results.sort(key=lambda r: names.index(r["pdf"]))
+    return results
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="HO・袋とじごとのハンドアウト PDF を 1 つの zip に書き出します。")
+    parser.add_argument("project", help="プロジェクトのパス (.shinobi / .json)")
+    parser.add_argument("-o", "--output", default="", help="zip の出力先（省略時はプロジェクトと同じ場所の <名前>-handouts.zip）")
+    parser.add_argument("-j", "--jobs", type=int, default=0, help="並列プロセス数（省略時は CPU コア数）")
+    parser.add_argument("--no-cache", action="store_true", help="出力キャッシュを使わずに書き出す")
+    parser.add_argument("--engine", choices=ENGINE_NAMES, default="", help="PDF エンジン（batch_export と同じ）")
+    args = parser.parse_args(argv)
+
+    data = read_project(args.project)
+    output = args.output or os.path.splitext(args.project)[0] + "-handouts.zip"
+
+    def on_result(result):
+        status = "OK " if result["ok"] else "NG "
+        detail = os.path.basename(result["pdf"]) if result["ok"] else result["error"]
+        print(f"{status}{result['seconds']:8.3f}s  {result['handout']} -> {detail}")
+
+    started = time.perf_counter()
+    try:
+        results = export_handouts(output, data["title"], data["text_content"], args.jobs, not args.no_cache, on_result, args.engine)
+    except ValueError as err:
+        print(err, file=sys.stderr)
+        return 2
+    failed = sum(1 for r in results if not r["ok"])
+    print(f"{len(results)} 件 / 失敗 {failed} 件 / {time.perf_counter() - started:.2f}s -> {output}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+import os
+import sys
+import time
+from collections import deque
+
+HISTORY_ENV = "SHINOBI_HISTORY_MB"
+DEFAULT_HISTORY_MB = 8
+MERGE_SECONDS = 1.0
+# 入力が続いていても、この間隔で取り消しの単位を区切る
+CHECKPOINT_SECONDS = 5.0
+ENTRY_OVERHEAD = 64
+# 入力欄の取り消しが戻しうる値として控えておく数
+FIELD_VALUES = 32
+
+
+def history_budget_from_env() -> int:
+    try:
+        mb = float(os.environ.get(HISTORY_ENV, "") or DEFAULT_HISTORY_MB)
+    except ValueError:
+        mb = DEFAULT_HISTORY_MB
+    return int(max(mb, 0.1) * 1024 * 1024)
+
+
+class Edit:
+    # 位置 at の deleted を inserted に置き換えた編集。全文は持たない
+    __slots__ = ("at", "deleted", "inserted", "typing", "started", "last")
+
+    def __init__(self, at: int, deleted: str, inserted: str, typing: bool, now: float):
+        self.at = at
+        self.deleted = deleted
+        self.inserted = inserted
+        self.typing = typing
+        self.started = now
+        self.last = now
+
+    def size(self) -> int:
+        return sys.getsizeof(self.deleted) + sys.getsizeof(self.inserted) + ENTRY_OVERHEAD
+
+    def try_merge(self, at: int, deleted: str, inserted: str, now: float) -> bool:
+        # 続けて打った文字・続けて消した文字を 1 つにまとめる。改行と一定時間ごとに区切る
+        if now - self.last > MERGE_SECONDS or now - self.started > CHECKPOINT_SECONDS or "\n" in inserted:
+            return False
+        if not deleted and not self.deleted and at == self.at + len(self.inserted):
+            self.inserted += inserted
+        elif not inserted and not self.inserted and at + len(deleted) == self.at:
+            # Backspace
+            self.at = at
+            self.deleted = deleted + self.deleted
+        elif not inserted and not self.inserted and at == self.at:
+            # Delete
+            self.deleted += deleted
+        else:
+            return False
+        self.last = now
+        return True
+
+
+class EditHistory:
+    # 取り消し・やり直し。差分を古い順に持ち、合計が max_bytes を超えたら古いものから捨てる
+
+    def __init__(self, max_bytes: int = 0):
+        self.max_bytes = max_bytes or history_budget_from_env()
+        self._undo = deque()
+        self._redo = []
+        self.bytes = 0
+
+    def can_undo(self) -> bool:
+        return bool(self._undo)
+
+    def can_redo(self) -> bool:
+        return bool(self._redo)
+
+    def record(self, at: int, deleted: str, inserted: str, typing: bool = False):
+        now = time.monotonic()
+        self._redo.clear()
+        last = self._undo[-1] if self._undo else None
+        if typing and last is not None and last.typing:
+            before = last.size()
+            if last.try_merge(at, deleted, inserted, now):
+                self.bytes += last.size() - before
+                self._trim()
+                return
+        edit = Edit(at, deleted, inserted, typing, now)
+        self._undo.append(edit)
+        self.bytes += edit.size()
+        self._trim()
+
+    def checkpoint(self):
+        # 次の入力を新しい取り消し単位にする (スニペット挿入・タブ切り替えの前など)
+        if self._undo:
+            self._undo[-1].typing = False
+
+    def _trim(self):
+        while self.bytes > self.max_bytes and len(self._undo) > 1:
+            self.bytes -= self._undo.popleft().size()
+
+    def undo(self):
+        # 戻すべき編集を返す。呼び出し側は (at, len(inserted)) を deleted に戻す
+        if not self._undo:
+            return None
+        edit = self._undo.pop()
+        self.bytes -= edit.size()
+        self._redo.append(edit)
+        return edit
+
+    def redo(self):
+        if not self._redo:
+            return None
+        edit = self._redo.pop()
+        edit.typing = False
+        self._undo.append(edit)
+        self.bytes += edit.size()
+        self._trim()
+        return edit
+
+
+class FieldValues:
+    # 入力欄 (Flutter) が表示した値の控え。入力欄自身の取り消し・やり直しは、このどれかに戻すことしかできない。
+    # 全文は持たず (長さ, ハッシュ) だけを覚える
+    def __init__(self, limit: int = FIELD_VALUES):
+        self._values = deque(maxlen=limit)
+        self._expected = set()
+        # まだ届いていないクライアント側の取り消しの数
+        self._pending = 0
+
+    @staticmethod
+    def _key(value: str):
+        return len(value), hash(value)
+
+    def seen(self, value: str):
+        key = self._key(value)
+        if not self._values or self._values[-1] != key:
+            self._values.append(key)
+
+    def expect_client_undo(self):
+        # Ctrl+Z/Y でアプリの履歴を戻す直前に呼ぶ。
+        # 入力欄の取り消しは押した時点の値 (最後の値) からは必ず離れるので、それと同じ値は打ち直した入力として扱う
+        if self._pending:
+            self._expected.update(self._values)
+        else:
+            self._expected = set(self._values)
+            if self._values:
+                self._expected.discard(self._values[-1])
+        self._pending += 1
+
+    def is_client_undo(self, value: str) -> bool:
+        if not self._pending:
+            return False
+        if self._key(value) in self._expected:
+            self._pending -= 1
+            return True
+        # 控えに無い値は利用者の入力。入力欄の取り消しはもう来ない
+        self._pending = 0
+        return False
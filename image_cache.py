@@ -0,0 +1,127 @@
+import hashlib
+import os
+from dataclasses import dataclass
+
+from cache_paths import cache_dir
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow が無ければ元画像をそのまま使う
+    Image = None
+
+MAX_CACHED_IMAGES = 64
+
+
+@dataclass(frozen=True)
+class ImagePolicy:
+    # プレビューは表示サイズ (高 DPI 画面向けに 2 倍) に収まる大きさ、PDF は印刷 DPI で枠に収まる大きさにする
+    preview_width: int = 800
+    preview_height: int = 400
+    print_dpi: int = 200
+    jpeg_quality: int = 88
+
+    def key(self) -> str:
+        return f"{self.preview_width}x{self.preview_height}:{self.print_dpi}:{self.jpeg_quality}"
+
+
+def _policy_from_env() -> ImagePolicy:
+    dpi = os.environ.get("SHINOBI_IMAGE_DPI")
+    return ImagePolicy(print_dpi=int(dpi)) if dpi else ImagePolicy()
+
+
+_policy = _policy_from_env()
+_paths = {}
+_readers = {}
+
+
+def get_policy() -> ImagePolicy:
+    return _policy
+
+
+def set_policy(policy: ImagePolicy):
+    global _policy
+    _policy = policy
+    _paths.clear()
+    _readers.clear()
+
+
+def _stamp(img_path: str):
+    st = os.stat(img_path)
+    return os.path.abspath(img_path), st.st_mtime_ns, st.st_size
+
+
+def _resampled(img_path: str, max_w: int, max_h: int) -> str:
+    # 枠より小さい JPEG はそのまま、それ以外は縮小して JPEG に焼き直す (path + mtime ごとに 1 回)
+    if Image is None or not img_path or not os.path.exists(img_path):
+        return img_path
+    stamp = _stamp(img_path)
+    memo_key = (stamp, max_w, max_h, _policy.jpeg_quality)
+    path = _paths.get(memo_key)
+    if path is not None and os.path.exists(path):
+        return path
+
+    name = hashlib.sha1(repr(memo_key).encode("utf-8")).hexdigest()
+    folder = cache_dir("images")
+    path = os.path.join(folder, f"{name}.jpg")
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        with Image.open(img_path) as im:
+            if im.format == "JPEG" and im.width <= max_w and im.height <= max_h:
+                _paths[memo_key] = img_path
+                return img_path
+            im.draft("RGB", (max(max_w, max_h), max(max_w, max_h)))
+            im = ImageOps.exif_transpose(im)
+            if im.mode in ("RGBA", "LA", "P"):
+                # ページ背景は白なので透過は白で合成する
+                rgba = im.convert("RGBA")
+                im = Image.new("RGB", rgba.size, "white")
+                im.paste(rgba, mask=rgba.getchannel("A"))
+            elif im.mode != "RGB":
+                im = im.convert("RGB")
+            im.thumbnail((max_w, max_h), Image.LANCZOS)
+            im.save(path + ".tmp", "JPEG", quality=_policy.jpeg_quality, optimize=True)
+        os.replace(path + ".tmp", path)
+        _prune(folder)
+    if len(_paths) > 4 * MAX_CACHED_IMAGES:
+        _paths.clear()
+    _paths[memo_key] = path
+    return path
+
+
+def _prune(folder: str):
+    entries = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith(".jpg")]
+    if len(entries) <= MAX_CACHED_IMAGES:
+        return
+    entries.sort(key=os.path.getmtime)
+    for old in entries[: len(entries) - MAX_CACHED_IMAGES]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass
+
+
+def preview_image(img_path: str) -> str:
+    try:
+        return _resampled(img_path, _policy.preview_width, _policy.preview_height)
+    except OSError:
+        return img_path
+
+
+def print_image(img_path: str, box_w: float, box_h: float) -> str:
+    # box はポイント単位 (1/72 inch)
+    dpi = _policy.print_dpi
+    return _resampled(img_path, max(1, round(box_w * dpi / 72)), max(1, round(box_h * dpi / 72)))
+
+
+def print_image_reader(img_path: str, box_w: float, box_h: float):
+    # ImageReader を使い回すと RGB 展開とハッシュ計算が初回だけで済み、JPEG はそのまま埋め込まれる
+    from reportlab.lib.utils import ImageReader
+
+    key = (_stamp(img_path), round(box_w, 2), round(box_h, 2), _policy.key())
+    reader = _readers.get(key)
+    if reader is None:
+        if len(_readers) >= 8:
+            _readers.clear()
+        reader = _readers[key] = ImageReader(print_image(img_path, box_w, box_h))
+    return reader
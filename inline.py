@@ -0,0 +1,77 @@
+import functools
+import re
+
+# 行内記法: {漢字}(よみ) のルビ、**強調**、\ による記号のエスケープ
+_RUBY = r"\{([^{}\n]+)\}\(([^()\n]+)\)"
+_RUBY_PATTERN = re.compile(_RUBY)
+_TOKEN = re.compile(r"\\([\\{}()*])|" + _RUBY + r"|\*\*")
+
+MAX_CACHED_BODIES = 65536
+
+
+@functools.lru_cache(maxsize=MAX_CACHED_BODIES)
+def lex_inline(body: str):
+    # 本文を 1 回走査して (文字列, 強調か) の並びにする。隣り合う同じ書式はまとめる
+    if not body:
+        return ()
+    if "*" not in body and "\\" not in body:
+        # ルビだけなら置換 1 回で済む
+        return ((_RUBY_PATTERN.sub(r"\1(\2)", body) if "{" in body else body, False),)
+    pieces = []
+    markers = []
+    pos = 0
+    for m in _TOKEN.finditer(body):
+        if m.start() > pos:
+            pieces.append(body[pos : m.start()])
+        if m.group(1) is not None:
+            pieces.append(m.group(1))
+        elif m.group(2) is not None:
+            pieces.append(f"{m.group(2)}({m.group(3)})")
+        else:
+            markers.append(len(pieces))
+            pieces.append(None)
+        pos = m.end()
+    if pos < len(body):
+        pieces.append(body[pos:])
+    if len(markers) % 2:
+        # 閉じていない ** は文字として残す
+        pieces[markers.pop()] = "**"
+
+    runs = []
+    buffer = []
+    bold = False
+    for piece in pieces:
+        if piece is None:
+            if buffer:
+                runs.append(("".join(buffer), bold))
+                buffer = []
+            bold = not bold
+        else:
+            buffer.append(piece)
+    if buffer:
+        runs.append(("".join(buffer), bold))
+    return tuple(runs)
+
+
+def _escape(text: str) -> str:
+    if "&" in text:
+        text = text.replace("&", "&amp;")
+    if "<" in text:
+        text = text.replace("<", "&lt;")
+    if ">" in text:
+        text = text.replace(">", "&gt;")
+    return text
+
+
+def plain_text(body: str) -> str:
+    return "".join(text for text, _ in lex_inline(body))
+
+
+def has_emphasis(body: str) -> bool:
+    return any(bold for _, bold in lex_inline(body))
+
+
+@functools.lru_cache(maxsize=MAX_CACHED_BODIES)
+def inline_markup(body: str) -> str:
+    # ReportLab Paragraph 用。& < > はエスケープ済み
+    return "".join(f"<b>{_escape(text)}</b>" if bold else _escape(text) for text, bold in lex_inline(body))
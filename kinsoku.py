@@ -0,0 +1,129 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+from reportlab.pdfbase.pdfmetrics import getAscentDescent, stringWidth
+from reportlab.platypus import Paragraph
+
+# 行頭に来てはいけない文字 / 行末に来てはいけない文字
+NO_LINE_START = frozenset(
+    "、。，．,.・：；:;？！?!゛゜ヽヾゝゞ々〻ー‐–—～〜…‥"
+    "）〕］｝〉》」』】〙〗)]}’”»"
+    "ぁぃぅぇぉっゃゅょゎゕゖァィゥェォッャュョヮヵヶㇰㇱㇲㇳㇴㇵㇶㇷㇸㇹㇺㇻㇼㇽㇾㇿ"
+)
+NO_LINE_END = frozenset("（〔［｛〈《「『【〘〖([{‘“«")
+
+_tables = {}
+
+
+def advance_table(font_name: str, font_size: float) -> dict:
+    # フォント・サイズごとの 文字 → 送り幅 (pt)。未登録の文字は使われた時に足す
+    key = (font_name, font_size)
+    table = _tables.get(key)
+    if table is None:
+        table = _tables[key] = {}
+    return table
+
+
+def _fill(table: dict, text: str, font_name: str, font_size: float):
+    missing = set(text).difference(table)
+    for ch in missing:
+        table[ch] = stringWidth(ch, font_name, font_size)
+
+
+def cumulative_widths(text: str, font_name: str, font_size: float):
+    # cum[i] = text[:i] の幅
+    table = advance_table(font_name, font_size)
+    _fill(table, text, font_name, font_size)
+    return list(accumulate(map(table.__getitem__, text), initial=0.0))
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isascii() and ch.isalnum()
+
+
+def _adjust_break(text: str, start: int, end: int) -> int:
+    # 追い出し: 禁則を満たす位置まで区切りを前へ。1 文字しか残らないなら元の位置で切る
+    brk = end
+    while brk > start + 1 and (text[brk] in NO_LINE_START or text[brk - 1] in NO_LINE_END):
+        brk -= 1
+    if text[brk] in NO_LINE_START or text[brk - 1] in NO_LINE_END:
+        brk = end
+    # 英数字の単語の途中なら直前の空白で切る
+    if _is_word_char(text[brk - 1]) and _is_word_char(text[brk]):
+        space = text.rfind(" ", start + 1, brk)
+        if space > start:
+            brk = space + 1
+    return brk
+
+
+def break_lines(text: str, max_widths, font_name: str, font_size: float):
+    # [(余り幅, 行文字列, 区切りの空白), ...]。max_widths は行ごとの幅 (足りない分は最後の値を繰り返す)
+    cum = cumulative_widths(text, font_name, font_size)
+    n = len(text)
+    last = len(max_widths) - 1
+    lines = []
+    start = 0
+    while start < n:
+        while start < n and text[start] == " ":
+            start += 1
+        if start >= n:
+            break
+        max_width = max_widths[min(len(lines), last)]
+        end = max(start + 1, bisect_right(cum, cum[start] + max_width + 1e-8, start + 1) - 1)
+        if end < n:
+            end = _adjust_break(text, start, end)
+        stop = end
+        while stop > start + 1 and text[stop - 1] == " ":
+            stop -= 1
+        while end < n and text[end] == " ":
+            end += 1
+        lines.append((max_width - (cum[stop] - cum[start]), text[start:stop], text[stop:end]))
+        start = end
+    return lines
+
+
+class _Line(str):
+    # 分割後の Paragraph に渡る単語。tail (行末で詰めた空白) を戻して連結し直す
+    tail = ""
+
+    def source(self) -> str:
+        return self + self.tail
+
+
+class KinsokuParagraph(Paragraph):
+    # 単一書式の段落だけ禁則処理つきの行分割に置き換える。それ以外は ReportLab の処理に任せる
+
+    def breakLines(self, width):
+        frags = self.frags
+        style = self.style
+        if (
+            len(frags) != 1
+            or self.bulletText
+            or style.endDots
+            or style.wordWrap
+            or hasattr(frags[0], "cbDefn")
+            or hasattr(frags[0], "backColor")
+        ):
+            return super().breakLines(width)
+        f = frags[0]
+        if hasattr(f, "text"):
+            text = f.text.strip()
+        elif all(isinstance(word, _Line) for word in f.words):
+            # 別の幅の枠で組み直すこともあるので、区切りの空白も元どおりにする
+            text = "".join(word.source() for word in f.words).strip()
+        else:
+            return super().breakLines(width)
+
+        max_widths = list(width) if isinstance(width, (list, tuple)) else [width]
+        ascent, descent = getAscentDescent(f.fontName, f.fontSize)
+        lines = []
+        width_max = 0
+        if text:
+            last = len(max_widths) - 1
+            for i, (space, line, tail) in enumerate(break_lines(text, max_widths, f.fontName, f.fontSize)):
+                width_max = max(width_max, max_widths[min(i, last)] - space)
+                word = _Line(line)
+                word.tail = tail
+                lines.append((space, [word]))
+        self._width_max = width_max
+        return f.clone(kind=0, lines=lines, ascent=ascent, descent=descent, fontSize=f.fontSize)
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import profiling
+
+DEBOUNCE_SECONDS = 0.18
+FRAME_BUDGET_SECONDS = 0.008
+
+
+class LivePreviewPipeline:
+    # 入力中の更新要求をまとめ、解析と差分適用を裏スレッドで行う。
+    # 新しい入力が来た時点で古い世代の作業は打ち切る
+
+    def __init__(self, parser, preview, toc, get_header, delay: float = DEBOUNCE_SECONDS, budget: float = FRAME_BUDGET_SECONDS, on_error=None):
+        self.parser = parser
+        self.preview = preview
+        self.toc = toc
+        self.get_header = get_header
+        self.on_error = on_error
+        self.delay = delay
+        self.budget = budget
+        self._cond = threading.Condition()
+        self._render_lock = threading.Lock()
+        self._pending = None
+        self._deadline = 0.0
+        self._generation = 0
+        self._thread = None
+        # blocks → ページ割りの見積もり。None なら見積もらない
+        self.layout = None
+
+    def submit(self, text):
+        # キー入力ごとに呼ばれる。最後の入力から delay 秒経ってから 1 回だけ描画する。
+        # text は本文を返す関数でもよい
+        with self._cond:
+            self._pending = text
+            self._generation += 1
+            self._deadline = time.monotonic() + self.delay
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="live-preview", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def refresh_now(self, text: str):
+        # 読込・スニペット挿入・Ctrl+R などは待たずに呼び出し元スレッドで描画する
+        with self._cond:
+            self._pending = None
+            self._generation += 1
+            generation = self._generation
+        self._render(text, generation, None)
+
+    def bind(self, parser, preview, toc):
+        # タブ切り替え。切り替え前の入力は前のタブのものなので捨て、描画中の分は打ち切らせる
+        with self._cond:
+            self._pending = None
+            self._generation += 1
+        with self._render_lock:
+            self.parser = parser
+            self.preview = preview
+            self.toc = toc
+
+    def add_parser_listener(self, listener):
+        # 裏スレッドの解析と重ならないよう描画ロックの中で登録する (登録時に現在の行がまとめて渡る)
+        with self._render_lock:
+            self.parser.add_listener(listener)
+
+    def _is_stale(self, generation: int) -> bool:
+        return generation != self._generation
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._pending is None:
+                        self._cond.wait()
+                        continue
+                    remaining = self._deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                text = self._pending
+                self._pending = None
+                generation = self._generation
+            try:
+                if callable(text):
+                    # 本文の組み立ては入力を受けたスレッドではなくここで行う
+                    text = text()
+                self._render(text, generation, self.budget)
+            except Exception as err:
+                # 裏スレッドの例外は握りつぶさず呼び出し側に知らせ、次の入力からまた描画する
+                if self.on_error is not None:
+                    self.on_error(err)
+
+    def _render(self, text: str, generation: int, budget):
+        with self._render_lock:
+            if self._is_stale(generation):
+                return
+            with profiling.span("parse_blocks"):
+                blocks = self.parser.parse(text)
+            if self._is_stale(generation):
+                return
+            with profiling.span("update_toc"):
+                self.toc.refresh()
+            layout = None
+            if self.layout is not None:
+                with profiling.span("estimate_pages"):
+                    layout = self.layout(blocks)
+                if self._is_stale(generation):
+                    return
+            title, img_path = self.get_header()
+            with profiling.span("update_preview"):
+                self.preview.render(title, img_path, blocks, budget, lambda: self._is_stale(generation), layout)
@@ -0,0 +1,130 @@
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+CHUNK_LINES = 512
+
+
+def heading_of(raw_line: str):
+    text = raw_line.strip()
+    if text.startswith("# "):
+        return 1, text[2:]
+    if text.startswith("## "):
+        return 2, text[3:]
+    return None
+
+
+class _Chunk:
+    __slots__ = ("lengths", "starts", "headings")
+
+    def __init__(self, lengths, headings):
+        self.lengths = lengths
+        self.starts = array("l", accumulate(lengths, initial=0))
+        self.headings = headings
+
+
+class OutlineIndex:
+    # 見出し (# / ##) と行頭オフセット表。行はチャンク単位で持ち、編集差分の範囲だけ組み直す
+
+    def __init__(self):
+        self._chunks = []
+        self._line_starts = []
+        self._char_starts = []
+        self.line_count = 0
+        self.char_count = 0
+        self.version = 0
+
+    def apply(self, head: int, old_stop: int, new_lines):
+        new_lengths = array("l", map(len, new_lines))
+        new_headings = []
+        for i, line in enumerate(new_lines):
+            heading = heading_of(line)
+            if heading is not None:
+                new_headings.append((i, *heading))
+
+        if not self._chunks:
+            c0, c1, base = 0, -1, 0
+            lengths = array("l")
+            headings = []
+        else:
+            c0 = self._chunk_for_line(head)
+            c1 = self._chunk_for_line(max(head, old_stop - 1))
+            base = self._line_starts[c0]
+            lengths = array("l")
+            headings = []
+            for chunk_index in range(c0, c1 + 1):
+                chunk = self._chunks[chunk_index]
+                offset = len(lengths)
+                headings.extend((rel + offset, level, title) for rel, level, title in chunk.headings)
+                lengths.extend(chunk.lengths)
+
+        a = head - base
+        b = old_stop - base
+        shift = len(new_lengths) - (b - a)
+        removed = any(a <= rel < b for rel, _, _ in headings)
+        merged_headings = [h for h in headings if h[0] < a]
+        merged_headings.extend((rel + a, level, title) for rel, level, title in new_headings)
+        merged_headings.extend((rel + shift, level, title) for rel, level, title in headings if rel >= b)
+        merged_lengths = lengths[:a] + new_lengths + lengths[b:]
+
+        chunks = []
+        for start in range(0, len(merged_lengths), CHUNK_LINES):
+            stop = start + CHUNK_LINES
+            chunk_headings = [(rel - start, level, title) for rel, level, title in merged_headings if start <= rel < stop]
+            chunks.append(_Chunk(merged_lengths[start:stop], chunk_headings))
+        self._chunks[c0 : c1 + 1] = chunks
+        self._rebuild_prefix()
+        if removed or new_headings:
+            self.version += 1
+
+    def _rebuild_prefix(self):
+        line_starts = []
+        char_starts = []
+        lines = 0
+        chars = 0
+        for chunk in self._chunks:
+            line_starts.append(lines)
+            char_starts.append(chars)
+            lines += len(chunk.lengths)
+            chars += chunk.starts[-1]
+        self._line_starts = line_starts
+        self._char_starts = char_starts
+        self.line_count = lines
+        self.char_count = chars
+
+    def _chunk_for_line(self, line: int) -> int:
+        return max(0, min(bisect_right(self._line_starts, line) - 1, len(self._chunks) - 1))
+
+    def line_offset(self, line: int) -> int:
+        if line <= 0 or not self._chunks:
+            return 0
+        if line >= self.line_count:
+            return self.char_count
+        c = bisect_right(self._line_starts, line) - 1
+        return self._char_starts[c] + self._chunks[c].starts[line - self._line_starts[c]]
+
+    def line_at_offset(self, offset: int) -> int:
+        if offset <= 0 or not self._chunks:
+            return 0
+        if offset >= self.char_count:
+            return max(0, self.line_count - 1)
+        c = bisect_right(self._char_starts, offset) - 1
+        return self._line_starts[c] + bisect_right(self._chunks[c].starts, offset - self._char_starts[c]) - 1
+
+    def headings(self):
+        result = []
+        for chunk, first_line in zip(self._chunks, self._line_starts):
+            result.extend((first_line + rel, level, title) for rel, level, title in chunk.headings)
+        return result
+
+    def section_at(self, line: int):
+        # line を含む見出しから、同じか上の階層の次の見出しの手前まで。(開始行, 終了行, 見出し)
+        start, level, title = 0, 0, ""
+        end = self.line_count
+        for heading_line, heading_level, heading_title in self.headings():
+            if heading_line <= line:
+                start, level, title = heading_line, heading_level, heading_title
+            elif level == 0 or heading_level <= level:
+                end = heading_line
+                break
+        return start, end, title
@@ -0,0 +1,100 @@
+import math
+from dataclasses import dataclass, field
+
+from reportlab import rl_config
+from reportlab.platypus import Frame, Paragraph
+
+from pdf_export import STYLE_VERSION, get_flowable_factory, page_frames, register_pdf_font
+
+MAX_MEASURED_BLOCKS = 50000
+COLUMN_NAMES = ("左段", "右段")
+
+
+@dataclass
+class PageEstimate:
+    pages: int = 1
+    # ブロック番号 → その手前に出す区切りの表示文字列のリスト (長い段落が何段もまたぐと 1 か所に複数並ぶ)
+    breaks: dict = field(default_factory=dict)
+
+
+class PageEstimator:
+    # save_pdf_file と同じ枠・同じフローアブルの高さで、ReportLab の段送りだけをなぞる。
+    # 高さは (種別, 本文, 幅) ごとに覚えるので、2 回目以降は変わったブロックの分しか組版しない
+
+    def __init__(self):
+        self.font_name = register_pdf_font()
+        self.factory = get_flowable_factory(self.font_name)
+        first, left, _ = page_frames(Frame)
+        self.first_frame = (first._aW, first._aH)
+        self.column_frame = (left._aW, left._aH)
+        self._measured = {}
+
+    def _measure(self, block, width: float):
+        # [(分割できる段落か, 高さ, 前の空き, 後の空き, 行数, 行送り), ...]
+        key = (block, width, STYLE_VERSION)
+        items = self._measured.get(key)
+        if items is not None:
+            return items
+        items = []
+        for flowable in self.factory.block(*block):
+            _, height = flowable.wrap(width, 1e9)
+            if isinstance(flowable, Paragraph):
+                lines = len(flowable.blPara.lines)
+                items.append((True, height, flowable.getSpaceBefore(), flowable.getSpaceAfter(), lines, flowable.style.leading))
+            else:
+                items.append((False, height, flowable.getSpaceBefore(), flowable.getSpaceAfter(), 0, 0.0))
+        if len(self._measured) >= MAX_MEASURED_BLOCKS:
+            del self._measured[next(iter(self._measured))]
+        self._measured[key] = items = tuple(items)
+        return items
+
+    def estimate(self, blocks) -> PageEstimate:
+        result = PageEstimate()
+        frame_index = 0
+        width, avail = self.first_frame
+        used = 0.0
+        prev_after = 0.0
+        at_top = True
+
+        for index, block in enumerate(blocks):
+            items = list(self._measure(block, width))
+            i = 0
+            while i < len(items):
+                splittable, height, before, after, lines, leading = items[i]
+                space = 0.0 if at_top else max(before - prev_after, 0.0)
+                if used + space + height <= avail + rl_config._FUZZ or (at_top and not splittable):
+                    # 空の枠にも入らない分割不可の物は、はみ出したまま置く (ReportLab では LayoutError)
+                    used += space + height + after
+                    prev_after = after
+                    at_top = at_top and space + height + after == 0
+                    i += 1
+                    continue
+
+                carried = None
+                if splittable:
+                    # Paragraph.split と同じく、入る行数が 1 行以下なら丸ごと次の段へ送る
+                    fit = int((avail - used - space) / leading)
+                    if 2 <= fit < lines:
+                        carried = lines - fit
+                frame_index += 1
+                page = 1 + (frame_index + 1) // 2
+                label = f"{page}ページ目・{COLUMN_NAMES[(frame_index - 1) % 2]}"
+                if i == 0 and carried is None:
+                    result.breaks.setdefault(index, []).append(label)
+                else:
+                    # ブロックの途中で段が変わった。区切りは次のブロックの手前に出す
+                    result.breaks.setdefault(index + 1, []).append(f"{label} (前の段落から続く)" if carried is not None else label)
+                new_width, avail = self.column_frame
+                if carried is not None:
+                    # 1 ページ目 → 2 段組で幅が変わる時は、残りの行数を幅の比で見積もる
+                    if new_width != width:
+                        carried = math.ceil(carried * width / new_width)
+                    items[i] = (True, carried * leading, before, after, carried, leading)
+                elif new_width != width:
+                    items[i:] = self._measure(block, new_width)[i:]
+                width = new_width
+                used = 0.0
+                prev_after = 0.0
+                at_top = True
+            result.pages = 1 + (frame_index + 1) // 2
+        return result
@@ -0,0 +1,578 @@
+import copyreg
+import functools
+import hashlib
+import operator
+import os
+import pickle
+from weakref import WeakKeyDictionary
+
+import reportlab
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.lib.units import mm
+from reportlab.pdfbase.cidfonts import UnicodeCIDFont
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont, TTFontFace
+from reportlab.pdfgen import canvas
+from reportlab.platypus import (
+    BaseDocTemplate,
+    Flowable,
+    Frame,
+    FrameBreak,
+    NextPageTemplate,
+    PageTemplate,
+    Spacer,
+    Table,
+    TableStyle,
+)
+
+from blocks import parse_blocks
+from cache_paths import cache_dir
+from export_cache import ExportCache, export_key
+from image_cache import get_policy, print_image_reader
+from inline import inline_markup
+from kinsoku import KinsokuParagraph
+from profiling import span, timed
+
+FONT_CANDIDATES = [
+    "C:\\Windows\\Fonts\\meiryo.ttc",
+    "C:\\Windows\\Fonts\\msgothic.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/opentype/noto/NotoSerifCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansCJK-Regular.ttc",
+    "/Library/Fonts/Arial Unicode.ttf",
+]
+
+STYLE_VERSION = 4
+MAX_FLOWABLE_TEMPLATES = 50000
+MAX_CACHED_CHAPTERS = 2000
+
+_pdf_font_name = None
+
+
+def _font_cache_path(font_path: str):
+    st = os.stat(font_path)
+    path_key = hashlib.sha1(os.path.abspath(font_path).encode("utf-8")).hexdigest()[:16]
+    stamp = f"{st.st_mtime_ns}:{st.st_size}:{reportlab.Version}"
+    stamp_key = hashlib.sha1(stamp.encode("utf-8")).hexdigest()[:16]
+    return cache_dir("fonts"), path_key, f"{path_key}-{stamp_key}.pickle"
+
+
+def load_ttfont(name: str, font_path: str):
+    # 解析済みの TTFont（グリフ幅テーブルを含む）をパス + mtime 単位でディスクに保持する
+    try:
+        folder, path_key, file_name = _font_cache_path(font_path)
+    except OSError:
+        return TTFont(name, font_path)
+
+    cache_file = os.path.join(folder, file_name)
+    try:
+        with open(cache_file, "rb") as f:
+            font = pickle.load(f)
+        if font.fontName == name:
+            return font
+    except Exception:
+        pass
+
+    font = TTFont(name, font_path)
+    tmp_file = cache_file + ".tmp"
+    try:
+        for old in os.listdir(folder):
+            if old.startswith(path_key) and old != file_name:
+                os.remove(os.path.join(folder, old))
+        with open(tmp_file, "wb") as f:
+            pickler = pickle.Pickler(f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickler.dispatch_table = _FONT_PICKLE_TABLE
+            pickler.dump(font)
+        os.replace(tmp_file, cache_file)
+    except Exception:
+        # 書けなくても毎回解析するだけで済む。書きかけは残さない
+        try:
+            os.remove(tmp_file)
+        except OSError:
+            pass
+    return font
+
+
+def _restore_face(state: dict):
+    face = TTFontFace.__new__(TTFontFace)
+    face.__dict__.update(state)
+    units = state.get("unitsPerEm", 1000)
+    # ReportLab 4 以降は解析時に作るラムダ (pickle できない) で幅を 1000 単位に直す
+    face._pdfScale = _same if units == 1000 else functools.partial(operator.mul, 1000 / units)
+    return face
+
+
+def _same(x):
+    return x
+
+
+def _reduce_face(face):
+    state = dict(face.__dict__)
+    state.pop("_pdfScale", None)
+    return _restore_face, (state,)
+
+
+def _reduce_weak_dict(_):
+    # TTFont.state は文書ごとの使用グリフ。キャッシュには空で入れる
+    return WeakKeyDictionary, ()
+
+
+_FONT_PICKLE_TABLE = copyreg.dispatch_table.copy()
+_FONT_PICKLE_TABLE[TTFontFace] = _reduce_face
+_FONT_PICKLE_TABLE[WeakKeyDictionary] = _reduce_weak_dict
+
+
+def register_pdf_font() -> str:
+    global _pdf_font_name
+    if _pdf_font_name is not None:
+        return _pdf_font_name
+
+    font_name = "Helvetica"
+    for candidate in FONT_CANDIDATES:
+        if os.path.exists(candidate):
+            try:
+                pdfmetrics.registerFont(load_ttfont("Japanese", candidate))
+                font_name = "Japanese"
+                break
+            except Exception:
+                continue
+
+    if font_name != "Japanese":
+        try:
+            pdfmetrics.registerFont(UnicodeCIDFont("HeiseiKakuGo-W5"))
+            font_name = "HeiseiKakuGo-W5"
+        except Exception:
+            pass
+
+    _pdf_font_name = font_name
+    return font_name
+
+
+@functools.lru_cache(maxsize=None)
+def get_styles(font_name: str):
+    base = getSampleStyleSheet()["BodyText"]
+    base.fontName = font_name
+    base.fontSize = 10
+    base.leading = 14
+
+    heading = ParagraphStyle(
+        "HeadingStyle",
+        parent=base,
+        fontSize=13,
+        leading=18,
+        textColor=colors.HexColor("#111111"),
+        backColor=colors.HexColor("#f4f4f4"),
+        borderPadding=(6, 8, 6),
+        leftIndent=0,
+        borderWidth=0,
+    )
+    quote = ParagraphStyle(
+        "QuoteStyle",
+        parent=base,
+        backColor=colors.HexColor("#eeeeee"),
+        textColor=colors.HexColor("#222222"),
+        borderPadding=(6, 8, 6),
+        leftIndent=6,
+        rightIndent=6,
+    )
+    normal = ParagraphStyle("NormalStyle", parent=base)
+    return heading, quote, normal
+
+
+HEADING_TABLE_STYLE = TableStyle(
+    [
+        ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f4f4f4")),
+        ("TEXTCOLOR", (0, 0), (-1, -1), colors.HexColor("#111111")),
+        ("BOX", (0, 0), (-1, -1), 0.5, colors.HexColor("#dadada")),
+        ("LEFTPADDING", (0, 0), (-1, -1), 6),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 6),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+HO_TABLE_STYLE = TableStyle(
+    [
+        ("BOX", (0, 0), (-1, -1), 1, colors.HexColor("#555555")),
+        ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f7f7f7")),
+        ("LEFTPADDING", (0, 0), (-1, -1), 8),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 8),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+SECRET_TABLE_STYLE = TableStyle(
+    [
+        ("BOX", (0, 0), (-1, -1), 1, colors.HexColor("#333333")),
+        ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#eeeeee")),
+        ("LEFTPADDING", (0, 0), (-1, -1), 8),
+        ("RIGHTPADDING", (0, 0), (-1, -1), 8),
+        ("TOPPADDING", (0, 0), (-1, -1), 6),
+        ("BOTTOMPADDING", (0, 0), (-1, -1), 6),
+    ]
+)
+
+
+class FlowableFactory:
+    # Paragraph のマークアップ解析結果 (frags) を (種別, 本文, スタイル版) 単位で使い回す
+
+    def __init__(self, font_name: str, max_templates: int = MAX_FLOWABLE_TEMPLATES):
+        self.font_name = font_name
+        self.heading_style, self.quote_style, self.normal_style = get_styles(font_name)
+        self.max_templates = max_templates
+        self._templates = {}
+        self.parsed = 0
+        self.reused = 0
+
+    def stats(self):
+        return {"templates": len(self._templates), "parsed": self.parsed, "reused": self.reused}
+
+    def paragraph(self, block_type: str, body: str, markup: str, style):
+        key = (block_type, body, STYLE_VERSION)
+        frags = self._templates.get(key)
+        if frags is not None:
+            self.reused += 1
+            return KinsokuParagraph(markup, style, frags=list(frags))
+
+        para = KinsokuParagraph(markup, style)
+        self.parsed += 1
+        if len(self._templates) >= self.max_templates:
+            del self._templates[next(iter(self._templates))]
+        self._templates[key] = para.frags
+        return para
+
+    def block(self, block_type: str, body: str):
+        if block_type == "blank":
+            return [Spacer(1, 4 * mm)]
+        markup = inline_markup(body)
+        if block_type == "heading":
+            heading_tbl = Table(
+                [[self.paragraph(block_type, body, f"<b>{markup}</b>", self.heading_style)]],
+                colWidths=[170 * mm],
+            )
+            heading_tbl.setStyle(HEADING_TABLE_STYLE)
+            return [heading_tbl, Spacer(1, 3 * mm)]
+        if block_type == "quote":
+            return [self.paragraph(block_type, body, markup, self.quote_style), Spacer(1, 2 * mm)]
+        if block_type == "ho":
+            ho_tbl = Table(
+                [[self.paragraph(block_type, body, f"HO: <b>{markup}</b>", self.normal_style)]],
+                colWidths=[170 * mm],
+            )
+            ho_tbl.setStyle(HO_TABLE_STYLE)
+            return [ho_tbl, Spacer(1, 2 * mm)]
+        if block_type == "secret":
+            secret_tbl = Table(
+                [[self.paragraph(block_type, body, f"SECRET: {markup}", self.normal_style)]],
+                colWidths=[170 * mm],
+            )
+            secret_tbl.setStyle(SECRET_TABLE_STYLE)
+            return [secret_tbl, Spacer(1, 2 * mm)]
+        return [self.paragraph(block_type, body, markup, self.normal_style), Spacer(1, 2 * mm)]
+
+
+_flowable_factories = {}
+
+
+def get_flowable_factory(font_name: str) -> FlowableFactory:
+    factory = _flowable_factories.get(font_name)
+    if factory is None:
+        factory = _flowable_factories[font_name] = FlowableFactory(font_name)
+    return factory
+
+
+@timed("build_story")
+def build_story(blocks, font_name: str):
+    factory = get_flowable_factory(font_name)
+    story = [NextPageTemplate("Later")]
+    for block_type, body in blocks:
+        story.extend(factory.block(block_type, body))
+    return story
+
+
+def split_chapters(blocks):
+    chapters = []
+    current = []
+    for block in blocks:
+        if block[0] == "heading" and current:
+            chapters.append(current)
+            current = []
+        current.append(block)
+    if current:
+        chapters.append(current)
+    return chapters
+
+
+def chapter_key(chapter, font_name: str) -> str:
+    h = hashlib.sha1(f"{STYLE_VERSION}:{font_name}".encode("utf-8"))
+    for block_type, body in chapter:
+        h.update(f"\0{block_type}\1{body}".encode("utf-8"))
+    return h.hexdigest()
+
+
+class ChapterMark:
+    # ChapterDocTemplate だけが解釈する章境界。キャッシュが無ければ blocks からフローアブルを作る
+
+    def __init__(self, key: str, blocks, factory: FlowableFactory):
+        self.key = key
+        self.blocks = blocks
+        self.factory = factory
+
+    def flowables(self):
+        story = []
+        with span("build_story"):
+            for block_type, body in self.blocks:
+                story.extend(self.factory.block(block_type, body))
+        return story
+
+
+class ReplaySegment(Flowable):
+    # 前回の組版で 1 フレームに配置済みの断片を、同じ座標にそのまま描き直す
+
+    def __init__(self, pieces, height: float, space_after: float):
+        Flowable.__init__(self)
+        self.pieces = pieces
+        self.height = height
+        self.space_after = space_after
+
+    def wrap(self, availWidth, availHeight):
+        return 0, self.height
+
+    def getSpaceAfter(self):
+        return self.space_after
+
+    def drawOn(self, canvas, x, y, _sW=0):
+        for piece, px, py, sw in self.pieces:
+            piece.drawOn(canvas, px, py, _sW=sw)
+
+
+class ChapterLayout:
+    def __init__(self):
+        self.steps = []
+
+    def replay(self):
+        story = []
+        for breaks, pieces, height, space_after in self.steps:
+            story.extend([FrameBreak] * breaks)
+            story.append(ReplaySegment(pieces, height, space_after))
+        return story
+
+
+class LayoutCache:
+    # (章内容ハッシュ, 開始位置) → 配置済み断片。開始位置か内容が変わった章だけ組み直す
+
+    def __init__(self, max_chapters: int = MAX_CACHED_CHAPTERS):
+        self.max_chapters = max_chapters
+        self._chapters = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, state):
+        layout = self._chapters.get((key, state))
+        if layout is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return layout
+
+    def put(self, key: str, state, layout: ChapterLayout):
+        if len(self._chapters) >= self.max_chapters:
+            del self._chapters[next(iter(self._chapters))]
+        self._chapters[(key, state)] = layout
+
+
+class _ChapterRecording:
+    def __init__(self, key: str, state, serial: int):
+        self.key = key
+        self.state = state
+        self.serial = serial
+        self.steps = []
+
+
+class LayoutFrame(Frame):
+    on_draw = None
+
+    def add(self, flowable, canv, trySplit=0):
+        if self.on_draw is None:
+            return Frame.add(self, flowable, canv, trySplit)
+        placed = []
+        draw_on = flowable.drawOn
+
+        def record(canvas, x, y, _sW=0):
+            placed.append((x, y, _sW))
+            draw_on(canvas, x, y, _sW=_sW)
+
+        y_before = self._y
+        flowable.drawOn = record
+        try:
+            added = Frame.add(self, flowable, canv, trySplit)
+        finally:
+            del flowable.drawOn
+        if added and placed:
+            self.on_draw(flowable, y_before, placed[0])
+        return added
+
+
+class ChapterDocTemplate(BaseDocTemplate):
+    def __init__(self, filename, layout_cache=None, **kw):
+        self.layout_cache = layout_cache
+        self._frame_serial = 0
+        self._recording = None
+        BaseDocTemplate.__init__(self, filename, **kw)
+
+    def addPageTemplates(self, pageTemplates):
+        BaseDocTemplate.addPageTemplates(self, pageTemplates)
+        if self.layout_cache is None:
+            return
+        for template in self.pageTemplates:
+            for frame in template.frames:
+                frame.on_draw = self._on_draw
+
+    def handle_frameEnd(self, resume=0):
+        self._frame_serial += 1
+        BaseDocTemplate.handle_frameEnd(self, resume)
+
+    def _layout_state(self):
+        frame = self.frame
+        return (
+            self.pageTemplate.id,
+            frame.id,
+            round(frame._y, 3),
+            frame._atTop,
+            round(frame._prevASpace, 3),
+            getattr(self, "_nextPageTemplateIndex", None),
+        )
+
+    def _on_draw(self, piece, y_before, placement):
+        recording = self._recording
+        if recording is None:
+            return
+        if not recording.steps or recording.serial != self._frame_serial:
+            recording.steps.append([self._frame_serial - recording.serial, [], y_before, y_before, 0.0])
+            recording.serial = self._frame_serial
+        step = recording.steps[-1]
+        step[1].append((piece, *placement))
+        step[3] = self.frame._y
+        step[4] = piece.getSpaceAfter()
+
+    def _finish_chapter(self):
+        recording = self._recording
+        self._recording = None
+        if recording is None:
+            return
+        layout = ChapterLayout()
+        for breaks, pieces, y_start, y_end, space_after in recording.steps:
+            layout.steps.append((breaks, pieces, y_start - y_end - space_after, space_after))
+        self.layout_cache.put(recording.key, recording.state, layout)
+
+    def build(self, flowables, filename=None, canvasmaker=canvas.Canvas):
+        BaseDocTemplate.build(self, flowables, filename, canvasmaker)
+        self._finish_chapter()
+
+    def handle_flowable(self, flowables):
+        mark = flowables[0]
+        if not isinstance(mark, ChapterMark):
+            return BaseDocTemplate.handle_flowable(self, flowables)
+        del flowables[0]
+        self._finish_chapter()
+        if self.layout_cache is None:
+            flowables[0:0] = mark.flowables()
+            return
+        self.clean_hanging()
+        state = self._layout_state()
+        layout = self.layout_cache.get(mark.key, state)
+        if layout is not None:
+            flowables[0:0] = layout.replay()
+        else:
+            self._recording = _ChapterRecording(mark.key, state, self._frame_serial)
+            flowables[0:0] = mark.flowables()
+
+
+_export_cache = ExportCache()
+_layout_cache = LayoutCache()
+
+
+def style_version(font_name: str) -> str:
+    return f"{STYLE_VERSION}:{font_name}:{reportlab.Version}:{get_policy().key()}"
+
+
+def page_frames(frame_class=LayoutFrame):
+    # 1 ページ目 (タイトル・画像の下に 1 段) と 2 ページ目以降 (2 段組) の枠。ページ割りの見積もりでも同じ枠を使う
+    width, height = A4
+    first_frame = frame_class(
+        12 * mm,
+        15 * mm,
+        width - 24 * mm,
+        height - 120 * mm,
+        id="first_frame",
+    )
+    gap = 6 * mm
+    col_w = (width - 24 * mm - gap) / 2
+    later_frame_l = frame_class(12 * mm, 15 * mm, col_w, height - 27 * mm, id="col_left")
+    later_frame_r = frame_class(12 * mm + col_w + gap, 15 * mm, col_w, height - 27 * mm, id="col_right")
+    return first_frame, later_frame_l, later_frame_r
+
+
+def save_pdf_file(path: str, title: str, text: str, img_path: str = "", parser=None, progress=None, use_cache=True):
+    font_name = register_pdf_font()
+    cache_key = export_key(title, text, img_path, style_version(font_name)) if use_cache else ""
+    if cache_key and _export_cache.fetch(cache_key, path):
+        return
+
+    doc = ChapterDocTemplate(
+        path,
+        _layout_cache if use_cache else None,
+        pagesize=A4,
+        leftMargin=12 * mm,
+        rightMargin=12 * mm,
+        topMargin=12 * mm,
+        bottomMargin=12 * mm,
+    )
+    width, height = A4
+    first_frame, later_frame_l, later_frame_r = page_frames()
+
+    def draw_first_page(c, _):
+        c.saveState()
+        c.setFillColor(colors.white)
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        y = height - 15 * mm
+        if img_path and os.path.exists(img_path):
+            try:
+                img_w = width - 24 * mm
+                img_h = 70 * mm
+                with span("pdf.header_image"):
+                    c.drawImage(print_image_reader(img_path, img_w, img_h), 12 * mm, y - img_h, width=img_w, height=img_h, preserveAspectRatio=True, anchor='n')
+                y -= img_h + 8 * mm
+            except Exception:
+                pass
+        c.setFillColor(colors.HexColor("#111111"))
+        c.setFont(font_name, 22)
+        c.drawString(15 * mm, y, title or "No Title")
+        c.restoreState()
+
+    def draw_later_page(c, _):
+        c.saveState()
+        c.setFillColor(colors.white)
+        c.rect(0, 0, width, height, fill=1, stroke=0)
+        c.restoreState()
+
+    doc.addPageTemplates(
+        [
+            PageTemplate(id="First", frames=[first_frame], onPage=draw_first_page),
+            PageTemplate(id="Later", frames=[later_frame_l, later_frame_r], onPage=draw_later_page),
+        ]
+    )
+    if progress is not None:
+        doc.setProgressCallBack(progress)
+
+    with span("parse_blocks"):
+        blocks = parser.parse(text) if parser is not None else parse_blocks(text)
+    factory = get_flowable_factory(font_name)
+    story = [NextPageTemplate("Later")]
+    for chapter in split_chapters(blocks):
+        story.append(ChapterMark(chapter_key(chapter, font_name), chapter, factory))
+    with span("doc.build"):
+        doc.build(story)
+    if cache_key:
+        _export_cache.store(cache_key, path)
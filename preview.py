@@ -0,0 +1,209 @@
+import os
+import threading
+import time
+
+import flet as ft
+
+from image_cache import preview_image
+from inline import has_emphasis, lex_inline, plain_text
+from profiling import span
+
+PAGE_SIZE = 200
+SCROLL_MARGIN = 600
+# 表示するブロックの上限 (PAGE_SIZE 単位)。超えた分はスクロールと反対側から捨てる
+WINDOW_PAGES = 3
+
+
+def is_mounted(control) -> bool:
+    # 画面に載っていないコントロールの page は例外になる
+    try:
+        return control.page is not None
+    except RuntimeError:
+        return False
+
+
+def inline_text(body: str, prefix: str = "", **kwargs):
+    # 強調が無ければ従来どおり 1 つの文字列、あれば TextSpan の並びにする
+    if not has_emphasis(body):
+        return ft.Text(prefix + plain_text(body), **kwargs)
+    spans = [
+        ft.TextSpan(text, ft.TextStyle(weight=ft.FontWeight.BOLD) if bold else None)
+        for text, bold in lex_inline(body)
+    ]
+    return ft.Text(prefix, spans=spans, **kwargs)
+
+
+def build_block_control(block_type: str, body: str):
+    if block_type == "blank":
+        return ft.Container(height=8)
+    if block_type == "heading":
+        return ft.Container(
+            content=inline_text(body, color="#111", weight="bold"),
+            bgcolor="#f8f8f8",
+            border=ft.Border.only(left=ft.BorderSide(3, "#666")),
+            padding=8,
+        )
+    if block_type == "quote":
+        return ft.Container(content=inline_text(body, color="#222"), bgcolor="#dddddd", padding=8, border_radius=4)
+    if block_type == "ho":
+        return ft.Container(
+            content=inline_text(body, "HO: ", color="#333"),
+            border=ft.Border.all(1, "#888"),
+            bgcolor="#f6f6f6",
+            padding=8,
+        )
+    if block_type == "secret":
+        return ft.Container(
+            content=inline_text(body, "SECRET: ", color="#111"),
+            bgcolor="#cccccc",
+            border=ft.Border.all(1, "#666"),
+            padding=8,
+        )
+    return inline_text(body, color="#333")
+
+
+def page_break_control(label: str):
+    return ft.Container(
+        content=ft.Text(f"── {label} ──", size=10, color="#c62828"),
+        alignment=ft.Alignment.CENTER,
+        padding=ft.Padding.symmetric(vertical=2),
+    )
+
+
+class PreviewEngine:
+    # ブロック内容 + 出現回数をキーにコントロールを再利用し、表示範囲 [start, end) の分だけ構築する。
+    # 範囲はスクロール位置に合わせて PAGE_SIZE ずつ動く
+
+    def __init__(self, page_size: int = PAGE_SIZE):
+        self.page_size = page_size
+        self.title_text = ft.Text("", size=22, weight="bold", color="#111")
+        self.header_image = ft.Image(src="", height=140, fit=ft.BoxFit.COVER, visible=False)
+        self.page_info = ft.Text("", size=10, color="#c62828", visible=False)
+        self.view = ft.ListView(
+            controls=[self.title_text, self.header_image, self.page_info, ft.Divider(color="#ddd")],
+            expand=True,
+            on_scroll=self._on_scroll,
+            scroll_interval=100,
+        )
+        self._header_len = len(self.view.controls)
+        self._blocks = []
+        # ブロック番号 → その手前に出すページ・段の区切りのリスト (ページ割りの見積もりを表示する時だけ)
+        self._breaks = {}
+        self._cache = {}
+        self._start = 0
+        self._end = page_size
+        self._lock = threading.Lock()
+        self._unsent = False
+
+    def _header_changed(self, title: str, img_path: str) -> bool:
+        changed = False
+        if self.title_text.value != title:
+            self.title_text.value = title
+            changed = True
+        visible = bool(img_path) and os.path.exists(img_path)
+        src = preview_image(img_path) if visible else ""
+        if self.header_image.src != src or self.header_image.visible != visible:
+            self.header_image.src = src
+            self.header_image.visible = visible
+            changed = True
+        return changed
+
+    def _page_info_changed(self, layout) -> bool:
+        value = f"推定 {layout.pages} ページ (PDF と同じ枠・行分割で見積もり)" if layout is not None else ""
+        if self.page_info.value == value:
+            return False
+        self.page_info.value = value
+        self.page_info.visible = bool(value)
+        return True
+
+    def _sync_steps(self, budget=None):
+        # budget 秒ごとに None を yield し、最後に変更有無を yield する。途中で止めれば表示は変えない。
+        # budget で区切るのはコントロールの組み立てだけで、クライアントへは最後に 1 回だけ送る
+        cache = {}
+        seen = {}
+        controls = []
+        started = time.perf_counter()
+        breaks = self._breaks
+        blocks = self._blocks
+        # 本文が短くなって範囲より前で終わっていたら、末尾の 1 ページ分を出す
+        self._start = start = min(self._start, max(len(blocks) - self.page_size, 0))
+        self._end = min(max(self._end, start + self.page_size), start + self.page_size * WINDOW_PAGES)
+        for index, block in enumerate(blocks[start : self._end], start):
+            for label in breaks.get(index, ()):
+                key = (("break", label), 0)
+                control = self._cache.get(key)
+                if control is None:
+                    control = page_break_control(label)
+                cache[key] = control
+                controls.append(control)
+            occurrence = seen.get(block, 0)
+            seen[block] = occurrence + 1
+            key = (block, occurrence)
+            control = self._cache.get(key)
+            if control is None:
+                control = build_block_control(*block)
+                self._cache[key] = control
+                if budget is not None and time.perf_counter() - started > budget:
+                    yield None
+                    started = time.perf_counter()
+            cache[key] = control
+            controls.append(control)
+        self._cache = cache
+
+        current = self.view.controls[self._header_len :]
+        if len(current) == len(controls) and all(a is b for a, b in zip(current, controls)):
+            yield False
+            return
+        self.view.controls[self._header_len :] = controls
+        yield True
+
+    def _sync_blocks(self) -> bool:
+        changed = False
+        for changed in self._sync_steps():
+            pass
+        return changed
+
+    def render(self, title: str, img_path: str, blocks, budget=None, is_stale=None, layout=None) -> bool:
+        # is_stale() が真になったら途中で打ち切り False を返す (作りかけのコントロールは次回に再利用)。
+        # layout はページ割りの見積もり (page_estimate.PageEstimate)
+        with self._lock:
+            self._blocks = blocks
+            self._breaks = layout.breaks if layout is not None else {}
+            header_changed = self._page_info_changed(layout)
+            header_changed = self._header_changed(title, img_path) or header_changed or self._unsent
+            self._unsent = header_changed
+            blocks_changed = False
+            with span("preview.build_controls"):
+                for step in self._sync_steps(budget):
+                    if step is None:
+                        if is_stale is not None and is_stale():
+                            return False
+                        time.sleep(0)
+                    else:
+                        blocks_changed = step
+            if (header_changed or blocks_changed) and is_mounted(self.view):
+                with span("preview.send"):
+                    self.view.update()
+            self._unsent = False
+            return True
+
+    def _on_scroll(self, e: ft.OnScrollEvent):
+        with self._lock:
+            count = len(self._blocks)
+            start, end = self._start, min(self._end, count)
+            if e.pixels >= e.max_scroll_extent - SCROLL_MARGIN and end < count:
+                end += self.page_size
+                start = max(start, end - self.page_size * WINDOW_PAGES)
+            elif e.pixels <= SCROLL_MARGIN and start > 0:
+                start = max(start - self.page_size, 0)
+                end = min(end, start + self.page_size * WINDOW_PAGES)
+            else:
+                return
+            # 上で捨てた・足したブロックの分だけ位置をずらし、見ていた所に留まる (高さは今の平均で見積もる)
+            average = (e.max_scroll_extent + e.viewport_dimension) / max(len(self.view.controls), 1)
+            shifted = start - self._start
+            self._start, self._end = start, end
+            if self._sync_blocks():
+                self.view.update()
+                if shifted:
+                    self.view.page.run_task(self.view.scroll_to, delta=-shifted * average)
@@ -0,0 +1,137 @@
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+WINDOW = 200
+MAX_TRACE_EVENTS = 100000
+
+_enabled = bool(os.environ.get("SHINOBI_PROFILE"))
+_lock = threading.Lock()
+_durations = {}
+_events = deque(maxlen=MAX_TRACE_EVENTS)
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(enabled: bool):
+    global _enabled
+    _enabled = bool(enabled)
+
+
+def record(name: str, start_ns: int, duration_ns: int, pid: int = 0, tid: int = 0):
+    with _lock:
+        window = _durations.get(name)
+        if window is None:
+            window = _durations[name] = deque(maxlen=WINDOW)
+        window.append(duration_ns / 1e6)
+        _events.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start_ns // 1000,
+                "dur": duration_ns // 1000,
+                "pid": pid or os.getpid(),
+                "tid": tid or threading.get_ident(),
+            }
+        )
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("name", "start")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, self.start, time.perf_counter_ns() - self.start)
+        return False
+
+
+def span(name: str):
+    if not _enabled:
+        return _NULL_SPAN
+    return _Span(name)
+
+
+def timed(name: str):
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            with _Span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def drain_events():
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    return events
+
+
+def merge(events):
+    # 別プロセス（PDF ワーカー）で取ったスパンを取り込む
+    for event in events:
+        record(event["name"], event["ts"] * 1000, event["dur"] * 1000, event["pid"], event["tid"])
+
+
+def summary():
+    rows = []
+    with _lock:
+        items = [(name, sorted(window)) for name, window in _durations.items()]
+    for name, values in sorted(items):
+        if not values:
+            continue
+        count = len(values)
+        rows.append(
+            {
+                "name": name,
+                "count": count,
+                "mean_ms": sum(values) / count,
+                "p50_ms": values[count // 2],
+                "p95_ms": values[min(count - 1, int(count * 0.95))],
+                "max_ms": values[-1],
+            }
+        )
+    return rows
+
+
+def reset():
+    with _lock:
+        _durations.clear()
+        _events.clear()
+
+
+def dump_trace(path: str):
+    # chrome://tracing / Perfetto / speedscope で開ける Trace Event 形式
+    with _lock:
+        events = list(_events)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,221 @@
+import json
+import os
+import queue
+import threading
+import time
+
+from blocks import TEXT_CHUNK, common_prefix, common_suffix
+
+FORMAT = "shinobi-journal"
+VERSION = 1
+EXTENSION = ".shinobi"
+SECTION_MAX_CHARS = 64 * 1024
+AUTOSAVE_SECONDS = 5.0
+IDLE_COMPACT_SECONDS = 30.0
+
+# ファイル構成 (1 行 1 JSON):
+#   1 行目        ヘッダー {format, version, title, header_image_path, body_bytes}
+#   続く body_bytes  スナップショット本文。見出し単位の {"text": ...} 行
+#   以降          追記ジャーナル {"at", "del", "ins"} / {"title"} / {"header_image_path"}
+
+
+def is_journal_project(path: str) -> bool:
+    return path.lower().endswith(EXTENSION)
+
+
+def split_sections(text: str):
+    # 見出し行の手前で区切る。長い章は SECTION_MAX_CHARS ごとにさらに分ける
+    sections = []
+    current = []
+    size = 0
+    for line in text.splitlines(True):
+        if current and (line.startswith("# ") or size + len(line) > SECTION_MAX_CHARS):
+            sections.append("".join(current))
+            current = []
+            size = 0
+        current.append(line)
+        size += len(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def text_delta(old: str, new: str):
+    # (位置, 削除文字数, 挿入文字列)。変更が無ければ None
+    if old == new:
+        return None
+    head = common_prefix(old, new, TEXT_CHUNK)
+    tail = common_suffix(old, new, min(len(old), len(new)) - head, TEXT_CHUNK)
+    return head, len(old) - head - tail, new[head : len(new) - tail]
+
+
+def apply_delta(text: str, at: int, deleted: int, inserted: str) -> str:
+    return text[:at] + inserted + text[at + deleted :]
+
+
+def _encode(record: dict) -> bytes:
+    return (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+def write_snapshot(path: str, title: str, text: str, img_path: str):
+    # 一時ファイルに書いてから置き換えるので、途中で落ちても元のファイルは壊れない
+    body = b"".join(_encode({"text": section}) for section in split_sections(text))
+    header = _encode(
+        {
+            "format": FORMAT,
+            "version": VERSION,
+            "title": title,
+            "header_image_path": img_path,
+            "body_bytes": len(body),
+        }
+    )
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_journal_project(path: str, on_head=None) -> dict:
+    # ジャーナルが空なら先頭の章を読んだ時点で on_head(data) を呼ぶ (残りを読む前に編集を始められる)
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError("ShinobiWriter のプロジェクトファイルではありません")
+        if header.get("version", 0) > VERSION:
+            raise ValueError(f"未対応のバージョンです: {header.get('version')}")
+        title = header.get("title", "")
+        img_path = header.get("header_image_path", "")
+        snapshot_end = f.tell() + header["body_bytes"]
+        has_journal = os.fstat(f.fileno()).st_size > snapshot_end
+
+        sections = []
+        while f.tell() < snapshot_end:
+            sections.append(json.loads(f.readline())["text"])
+            if len(sections) == 1 and on_head is not None and not has_journal:
+                on_head({"title": title, "text_content": sections[0], "header_image_path": img_path})
+        text = "".join(sections)
+
+        replayed = 0
+        torn = False
+        for line in f:
+            # クラッシュで書きかけになった末尾の行は捨てる
+            try:
+                record = json.loads(line) if line.endswith(b"\n") else None
+            except ValueError:
+                record = None
+            if record is None:
+                torn = True
+                break
+            if "at" in record:
+                text = apply_delta(text, record["at"], record["del"], record["ins"])
+            if "title" in record:
+                title = record["title"]
+            if "header_image_path" in record:
+                img_path = record["header_image_path"]
+            replayed += 1
+
+    return {
+        "title": title,
+        "text_content": text,
+        "header_image_path": img_path,
+        "replayed": replayed,
+        "needs_compact": replayed > 0 or torn,
+    }
+
+
+class ProjectJournal:
+    # 差分の計算は呼び出し側、書き込みは専用スレッドで順番に行う
+
+    def __init__(self, path: str, title: str, text: str, img_path: str, on_error=None):
+        self.path = path
+        self.on_error = on_error
+        self.last_change = time.monotonic()
+        self._state = (title, text, img_path)
+        self._records = 0
+        self._needs_snapshot = False
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._closed = threading.Event()
+        self._writer = threading.Thread(target=self._run, name="project-journal", daemon=True)
+        self._writer.start()
+        self._autosave = None
+
+    def record(self, title: str, text: str, img_path: str) -> bool:
+        with self._lock:
+            old_title, old_text, old_img_path = self._state
+            records = []
+            delta = text_delta(old_text, text)
+            if delta is not None:
+                at, deleted, inserted = delta
+                records.append({"at": at, "del": deleted, "ins": inserted})
+            if title != old_title:
+                records.append({"title": title})
+            if img_path != old_img_path:
+                records.append({"header_image_path": img_path})
+            if not records:
+                return False
+            self._state = (title, text, img_path)
+            self._records += len(records)
+            self.last_change = time.monotonic()
+            if self._needs_snapshot:
+                # 追記に失敗した後はジャーナルが欠けているので丸ごと書き直す
+                self._needs_snapshot = False
+                self._records = 0
+                self._queue.put(("snapshot", self._state))
+            else:
+                self._queue.put(("append", b"".join(_encode(r) for r in records)))
+            return True
+
+    def compact(self):
+        with self._lock:
+            self._records = 0
+            self._queue.put(("snapshot", self._state))
+
+    def flush(self):
+        self._queue.join()
+
+    def start_autosave(self, get_state, interval: float = AUTOSAVE_SECONDS, idle: float = IDLE_COMPACT_SECONDS):
+        # interval 秒ごとに差分を追記し、idle 秒編集が無ければスナップショットに畳む
+        def loop():
+            while not self._closed.wait(interval):
+                self.record(*get_state())
+                if self._records and time.monotonic() - self.last_change >= idle:
+                    self.compact()
+
+        self._autosave = threading.Thread(target=loop, name="project-autosave", daemon=True)
+        self._autosave.start()
+
+    def close(self, state=None):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if state is not None:
+            self.record(*state)
+        if self._records:
+            self.compact()
+        self._queue.put(None)
+        self._writer.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                kind, payload = item
+                if kind == "append":
+                    with open(self.path, "ab") as f:
+                        f.write(payload)
+                        f.flush()
+                        os.fsync(f.fileno())
+                else:
+                    write_snapshot(self.path, *payload)
+            except OSError as err:
+                self._needs_snapshot = True
+                if self.on_error is not None:
+                    self.on_error(err)
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,33 @@
+import json
+import os
+
+from project_journal import is_journal_project, read_journal_project
+
+
+def read_project(path: str) -> dict:
+    if is_journal_project(path):
+        data = read_journal_project(path)
+        return {key: data[key] for key in ("title", "text_content", "header_image_path")}
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return {
+        "title": data.get("title", ""),
+        "text_content": data.get("text_content", ""),
+        "header_image_path": data.get("header_image_path", ""),
+    }
+
+
+def write_project(path: str, title: str, text: str, img_path: str):
+    data = {
+        "title": title,
+        "text_content": text,
+        "header_image_path": img_path,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def resolve_image_path(project_path: str, img_path: str) -> str:
+    if img_path and not os.path.isabs(img_path):
+        img_path = os.path.join(os.path.dirname(os.path.abspath(project_path)), img_path)
+    return img_path
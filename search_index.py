@@ -0,0 +1,111 @@
+from bisect import bisect_right
+from itertools import count
+
+CHUNK_LINES = 64
+MAX_HITS = 5000
+
+_chunk_ids = count()
+
+
+def bigrams(text: str):
+    return {text[i : i + 2] for i in range(len(text) - 1)}
+
+
+class _Chunk:
+    __slots__ = ("id", "lines", "grams")
+
+    def __init__(self, lines):
+        self.id = next(_chunk_ids)
+        self.lines = lines
+        grams = set()
+        for line in lines:
+            grams.update(line[i : i + 2] for i in range(len(line) - 1))
+        self.grams = grams
+
+
+class SearchIndex:
+    # 文字 2-gram → 行チャンクの転置索引。ブロック解析の差分 (行の置き換え) を受けて、
+    # 変わったチャンクの分だけ索引を付け替える
+
+    def __init__(self):
+        self._chunks = []
+        self._line_starts = []
+        self._postings = {}
+        self.entries = 0
+        self.version = 0
+
+    def apply(self, head: int, old_stop: int, new_lines):
+        if self._chunks:
+            c0 = self._chunk_for_line(head)
+            c1 = self._chunk_for_line(max(head, old_stop - 1))
+            base = self._line_starts[c0]
+        else:
+            c0, c1, base = 0, -1, 0
+        lines = []
+        for chunk in self._chunks[c0 : c1 + 1]:
+            lines.extend(chunk.lines)
+            self._unindex(chunk)
+        lines[head - base : old_stop - base] = new_lines
+
+        chunks = [_Chunk(lines[i : i + CHUNK_LINES]) for i in range(0, len(lines), CHUNK_LINES)]
+        for chunk in chunks:
+            self.entries += len(chunk.grams)
+            for gram in chunk.grams:
+                posting = self._postings.get(gram)
+                if posting is None:
+                    posting = self._postings[gram] = set()
+                posting.add(chunk.id)
+        self._chunks[c0 : c1 + 1] = chunks
+        self._rebuild_prefix()
+        self.version += 1
+
+    def _unindex(self, chunk):
+        self.entries -= len(chunk.grams)
+        for gram in chunk.grams:
+            posting = self._postings[gram]
+            posting.discard(chunk.id)
+            if not posting:
+                del self._postings[gram]
+
+    def _rebuild_prefix(self):
+        starts = []
+        lines = 0
+        for chunk in self._chunks:
+            starts.append(lines)
+            lines += len(chunk.lines)
+        self._line_starts = starts
+
+    def _chunk_for_line(self, line: int) -> int:
+        return max(0, min(bisect_right(self._line_starts, line) - 1, len(self._chunks) - 1))
+
+    def candidates(self, query: str):
+        # query の 2-gram をすべて含むチャンクの番号 (1 文字なら全チャンク)
+        grams = bigrams(query)
+        if not grams:
+            return range(len(self._chunks))
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if not posting:
+                return []
+            postings.append(posting)
+        postings.sort(key=len)
+        ids = set(postings[0]).intersection(*postings[1:])
+        return [i for i, chunk in enumerate(self._chunks) if chunk.id in ids]
+
+    def search(self, query: str, limit: int = MAX_HITS):
+        # [(行, 行内位置), ...] を文書順に。行をまたぐ一致は探さない。limit=0 なら全件
+        hits = []
+        if not query or "\n" in query:
+            return hits
+        step = len(query)
+        for c in self.candidates(query):
+            first_line = self._line_starts[c]
+            for rel, line in enumerate(self._chunks[c].lines):
+                col = line.find(query)
+                while col >= 0:
+                    hits.append((first_line + rel, col))
+                    if limit and len(hits) >= limit:
+                        return hits
+                    col = line.find(query, col + step)
+        return hits
@@ -0,0 +1,40 @@
+import os
+
+from batch_export import collect_projects, output_paths, run_batch
+from project_store import write_project
+
+
+def test_out_dir_mirrors_folders(tmp_path):
+    a = str(tmp_path / "scan" / "a" / "session.json")
+    b = str(tmp_path / "scan" / "b" / "deep" / "session.json")
+    out = str(tmp_path / "out")
+    paths = output_paths([a, b], out)
+    assert paths[a] == os.path.join(out, "a", "session.pdf")
+    assert paths[b] == os.path.join(out, "b", "deep", "session.pdf")
+    # 1 件だけならそのまま出力先の直下
+    assert output_paths([a], out)[a] == os.path.join(out, "session.pdf")
+    # 出力先を省略したらプロジェクトの隣
+    assert output_paths([a, b])[a] == os.path.join(os.path.dirname(a), "session.pdf")
+
+
+def test_same_stem_in_one_folder_keeps_extension(tmp_path):
+    json_path = str(tmp_path / "x.json")
+    journal_path = str(tmp_path / "x.shinobi")
+    other = str(tmp_path / "y.json")
+    paths = output_paths([json_path, journal_path, other])
+    assert paths[json_path] == str(tmp_path / "x.json.pdf")
+    assert paths[journal_path] == str(tmp_path / "x.shinobi.pdf")
+    assert paths[other] == str(tmp_path / "y.pdf")
+
+
+def test_recursive_scan_writes_every_pdf(tmp_path):
+    scan = tmp_path / "scan"
+    for folder in ("a", "b"):
+        (scan / folder).mkdir(parents=True)
+        write_project(str(scan / folder / "session.json"), folder, f"# {folder}\n本文", "")
+    out = tmp_path / "out"
+    projects = collect_projects([str(scan)])
+    results = run_batch(projects, str(out), jobs=2, use_cache=False, engine="reportlab")
+    assert [r["ok"] for r in results] == [True, True]
+    assert sorted(r["pdf"] for r in results) == [str(out / "a" / "session.pdf"), str(out / "b" / "session.pdf")]
+    assert (out / "a" / "session.pdf").read_bytes() != (out / "b" / "session.pdf").read_bytes()
@@ -0,0 +1,41 @@
+import random
+
+from blocks import IncrementalBlockParser, parse_blocks
+
+PIECES = ["# 見出し", "> 引用", "{{HO1}}", ":::secret 秘密 :::", "本文", " ", "\n", "\n", "\r", "\r\n", " ", "x"]
+
+
+def test_incremental_parse_matches_full_parse():
+    rng = random.Random(3)
+    parser = IncrementalBlockParser()
+    lines = []
+
+    def follow(head, old_stop, new_lines):
+        lines[head:old_stop] = new_lines
+
+    parser.add_listener(follow)
+    text = ""
+    for _ in range(1000):
+        at = rng.randrange(len(text) + 1)
+        deleted = rng.randrange(0, 6) if rng.random() < 0.4 else 0
+        inserted = "".join(rng.choice(PIECES) for _ in range(rng.randrange(0, 4)))
+        previous = parser.parse(text)
+        snapshot = list(previous)
+        text = text[:at] + inserted + text[at + deleted :]
+        blocks = parser.parse(text)
+        assert list(blocks) == parse_blocks(text)
+        assert lines == text.splitlines(True)
+        # 前回の結果は後の parse で書き換わらない
+        assert list(previous) == snapshot
+
+
+def test_unchanged_text_returns_same_result():
+    parser = IncrementalBlockParser()
+    text = "# A\n本文\n> 引用\n"
+    blocks = parser.parse(text)
+    assert parser.parse(text) is blocks
+    assert parser.dirty_range == (3, 3)
+    assert blocks[1] == ("paragraph", "本文")
+    assert blocks[-1] == ("quote", "引用")
+    assert blocks[:2] == [("heading", "A"), ("paragraph", "本文")]
+    assert parser.line_at(1) == "本文\n"
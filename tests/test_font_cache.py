@@ -0,0 +1,50 @@
+import copyreg
+import os
+
+import pytest
+import reportlab
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFontFile
+from reportlab.pdfgen import canvas
+
+import pdf_export
+from pdf_export import load_ttfont
+
+VERA = os.path.join(os.path.dirname(reportlab.__file__), "fonts", "Vera.ttf")
+
+pytestmark = pytest.mark.skipif(not os.path.exists(VERA), reason="ReportLab 同梱の Vera.ttf を使う")
+
+
+def test_warm_cache_skips_ttf_parse(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHINOBI_CACHE_DIR", str(tmp_path / "cache"))
+    cold = load_ttfont("CacheVera", VERA)
+    cached = os.listdir(tmp_path / "cache" / "fonts")
+    assert len(cached) == 1 and cached[0].endswith(".pickle")
+
+    def no_parse(*args, **kwargs):
+        raise AssertionError("キャッシュがあるのに TTF を解析した")
+
+    monkeypatch.setattr(TTFontFile, "__init__", no_parse)
+    warm = load_ttfont("CacheVera", VERA)
+    assert warm is not cold
+    assert warm.face.unitsPerEm != 1000
+    text = "Shinobi Writer 0123"
+    assert warm.stringWidth(text, 10.5) == cold.stringWidth(text, 10.5)
+
+    # サブセット埋め込みまで通る
+    pdfmetrics.registerFont(warm)
+    path = tmp_path / "vera.pdf"
+    c = canvas.Canvas(str(path))
+    c.setFont("CacheVera", 12)
+    c.drawString(72, 720, text)
+    c.save()
+    assert path.read_bytes().startswith(b"%PDF")
+
+
+def test_failed_cache_write_leaves_no_tmp(tmp_path, monkeypatch):
+    monkeypatch.setenv("SHINOBI_CACHE_DIR", str(tmp_path / "cache"))
+    # 面の還元を外すと解析時のラムダで pickle が失敗する
+    monkeypatch.setattr(pdf_export, "_FONT_PICKLE_TABLE", copyreg.dispatch_table.copy())
+    font = load_ttfont("CacheVeraTmp", VERA)
+    assert font.face.unitsPerEm
+    assert os.listdir(tmp_path / "cache" / "fonts") == []
@@ -0,0 +1,169 @@
+import pytest
+
+import history
+from history import CHECKPOINT_SECONDS, MERGE_SECONDS, EditHistory, FieldValues
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(history.time, "monotonic", lambda: now[0])
+
+    def advance(seconds: float):
+        now[0] += seconds
+
+    return advance
+
+
+def _apply(text: str, at: int, deleted: str, inserted: str) -> str:
+    assert text[at : at + len(deleted)] == deleted
+    return text[:at] + inserted + text[at + len(deleted) :]
+
+
+def _undo(text: str, edit) -> str:
+    return _apply(text, edit.at, edit.inserted, edit.deleted)
+
+
+def _redo(text: str, edit) -> str:
+    return _apply(text, edit.at, edit.deleted, edit.inserted)
+
+
+def test_typing_merges_into_one_step(clock):
+    h = EditHistory(1 << 20)
+    text = ""
+    for i, ch in enumerate("忍びの里"):
+        h.record(i, "", ch, typing=True)
+        text += ch
+        clock(0.1)
+    edit = h.undo()
+    assert (edit.at, edit.deleted, edit.inserted) == (0, "", "忍びの里")
+    assert _undo(text, edit) == ""
+    assert not h.can_undo()
+
+
+def test_backspace_and_delete_merge(clock):
+    h = EditHistory(1 << 20)
+    # 「abcdef」の d の前で Backspace 2 回
+    h.record(2, "c", "", typing=True)
+    h.record(1, "b", "", typing=True)
+    edit = h.undo()
+    assert (edit.at, edit.deleted) == (1, "bc")
+    # 同じ位置で Delete 2 回
+    h.record(1, "b", "", typing=True)
+    h.record(1, "c", "", typing=True)
+    edit = h.undo()
+    assert (edit.at, edit.deleted) == (1, "bc")
+
+
+def test_merge_breaks_on_pause_newline_and_checkpoint(clock):
+    h = EditHistory(1 << 20)
+    h.record(0, "", "a", typing=True)
+    clock(MERGE_SECONDS + 0.1)
+    h.record(1, "", "b", typing=True)
+    h.record(2, "", "\n", typing=True)
+    h.record(3, "", "c", typing=True)
+    h.checkpoint()
+    h.record(4, "", "d", typing=True)
+    # 改行はそれまでの入力と切り離し、改行の後の入力は改行と同じ単位になる
+    assert [h.undo().inserted for _ in range(4)] == ["d", "\nc", "b", "a"]
+
+
+def test_long_typing_is_split_at_checkpoint_interval(clock):
+    h = EditHistory(1 << 20)
+    at = 0
+    while at * 0.5 <= CHECKPOINT_SECONDS + 1:
+        h.record(at, "", "x", typing=True)
+        at += 1
+        clock(0.5)
+    first = h.undo()
+    second = h.undo()
+    assert first.inserted and second.inserted
+    assert len(first.inserted) + len(second.inserted) == at
+
+
+def test_undo_redo_round_trip(clock):
+    h = EditHistory(1 << 20)
+    text = "夜の港"
+    steps = [(0, "夜", "朝"), (3, "", "で待つ"), (1, "の", "")]
+    for at, deleted, inserted in steps:
+        text = _apply(text, at, deleted, inserted)
+        h.record(at, deleted, inserted)
+        clock(2)
+    final = text
+    for _ in steps:
+        text = _undo(text, h.undo())
+    assert text == "夜の港" and h.undo() is None
+    for _ in steps:
+        text = _redo(text, h.redo())
+    assert text == final and h.redo() is None
+
+
+def test_new_edit_clears_redo(clock):
+    h = EditHistory(1 << 20)
+    h.record(0, "", "a")
+    h.undo()
+    assert h.can_redo()
+    h.record(0, "", "b")
+    assert not h.can_redo()
+
+
+def test_budget_drops_oldest_but_keeps_latest(clock):
+    h = EditHistory(4096)
+    for i in range(200):
+        h.record(i, "", "x" * 50)
+    assert h.bytes <= 4096
+    kept = []
+    while h.can_undo():
+        kept.append(h.undo().at)
+    assert kept[0] == 199 and 1 < len(kept) < 200
+    assert kept == sorted(kept, reverse=True)
+    # 上限より大きい 1 件でも最後の編集は残す
+    h = EditHistory(16)
+    h.record(0, "", "y" * 1000)
+    assert h.can_undo()
+
+
+def test_budget_from_env(monkeypatch):
+    monkeypatch.setenv(history.HISTORY_ENV, "2")
+    assert EditHistory().max_bytes == 2 * 1024 * 1024
+    monkeypatch.setenv(history.HISTORY_ENV, "oops")
+    assert EditHistory().max_bytes == history.DEFAULT_HISTORY_MB * 1024 * 1024
+
+
+def test_client_undo_matches_only_earlier_field_values():
+    values = FieldValues()
+    for value in ("", "a", "ab", "abc"):
+        values.seen(value)
+    values.expect_client_undo()
+    values.seen("ab")  # アプリの履歴で戻して送った値
+    assert values.is_client_undo("a")
+    # 1 回分だけ。以後の変更は利用者の入力
+    assert not values.is_client_undo("")
+
+
+def test_user_input_after_undo_is_kept():
+    values = FieldValues()
+    for value in ("", "a", "ab"):
+        values.seen(value)
+    values.expect_client_undo()
+    values.seen("a")
+    # 入力欄が何も戻さず、利用者が打ち直した
+    assert not values.is_client_undo("ab")
+    assert not values.is_client_undo("")
+    values.expect_client_undo()
+    assert not values.is_client_undo("abz")
+    assert not values.is_client_undo("a")
+
+
+def test_late_and_repeated_client_undo():
+    values = FieldValues()
+    for value in ("", "a", "ab", "abc"):
+        values.seen(value)
+    # 2 回続けて押し、入力欄の取り消しは後からまとめて届く
+    values.expect_client_undo()
+    values.seen("ab")
+    values.expect_client_undo()
+    values.seen("a")
+    assert values.is_client_undo("ab")
+    assert values.is_client_undo("a")
+    assert not values.is_client_undo("ab")
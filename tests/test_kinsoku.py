@@ -0,0 +1,34 @@
+from pdf_export import get_styles, register_pdf_font, save_pdf_file
+from kinsoku import KinsokuParagraph, break_lines
+
+
+def _words(paragraph):
+    return " ".join(line for _, words in paragraph.blPara.lines for line in words).split()
+
+
+def test_break_lines_keeps_break_whitespace():
+    font_name = register_pdf_font()
+    text = "alpha beta gamma delta " * 20
+    lines = break_lines(text.strip(), [120], font_name, 10)
+    assert "".join(line + tail for _, line, tail in lines) == text.strip()
+    assert all(not line.endswith(" ") for _, line, _ in lines)
+
+
+def test_split_rewraps_at_narrower_width():
+    # 1 ページ目の全幅の枠で分割し、続きを 2 段組の片側の幅で組み直す
+    font_name = register_pdf_font()
+    style = get_styles(font_name)[2]
+    text = " ".join(f"gamma delta{i}" for i in range(120))
+    paragraph = KinsokuParagraph(text, style)
+    paragraph.wrap(480, 10000)
+    first, rest = paragraph.split(480, 5 * style.leading)
+    first.wrap(480, 10000)
+    rest.wrap(240, 10000)
+    assert _words(first) + _words(rest) == text.split()
+    assert rest.height < 10000
+
+
+def test_ascii_document_exports(tmp_path):
+    path = tmp_path / "ascii.pdf"
+    save_pdf_file(str(path), "ascii", "\n".join(["word " * 200] * 8), use_cache=False)
+    assert path.read_bytes().startswith(b"%PDF")
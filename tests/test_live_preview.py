@@ -0,0 +1,22 @@
+import threading
+
+from live_preview import LivePreviewPipeline
+
+
+class _BrokenParser:
+    def parse(self, text):
+        raise ValueError(text)
+
+
+def test_background_errors_reach_on_error():
+    errors = []
+    reported = threading.Event()
+
+    def on_error(err):
+        errors.append(err)
+        reported.set()
+
+    pipeline = LivePreviewPipeline(_BrokenParser(), None, None, lambda: ("", ""), delay=0.0, on_error=on_error)
+    pipeline.submit(lambda: "壊れた本文")
+    assert reported.wait(5)
+    assert isinstance(errors[0], ValueError) and errors[0].args == ("壊れた本文",)
@@ -0,0 +1,78 @@
+from blocks import parse_blocks
+from kinsoku import KinsokuParagraph
+from page_estimate import PageEstimator
+from pdf_export import ChapterDocTemplate, FlowableFactory, save_pdf_file
+
+
+def _sample_text():
+    lines = ["# 導入", "夜の港で依頼人と落ち合う。" * 6, ""]
+    for chapter in range(1, 4):
+        lines.append(f"# 第{chapter}章")
+        for i in range(12):
+            lines.append(f"段落{chapter}-{i}。" + "忍びは影に潜み、標的の動きを静かに見張っている。" * (1 + i % 5))
+        lines.append("> 引用: " + "古い巻物の一節。" * 8)
+        lines.append("")
+    # 何段もまたぐ段落
+    lines.append("長い段落。" + "霧の中を駆け抜ける足音だけが響く。" * 400)
+    lines.append("締めの一文。")
+    return "\n".join(lines)
+
+
+def _export_frames(monkeypatch, tmp_path, text):
+    # 実際に save_pdf_file で組版し、各段の最初に置かれた断片が (どのブロックの, 続きかどうか) を記録する
+    drawn = []
+    pages = []
+    make_block = FlowableFactory.block
+    split = KinsokuParagraph.split
+
+    def tagged_block(self, block_type, body):
+        flowables = make_block(self, block_type, body)
+        for flowable in flowables:
+            flowable.block_index = len(pages)
+            flowable.continued = flowable is not flowables[0]
+        pages.append(None)
+        return flowables
+
+    def tagged_split(self, width, height):
+        parts = split(self, width, height)
+        for i, part in enumerate(parts):
+            part.block_index = getattr(self, "block_index", None)
+            part.continued = getattr(self, "continued", False) or i > 0
+        return parts
+
+    def after_flowable(self, flowable):
+        index = getattr(flowable, "block_index", None)
+        if index is not None:
+            drawn.append((self._frame_serial, self.page, index, flowable.continued))
+
+    monkeypatch.setattr(FlowableFactory, "block", tagged_block)
+    monkeypatch.setattr(KinsokuParagraph, "split", tagged_split)
+    monkeypatch.setattr(ChapterDocTemplate, "afterFlowable", after_flowable, raising=False)
+    save_pdf_file(str(tmp_path / "estimate.pdf"), "見積もり", text, use_cache=False)
+
+    breaks = []
+    serial = 0
+    for frame_serial, _, index, continued in drawn:
+        if frame_serial != serial:
+            # 段の先頭がブロックの途中 (分割の続き・後ろの空き) なら、区切りは次のブロックの手前に出る
+            breaks.extend([index + 1 if continued else index] * (frame_serial - serial))
+            serial = frame_serial
+    return drawn[-1][1], breaks
+
+
+def test_estimate_matches_export(monkeypatch, tmp_path):
+    text = _sample_text()
+    estimate = PageEstimator().estimate(parse_blocks(text))
+    pages, breaks = _export_frames(monkeypatch, tmp_path, text)
+    assert pages > 3
+    assert estimate.pages == pages
+    assert sorted(index for index, labels in estimate.breaks.items() for _ in labels) == breaks
+
+
+def test_paragraph_across_frames_keeps_every_break():
+    blocks = [("normal", "霧の中を駆け抜ける足音だけが響く。" * 600)]
+    estimate = PageEstimator().estimate(blocks)
+    labels = estimate.breaks[1]
+    # 1 ページ目の 1 段 + 区切りの数だけ段がある
+    assert estimate.pages == 1 + (len(labels) + 1) // 2
+    assert len(set(labels)) == len(labels)
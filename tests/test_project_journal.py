@@ -0,0 +1,63 @@
+import random
+
+from document import PieceTable
+from project_journal import ProjectJournal, apply_delta, read_journal_project, text_delta, write_snapshot
+from workspace import ProjectSession
+
+
+def test_text_delta_round_trips():
+    rng = random.Random(7)
+    base = "".join(rng.choice("あいう\nab ") for _ in range(20000))
+    for _ in range(200):
+        at = rng.randrange(len(base))
+        deleted = rng.randrange(0, 50)
+        inserted = "".join(rng.choice("あいう\nab ") for _ in range(rng.randrange(0, 50)))
+        new = apply_delta(base, at, deleted, inserted)
+        delta = text_delta(base, new)
+        if new == base:
+            assert delta is None
+            continue
+        head, removed, added = delta
+        assert apply_delta(base, head, removed, added) == new
+        # 共通の先頭・末尾を除いた最小の差分になっている
+        assert removed <= deleted and len(added) <= len(inserted)
+
+
+def test_text_delta_repeated_characters():
+    assert text_delta("aaaa", "aaaaa") == (4, 0, "a")
+    assert text_delta("abcabc", "abc") == (3, 3, "")
+    assert text_delta("", "x") == (0, 0, "x")
+
+
+def test_save_during_background_load_is_held(tmp_path):
+    path = str(tmp_path / "p.shinobi")
+    text = "".join(f"# 第{i}章\n" + "本文。" * 50 + "\n" for i in range(8))
+    write_snapshot(path, "題", text, "")
+    session = ProjectSession(path=path)
+    held = []
+    head_len = []
+
+    def show_head(data):
+        # 先頭の章だけ表示した状態で Ctrl+S が押され、続けて先頭を書き換える
+        session.begin_load()
+        session.document = PieceTable(data["text_content"])
+        head_len.append(len(data["text_content"]))
+        held.append(session.hold_save(path))
+        session.edit(0, 0, "前書き\n")
+
+    data = read_journal_project(path, on_head=show_head)
+    assert held == [True]
+    # 途中までの本文でファイルを書き直していない
+    assert read_journal_project(path)["text_content"] == text
+
+    # 読み終わった残りを末尾に足し、ディスクの内容でジャーナルを開く
+    session.document.apply(len(session.document), 0, data["text_content"][head_len[0] :])
+    journal = ProjectJournal(path, data["title"], data["text_content"], "")
+    assert session.finish_load() == path
+    assert not session.hold_save(path)
+    session.edit(len(session.document), 0, "追記")
+    journal.record("題", session.text(), "")
+    journal.flush()
+    # 閉じる前 (落ちた時に復元される内容) で読み込み中の編集も含めて揃っている
+    assert read_journal_project(path)["text_content"] == "前書き\n" + text + "追記"
+    journal.close()
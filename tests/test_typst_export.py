@@ -0,0 +1,205 @@
+import os
+import queue
+import signal
+import subprocess
+import sys
+import time
+
+import pytest
+
+import export_engines
+from export_engines import ENGINE_ENV, ReportLabEngine, close_engines, get_engine
+from export_worker import ExportJob, PdfExportWorker
+from typst_export import TYPST_ENV, TypstCompiler, TypstEngine
+
+STUB = os.path.join(os.path.dirname(__file__), "bin", "typst")
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="スタブの typst はシェバンで起動する")
+
+
+@pytest.fixture
+def stub_log(tmp_path, monkeypatch):
+    path = tmp_path / "typst.log"
+    monkeypatch.setenv("TYPST_STUB_LOG", str(path))
+    monkeypatch.setenv("SHINOBI_CACHE_DIR", str(tmp_path / "cache"))
+
+    def calls():
+        return path.read_text(encoding="utf-8").splitlines() if path.exists() else []
+
+    return calls
+
+
+@pytest.fixture
+def compiler(tmp_path):
+    workdir = tmp_path / "work"
+    workdir.mkdir()
+    compiler = TypstCompiler(STUB, str(workdir))
+    yield compiler
+    compiler.close()
+
+
+def _output(compiler) -> str:
+    with open(compiler.output, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_watch_recompiles_on_change(compiler, stub_log):
+    compiler.compile("= first\n")
+    assert _output(compiler).endswith("= first\n")
+    compiler.compile("= second\n")
+    assert _output(compiler).endswith("= second\n")
+    assert stub_log() == ["watch", "watch compile", "watch compile"]
+
+
+def test_unchanged_source_returns_early(compiler, stub_log):
+    compiler.compile("= same\n")
+    compiler.compile("= same\n")
+    assert stub_log().count("watch compile") == 1
+
+
+def test_errors_are_reported(compiler, stub_log):
+    with pytest.raises(RuntimeError, match="main.typ:2:1: error: panicked"):
+        compiler.compile("= ok\n#panic\n")
+    # 直した本文は同じ watch で通る
+    compiler.compile("= fixed\n")
+    assert _output(compiler).endswith("= fixed\n")
+    assert stub_log().count("watch") == 1
+
+
+def test_falls_back_to_compile_when_watch_dies(compiler, stub_log, monkeypatch):
+    monkeypatch.setenv("TYPST_STUB_NO_WATCH", "1")
+    compiler.compile("= first\n")
+    assert _output(compiler).endswith("= first\n")
+    compiler.compile("= second\n")
+    assert _output(compiler).endswith("= second\n")
+    # watch は 1 度だけ試し、以後は都度 compile する
+    assert stub_log() == ["watch unsupported", "compile", "compile"]
+    with pytest.raises(RuntimeError, match="error: panicked"):
+        compiler.compile("#panic\n")
+
+
+def test_engine_exports_with_stub(tmp_path, stub_log):
+    engine = TypstEngine(STUB)
+    try:
+        path = tmp_path / "out.pdf"
+        engine.export(str(path), "題", "# 見出し\n本文", use_cache=False)
+        assert path.read_text(encoding="utf-8").startswith("%PDF-stub")
+    finally:
+        engine.close()
+
+
+def test_auto_falls_back_to_reportlab_without_binary(tmp_path, monkeypatch):
+    close_engines()
+    monkeypatch.setenv(TYPST_ENV, str(tmp_path / "missing-typst"))
+    try:
+        assert isinstance(get_engine("auto"), ReportLabEngine)
+        assert isinstance(get_engine("typst"), ReportLabEngine)
+        close_engines()
+        monkeypatch.setenv(TYPST_ENV, STUB)
+        assert isinstance(get_engine("auto"), TypstEngine)
+        assert isinstance(get_engine("reportlab"), ReportLabEngine)
+    finally:
+        close_engines()
+    assert export_engines._engines == {}
+
+
+def test_changing_header_image_recompiles(tmp_path, stub_log):
+    image = pytest.importorskip("PIL.Image")
+    a = tmp_path / "a.png"
+    b = tmp_path / "b.png"
+    image.new("RGB", (40, 20), "red").save(a)
+    image.new("RGB", (40, 20), "blue").save(b)
+    engine = TypstEngine(STUB)
+    try:
+        first = tmp_path / "a.pdf"
+        second = tmp_path / "b.pdf"
+        engine.export(str(first), "題", "本文", str(a), use_cache=False)
+        engine.export(str(second), "題", "本文", str(b), use_cache=False)
+        assert first.read_text(encoding="utf-8") != second.read_text(encoding="utf-8")
+        assert stub_log().count("watch compile") == 2
+        # 差し替え前の画像は作業フォルダに残さない
+        staged = [name for name in os.listdir(engine._compiler.workdir) if name.startswith("header-")]
+        assert len(staged) == 1 and staged[0] in second.read_text(encoding="utf-8")
+    finally:
+        engine.close()
+
+
+def _watch_processes(tmp_path):
+    # tmp_path の下で動いているスタブの typst watch の pid
+    pids = []
+    for name in os.listdir("/proc"):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f"/proc/{name}/cmdline", "rb") as f:
+                args = f.read().decode("utf-8", "replace").split("\0")
+        except OSError:
+            continue
+        if STUB in args and "watch" in args and any(str(tmp_path) in arg for arg in args):
+            pids.append(int(name))
+    return pids
+
+
+def _wait_until(predicate, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return predicate()
+
+
+def _export_in_worker(tmp_path, monkeypatch):
+    monkeypatch.setenv(TYPST_ENV, STUB)
+    monkeypatch.setenv(ENGINE_ENV, "typst")
+    events = queue.Queue()
+    worker = PdfExportWorker(lambda kind, job, value: events.put((kind, value)))
+    worker.submit(ExportJob(str(tmp_path / "out.pdf"), "題", "本文"))
+    while True:
+        kind, value = events.get(timeout=60)
+        if kind not in ("started", "page"):
+            break
+    assert (kind, value) == ("done", "typst")
+    assert _wait_until(lambda: _watch_processes(tmp_path))
+    return worker
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="/proc でプロセスを探す")
+def test_worker_close_stops_watch(tmp_path, stub_log, monkeypatch):
+    worker = _export_in_worker(tmp_path, monkeypatch)
+    worker.close()
+    assert _wait_until(lambda: not _watch_processes(tmp_path))
+    assert os.listdir(tmp_path / "cache" / "typst") == []
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="/proc でプロセスを探す")
+def test_killed_worker_does_not_leave_watch(tmp_path, stub_log, monkeypatch):
+    worker = _export_in_worker(tmp_path, monkeypatch)
+    try:
+        # 出力プロセスが後始末できずに落ちても、watch は親の終了で止まる
+        os.kill(worker._process.pid, signal.SIGKILL)
+        assert _wait_until(lambda: not _watch_processes(tmp_path))
+    finally:
+        worker.close()
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="/proc でプロセスを探す")
+def test_worker_exits_with_crashed_app(tmp_path, stub_log, monkeypatch):
+    # アプリ側のプロセスが close せずに終わった場合
+    monkeypatch.setenv(TYPST_ENV, STUB)
+    monkeypatch.setenv(ENGINE_ENV, "typst")
+    script = (
+        "import os, queue\n"
+        "from export_worker import ExportJob, PdfExportWorker\n"
+        "events = queue.Queue()\n"
+        "worker = PdfExportWorker(lambda kind, job, value: events.put(kind))\n"
+        f"worker.submit(ExportJob({str(tmp_path / 'out.pdf')!r}, 't', 'body'))\n"
+        "while events.get(timeout=60) in ('started', 'page'):\n"
+        "    pass\n"
+        "os._exit(1)\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", script], cwd=root, timeout=120)
+    assert (tmp_path / "out.pdf").exists()
+    assert _wait_until(lambda: not _watch_processes(tmp_path))
+    assert _wait_until(lambda: os.listdir(tmp_path / "cache" / "typst") == [])
@@ -0,0 +1,63 @@
+import flet as ft
+
+from preview import is_mounted
+
+
+class TocView:
+    # 見出し (階層, タイトル, 出現回数) ごとにコントロールを使い回し、変わった見出しだけ送る
+
+    def __init__(self, outline, on_jump):
+        self.outline = outline
+        self.on_jump = on_jump
+        self.view = ft.Column(scroll=ft.ScrollMode.AUTO, height=220)
+        self.version = -1
+        self._cache = {}
+
+    def _jump(self, key):
+        # 見出しの増減が無くても行番号はずれるので、クリック時に現在の行を引き直す
+        seen = {}
+        for line, level, title in self.outline.headings():
+            occurrence = seen.get((level, title), 0)
+            seen[(level, title)] = occurrence + 1
+            if (level, title, occurrence) == key:
+                self.on_jump(line)
+                return
+
+    def _build(self, key):
+        level, title, _ = key
+        if level == 1:
+            return ft.Container(
+                content=ft.Text(f"■ {title}", size=12, weight="bold", color="#dd0000"),
+                padding=ft.Padding.only(top=8, bottom=4),
+                on_click=lambda _, k=key: self._jump(k),
+            )
+        return ft.Container(
+            content=ft.Text(f"  - {title}", size=11, color="#aaaaaa"),
+            padding=ft.Padding.only(left=10, bottom=2),
+            on_click=lambda _, k=key: self._jump(k),
+        )
+
+    def refresh(self):
+        if self.outline.version == self.version:
+            return
+        seen = {}
+        cache = {}
+        controls = []
+        for _, level, title in self.outline.headings():
+            occurrence = seen.get((level, title), 0)
+            seen[(level, title)] = occurrence + 1
+            key = (level, title, occurrence)
+            control = self._cache.get(key)
+            if control is None:
+                control = self._build(key)
+            cache[key] = control
+            controls.append(control)
+        self._cache = cache
+        self.version = self.outline.version
+
+        current = self.view.controls
+        if len(current) == len(controls) and all(a is b for a, b in zip(current, controls)):
+            return
+        self.view.controls[:] = controls
+        if is_mounted(self.view):
+            self.view.update()
@@ -0,0 +1,317 @@
+import ctypes
+import hashlib
+import os
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+from collections import deque
+from multiprocessing.util import Finalize
+
+from blocks import parse_blocks
+from cache_paths import cache_dir
+from export_cache import ExportCache, export_key
+from image_cache import print_image
+from inline import lex_inline
+
+TYPST_ENV = "SHINOBI_TYPST_BIN"
+TYPST_STYLE_VERSION = 1
+COMPILE_TIMEOUT = 120.0
+POLL_SECONDS = 0.2
+PR_SET_PDEATHSIG = 1
+FONT_FAMILIES = ("Noto Sans CJK JP", "Yu Gothic", "Hiragino Sans", "Meiryo", "IPAexGothic")
+# A4 幅 - 左右余白 24mm と 70mm (ポイント)
+HEADER_BOX = ((210 - 24) * 72 / 25.4, 70 * 72 / 25.4)
+
+_COMPILED = re.compile(r"compiled (successfully|with warnings|with errors)")
+
+_export_cache = ExportCache()
+
+
+def find_typst() -> str:
+    # SHINOBI_TYPST_BIN で差し替え可能 (スタブのコンパイラで動作確認する時など)
+    binary = os.environ.get(TYPST_ENV) or "typst"
+    return shutil.which(binary) or ""
+
+
+def _string(text: str) -> str:
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def typst_inline(body: str) -> str:
+    # 本文は文字列リテラルとして埋め込むので、# * _ などの記号がマークアップとして解釈されない
+    return "".join(f"#strong({_string(text)})" if bold else f"#{_string(text)}" for text, bold in lex_inline(body))
+
+
+def typst_block(block_type: str, body: str) -> str:
+    if block_type == "blank":
+        return "#v(4mm)"
+    content = typst_inline(body)
+    if block_type == "heading":
+        return (
+            "#block(width: 100%, fill: luma(244), stroke: 0.5pt + luma(218), inset: 6pt)"
+            f'[#text(size: 13pt, weight: "bold")[{content}]]'
+        )
+    if block_type == "quote":
+        return f"#block(width: 100%, fill: luma(238), inset: 6pt)[{content}]"
+    if block_type == "ho":
+        return f"#block(width: 100%, fill: luma(247), stroke: 1pt + luma(85), inset: 8pt)[HO: #strong[{content}]]"
+    if block_type == "secret":
+        return f"#block(width: 100%, fill: luma(204), stroke: 1pt + luma(102), inset: 8pt)[SECRET: {content}]"
+    return content
+
+
+def typst_source(title: str, blocks, image_name: str = "") -> str:
+    fonts = ", ".join(_string(name) for name in FONT_FAMILIES)
+    lines = [
+        '#set page(paper: "a4", margin: 12mm)',
+        f'#set text(font: ({fonts}), size: 10pt, lang: "ja")',
+        "#set par(leading: 0.6em)",
+        "",
+    ]
+    if image_name:
+        lines.append(f'#image({_string(image_name)}, width: 100%, height: 70mm, fit: "contain")')
+    lines.append(f'#text(size: 22pt, weight: "bold", {_string(title or "No Title")})')
+    lines.append("")
+    lines.append("#columns(2, gutter: 6mm)[")
+    for block_type, body in blocks:
+        lines.append(typst_block(block_type, body))
+        lines.append("")
+    lines.append("]")
+    return "\n".join(lines) + "\n"
+
+
+def _die_with_parent():
+    # Linux では親 (PDF 出力プロセスなど) が強制終了されても watch が残らないよう、親の終了で SIGTERM を受ける。
+    # 正確には Popen を呼んだスレッドの終了で届くので、compile は長生きするスレッドから呼ぶ
+    libc = ctypes.CDLL(None, use_errno=True)
+
+    def set_pdeathsig():
+        libc.prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+
+    return set_pdeathsig
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+
+class TypstCompiler:
+    # typst watch を常駐させ、main.typ を書き換えるたびに出る "compiled ..." 行で完了を待つ。
+    # watch が使えない時は typst compile を都度起動する
+
+    def __init__(self, binary: str, workdir: str):
+        self.binary = binary
+        self.workdir = workdir
+        self.source = os.path.join(workdir, "main.typ")
+        self.output = os.path.join(workdir, "main.pdf")
+        self._process = None
+        self._watch_failed = False
+        self._cond = threading.Condition()
+        self._compiles = 0
+        self._ok = False
+        self._log = deque(maxlen=40)
+        self._errors = []
+        self._text = None
+        self._awaiting = None
+
+    def _command(self, mode: str):
+        return [self.binary, mode, "--diagnostic-format", "short", self.source, self.output]
+
+    def _popen_kwargs(self):
+        kwargs = {"cwd": self.workdir, "stdin": subprocess.DEVNULL}
+        if os.name == "nt":
+            kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW
+        elif sys.platform.startswith("linux"):
+            kwargs["preexec_fn"] = _die_with_parent()
+        return kwargs
+
+    def _start_watch(self) -> bool:
+        if self._process is not None and self._process.poll() is None:
+            return True
+        if self._watch_failed:
+            return False
+        try:
+            self._process = subprocess.Popen(
+                self._command("watch"),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                text=True,
+                encoding="utf-8",
+                errors="replace",
+                **self._popen_kwargs(),
+            )
+        except OSError:
+            self._watch_failed = True
+            return False
+        # atexit と違い、multiprocessing の子プロセス (バッチの並列ワーカー) 終了時にも呼ばれる
+        Finalize(None, self.close, exitpriority=10)
+        threading.Thread(target=self._read_output, args=(self._process,), name="typst-watch", daemon=True).start()
+        return True
+
+    def _read_output(self, process):
+        for line in process.stdout:
+            line = line.rstrip()
+            m = _COMPILED.search(line)
+            with self._cond:
+                if m is None:
+                    if line:
+                        self._log.append(line)
+                    continue
+                self._ok = m.group(1) != "with errors"
+                self._errors = list(self._log)
+                self._log.clear()
+                self._compiles += 1
+                self._cond.notify_all()
+        with self._cond:
+            self._cond.notify_all()
+
+    def _wait_for(self, count: int, progress, timeout: float) -> bool:
+        # コンパイル回数が count を超えるまで待つ。watch が落ちたら False
+        waited = 0.0
+        with self._cond:
+            while self._compiles <= count:
+                if self._process is None or self._process.poll() is not None:
+                    return False
+                if waited >= timeout:
+                    raise RuntimeError("Typst のコンパイルがタイムアウトしました")
+                self._cond.wait(POLL_SECONDS)
+                waited += POLL_SECONDS
+                if progress is not None:
+                    progress("PROGRESS", 0)
+        return True
+
+    def compile(self, text: str, progress=None, timeout: float = COMPILE_TIMEOUT):
+        if text == self._text and self._ok and os.path.exists(self.output):
+            return
+        if self._awaiting is not None and self._start_watch():
+            # キャンセルで待ちきれなかった前回分の完了通知を、今回の分と取り違えないよう先に受け取る
+            self._wait_for(self._awaiting, progress, timeout)
+        self._text = None
+        with self._cond:
+            seen = self._compiles
+        tmp_path = self.source + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.source)
+
+        if not self._start_watch():
+            self._compile_once()
+            self._text = text
+            return
+        self._awaiting = seen
+        compiled = self._wait_for(seen, progress, timeout)
+        self._awaiting = None
+        if not compiled:
+            # watch が落ちた (非対応の版など)。以後は都度コンパイルする
+            self._process = None
+            self._watch_failed = True
+            self._compile_once()
+            self._text = text
+            return
+        with self._cond:
+            ok = self._ok
+            errors = self._errors
+        if not ok:
+            raise RuntimeError("Typst: " + " / ".join(errors[-3:] or ["コンパイルに失敗しました"]))
+        self._text = text
+
+    def _compile_once(self):
+        result = subprocess.run(
+            self._command("compile"),
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            timeout=COMPILE_TIMEOUT,
+            **self._popen_kwargs(),
+        )
+        self._ok = result.returncode == 0
+        if not self._ok:
+            lines = [line for line in result.stdout.splitlines() if line.strip()]
+            raise RuntimeError("Typst: " + " / ".join(lines[-3:] or ["コンパイルに失敗しました"]))
+
+    def close(self):
+        process = self._process
+        self._process = None
+        if process is not None and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=2)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+class TypstEngine:
+    name = "typst"
+
+    def __init__(self, binary: str = ""):
+        self.binary = binary or find_typst()
+        self._compiler = None
+        self._image_stamp = None
+
+    def available(self) -> bool:
+        return bool(self.binary)
+
+    def _workdir(self) -> str:
+        # 並列バッチでも衝突しないようにプロセスごとに分ける。強制終了で残った他のプロセスの分はここで消す
+        root = cache_dir("typst")
+        if os.name != "nt":
+            for name in os.listdir(root):
+                if name.isdigit() and int(name) != os.getpid() and not _pid_alive(int(name)):
+                    shutil.rmtree(os.path.join(root, name), ignore_errors=True)
+        return cache_dir("typst", str(os.getpid()))
+
+    def _stage_image(self, img_path: str, workdir: str) -> str:
+        if not img_path or not os.path.exists(img_path):
+            return ""
+        src = print_image(img_path, *HEADER_BOX)
+        st = os.stat(src)
+        stamp = (os.path.abspath(src), st.st_mtime_ns, st.st_size)
+        # 画像が変わったら名前も変え、本文 (main.typ) が変わったものとして必ずコンパイルし直させる
+        digest = hashlib.sha1(repr(stamp).encode("utf-8")).hexdigest()[:16]
+        name = f"header-{digest}" + os.path.splitext(src)[1].lower()
+        if stamp != self._image_stamp or not os.path.exists(os.path.join(workdir, name)):
+            shutil.copyfile(src, os.path.join(workdir, name))
+            self._image_stamp = stamp
+        return name
+
+    def _drop_stale_images(self, workdir: str, keep: str):
+        # 古い画像は新しい本文のコンパイルが済んでから消す (watch 中に消すと、そのせいで走るコンパイルを取り違える)
+        for name in os.listdir(workdir):
+            if name.startswith("header-") and name != keep:
+                try:
+                    os.remove(os.path.join(workdir, name))
+                except OSError:
+                    pass
+
+    def export(self, path: str, title: str, text: str, img_path: str = "", parser=None, progress=None, use_cache=True):
+        cache_key = export_key(title, text, img_path, f"typst:{TYPST_STYLE_VERSION}") if use_cache else ""
+        if cache_key and _export_cache.fetch(cache_key, path):
+            return
+        workdir = self._workdir()
+        if self._compiler is None:
+            self._compiler = TypstCompiler(self.binary, workdir)
+        blocks = parser.parse(text) if parser is not None else parse_blocks(text)
+        image_name = self._stage_image(img_path, workdir)
+        source = typst_source(title, blocks, image_name)
+        self._compiler.compile(source, progress)
+        self._drop_stale_images(workdir, image_name)
+        shutil.copyfile(self._compiler.output, path)
+        if cache_key:
+            _export_cache.store(cache_key, path)
+
+    def close(self):
+        if self._compiler is not None:
+            self._compiler.close()
+            shutil.rmtree(self._compiler.workdir, ignore_errors=True)
+            self._compiler = None
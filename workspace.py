@@ -0,0 +1,194 @@
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from blocks import IncrementalBlockParser
+from document import PieceTable
+from history import EditHistory
+from outline import OutlineIndex
+from preview import PreviewEngine
+from toc import TocView
+
+MEMORY_ENV = "SHINOBI_WORKSPACE_MB"
+DEFAULT_MEMORY_MB = 256
+# tracemalloc で測った目安 (解析結果は本文 1 文字あたり、プレビュー・目次はコントロール 1 個あたり)
+PARSED_BYTES_PER_CHAR = 1
+PREVIEW_BYTES_PER_CONTROL = 2100
+TOC_BYTES_PER_ENTRY = 4500
+SEARCH_BYTES_PER_ENTRY = 180
+
+
+def memory_limit_from_env() -> int:
+    try:
+        mb = float(os.environ.get(MEMORY_ENV, "") or DEFAULT_MEMORY_MB)
+    except ValueError:
+        mb = DEFAULT_MEMORY_MB
+    return int(max(mb, 1) * 1024 * 1024)
+
+
+class DocumentView:
+    # 1 プロジェクト分の解析結果・見出し索引・プレビュー・目次。捨てても本文から作り直せる
+
+    def __init__(self, on_jump):
+        self.parser = IncrementalBlockParser()
+        self.outline = OutlineIndex()
+        self.parser.add_listener(self.outline.apply)
+        self.preview = PreviewEngine()
+        self.toc = TocView(self.outline, on_jump)
+        # 検索索引は初めて検索した時に作る (作った後は解析の差分で更新される)
+        self.search = None
+
+    def estimated_bytes(self) -> int:
+        return (
+            self.outline.char_count * PARSED_BYTES_PER_CHAR
+            + len(self.preview.view.controls) * PREVIEW_BYTES_PER_CONTROL
+            + len(self.toc.view.controls) * TOC_BYTES_PER_ENTRY
+            + (self.search.entries * SEARCH_BYTES_PER_ENTRY if self.search is not None else 0)
+        )
+
+
+@dataclass(eq=False)
+class ProjectSession:
+    # タブ 1 つ分。本文は document が正で、入力欄はその全体か section の範囲を映すだけ。
+    # タイトルは表示中のタブだけ入力欄が正で、切り替え時に書き戻す
+    title: str = ""
+    document: PieceTable = field(default_factory=PieceTable)
+    img_path: str = ""
+    path: str = ""
+    journal: object = None
+    # 章単位の編集中は (開始位置, 文字数, 見出し)
+    section: tuple = None
+    history: EditHistory = field(default_factory=EditHistory)
+    # 入力欄との突き合わせ (slice) から edit までと、裏スレッドからの読み書きをまとめて守る
+    lock: object = field(default_factory=threading.RLock, repr=False)
+    # 裏スレッドで読み込み中か。その間に頼まれた保存先は読み終わってから保存する
+    loading: bool = False
+    pending_save: str = ""
+
+    def visible_range(self):
+        if self.section is None:
+            return 0, len(self.document)
+        start, length, _ = self.section
+        return start, start + length
+
+    def text(self) -> str:
+        with self.lock:
+            return self.document.text()
+
+    def edit(self, at: int, deleted: int, inserted: str, typing: bool = False):
+        # at は入力欄 (章単位なら章の先頭) からの位置。typing なら続けて打った文字と 1 つの取り消し単位にまとめる
+        with self.lock:
+            start, _ = self.visible_range()
+            at += start
+            self.history.record(at, self.document.slice(at, at + deleted), inserted, typing)
+            self._replace(at, deleted, inserted)
+
+    def _replace(self, at: int, deleted: int, inserted: str):
+        self.document.apply(at, deleted, inserted)
+        if self.section is not None:
+            section_start, length, title = self.section
+            if section_start <= at and at + deleted <= section_start + length:
+                self.section = (section_start, length + len(inserted) - deleted, title)
+            elif at + deleted <= section_start:
+                self.section = (section_start + len(inserted) - deleted, length, title)
+            else:
+                # 章の境界をまたぐ取り消しなどは章単位をやめる
+                self.section = None
+
+    def undo(self):
+        # 戻した後のカーソル位置 (文書内)。戻す物が無ければ None
+        with self.lock:
+            edit = self.history.undo()
+            if edit is None:
+                return None
+            self._replace(edit.at, len(edit.inserted), edit.deleted)
+            return edit.at + len(edit.deleted)
+
+    def redo(self):
+        with self.lock:
+            edit = self.history.redo()
+            if edit is None:
+                return None
+            self._replace(edit.at, len(edit.deleted), edit.inserted)
+            return edit.at + len(edit.inserted)
+
+    def begin_load(self):
+        with self.lock:
+            self.loading = True
+            self.pending_save = ""
+
+    def hold_save(self, path: str) -> bool:
+        # 読み込み中なら保存先を控えて True。途中までの本文でファイルやジャーナルを作り直さない
+        with self.lock:
+            if not self.loading:
+                return False
+            self.pending_save = path
+            return True
+
+    def finish_load(self) -> str:
+        # 控えていた保存先を返す (無ければ "")
+        with self.lock:
+            self.loading = False
+            path, self.pending_save = self.pending_save, ""
+            return path
+
+    def display_name(self) -> str:
+        if self.path:
+            return os.path.basename(self.path)
+        return self.title or "無題"
+
+
+class Workspace:
+    # 本文はタブを閉じるまで持ち続け、作り直せる DocumentView だけを LRU で上限内に収める
+
+    def __init__(self, make_view, memory_limit: int = 0):
+        self.make_view = make_view
+        self.memory_limit = memory_limit or memory_limit_from_env()
+        self.sessions = []
+        self.active = None
+        self.evictions = 0
+        self._views = OrderedDict()
+
+    def add(self, session: ProjectSession) -> ProjectSession:
+        self.sessions.append(session)
+        return session
+
+    def remove(self, session: ProjectSession):
+        self.sessions.remove(session)
+        self._views.pop(session, None)
+        if self.active is session:
+            self.active = None
+
+    def find(self, path: str):
+        for session in self.sessions:
+            if session.path == path:
+                return session
+        return None
+
+    def view_for(self, session: ProjectSession) -> DocumentView:
+        view = self._views.get(session)
+        if view is None:
+            view = self._views[session] = self.make_view()
+        self._views.move_to_end(session)
+        return view
+
+    def is_cached(self, session: ProjectSession) -> bool:
+        return session in self._views
+
+    def memory_usage(self) -> int:
+        return sum(view.estimated_bytes() for view in self._views.values())
+
+    def trim(self) -> int:
+        # 表示中のタブ以外を古い順に捨てる
+        evicted = 0
+        usage = self.memory_usage()
+        for session in list(self._views):
+            if usage <= self.memory_limit:
+                break
+            if session is self.active:
+                continue
+            usage -= self._views.pop(session).estimated_bytes()
+            evicted += 1
+        self.evictions += evicted
+        return evicted